@@ -0,0 +1,324 @@
+import argparse
+import csv
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from capture import authorization_path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_SCRIPT = os.path.join(BASE_DIR, "initialization.py")
+DRIVER_SCRIPT = os.path.join(BASE_DIR, "qrlogin_process.py")
+
+FLAWS = ["F1", "F2", "F3", "F4", "F5", "F6"]
+RESULT_COLUMNS = ["url", "status", "qrid"] + FLAWS + ["elapsed", "workdir"]
+
+
+def read_targets(path):
+    '''
+    Read the sites to audit, either a csv of domains (e.g. QRlogn_websites.csv) or one URL per line
+    '''
+    targets = []
+    with open(path, "r", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].strip().startswith("#"):
+                continue
+            target = row[0].strip()
+            if target == "File Name":
+                continue
+            if "://" not in target:
+                target = "https://" + target
+            if target not in targets:
+                targets.append(target)
+    return targets
+
+
+def wait_for_port(port, timeout, host="127.0.0.1"):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def parse_result_file(res_file):
+    '''
+    Parse a res_xxx.txt written by the addon into (qrid, [F1..F6])
+    '''
+    if not os.path.exists(res_file):
+        return "", []
+    with open(res_file, "r") as f:
+        lines = f.read().split("\n")
+    qrid = lines[1] if len(lines) > 1 else ""
+    results = lines[4].split() if len(lines) > 4 else []
+    return qrid, results
+
+
+class BatchAuditor:
+    def __init__(self, targets, output_dir, parallel=1, base_proxy_port=7780, base_signal_port=8780,
+                 upstream="http://localhost:7890", config_dir=None, proxy_bin="mitmdump",
+                 startup_timeout=30, detect_timeout=600, shared_proxy=False, headless=False, authorization_dir=None):
+        self.targets = targets
+        self.output_dir = os.path.abspath(output_dir)
+        self.parallel = parallel
+        self.base_proxy_port = base_proxy_port
+        self.base_signal_port = base_signal_port
+        self.upstream = upstream
+        self.config_dir = config_dir
+        self.proxy_bin = proxy_bin
+        self.startup_timeout = startup_timeout
+        self.detect_timeout = detect_timeout
+        self.shared_proxy = shared_proxy
+        self.headless = headless
+        self.authorization_dir = authorization_dir
+
+        # each running audit holds one slot, which owns a proxy port and a signal port
+        self.slots = queue.Queue()
+        for i in range(parallel):
+            self.slots.put(i)
+
+        self.console_lock = threading.Lock()    # one QRLogin prompt on the console at a time
+        self.results_lock = threading.Lock()
+        self.results_file = os.path.join(self.output_dir, "batch_results.csv")
+
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(self.results_file, "w", newline="") as f:
+            csv.writer(f).writerow(RESULT_COLUMNS)
+
+        proxy = None
+        if self.shared_proxy:
+            # one proxy hosts all sessions, listening on one port per slot
+            ports = [self.base_proxy_port + i for i in range(self.parallel)]
+            os.makedirs(os.path.join(self.output_dir, "config"), exist_ok=True)
+            shutil.copy(os.path.join(BASE_DIR, "config", "credential.ini"), os.path.join(self.output_dir, "config", "credential.ini"))
+            proxy = self.start_proxy(self.output_dir, "", self.base_signal_port, ports)
+            if not all(wait_for_port(port, self.startup_timeout) for port in ports):
+                self.stop_proxy(proxy)
+                print("[BATCH] Shared proxy failed to start")
+                return []
+
+        results = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+                futures = [executor.submit(self.audit, url) for url in self.targets]
+                for future in as_completed(futures):
+                    row = future.result()
+                    results.append(row)
+                    self.write_result(row)
+                    print(f"[BATCH] {len(results)}/{len(self.targets)} {row['url']}: {row['status']}")
+        finally:
+            if proxy is not None:
+                self.stop_proxy(proxy)
+        return results
+
+
+    def audit(self, url):
+        slot = self.slots.get()
+        start = time.time()
+        workdir = self.prepare_workdir(url)
+        self.rotate_result_file(url, workdir)
+        row = {"url": url, "status": "error", "qrid": "", "elapsed": "", "workdir": workdir}
+        try:
+            row["status"] = self.run_target(url, workdir, self.base_proxy_port + slot, self.base_signal_port + slot)
+            row["qrid"], results = parse_result_file(self.result_file(url, workdir))
+            row.update(zip(FLAWS, results))
+        except Exception as e:
+            print(f"[BATCH] {url}: {e}")
+        finally:
+            self.slots.put(slot)
+        row["elapsed"] = f"{time.time() - start:.1f}"
+        return row
+
+
+    def prepare_workdir(self, url):
+        '''
+        Each target runs in its own directory holding its config, logs, res and reports
+        '''
+        workdir = os.path.join(self.output_dir, urllib.parse.quote(url, safe=''))
+        os.makedirs(os.path.join(workdir, "config"), exist_ok=True)
+
+        shutil.copy(os.path.join(BASE_DIR, "config", "credential.ini"), os.path.join(workdir, "config", "credential.ini"))
+        shutil.copy(self.find_configuration(url), os.path.join(workdir, "config", "configuration.json"))
+        return workdir
+
+
+    def rotate_result_file(self, url, workdir):
+        '''
+        Move aside the result of an earlier batch, so that only the result of this audit ends waiting for it
+        '''
+        res_file = self.result_file(url, workdir)
+        if os.path.exists(res_file):
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(os.path.getmtime(res_file)))
+            os.replace(res_file, f"{os.path.splitext(res_file)[0]}.{stamp}.txt")
+
+
+    def find_configuration(self, url):
+        '''
+        Per-site configuration is <config_dir>/<domain>.json, falling back to config/configuration.json
+        '''
+        if self.config_dir is not None:
+            domain = urllib.parse.urlparse(url).netloc
+            for name in [domain, domain.removeprefix("www.")]:
+                path = os.path.join(self.config_dir, name + ".json")
+                if os.path.exists(path):
+                    return path
+        return os.path.join(BASE_DIR, "config", "configuration.json")
+
+
+    def find_authorization(self, url, workdir):
+        '''
+        Recorded app authorization request of a site, from authorization_dir or saved by an earlier audit in workdir
+        '''
+        directories = [self.authorization_dir] if self.authorization_dir is not None else []
+        directories.append(os.path.join(self.output_dir if self.shared_proxy else workdir, "captures"))
+        for directory in directories:
+            path = authorization_path(url, directory)
+            if os.path.exists(path):
+                return path
+        return None
+
+
+    def result_file(self, url, workdir):
+        if self.shared_proxy:
+            workdir = self.output_dir
+        return os.path.join(workdir, "res", f"res_{urllib.parse.quote(url, safe='')}.txt")
+
+
+    def start_proxy(self, workdir, url, signal_port, ports):
+        '''
+        Start mitmdump with the addon in workdir, listening on the given ports
+        '''
+        # url must stay the first --set option, the addon reads it from sys.argv[4]
+        proxy_cmd = [self.proxy_bin, "-s", ADDON_SCRIPT, "--set", f"url={url}", "--set", f"signal_port={signal_port}",
+                     "--set", f"config_cache_dir={os.path.join(self.output_dir, 'discovered')}",    # shared by the targets and later batches
+                     "--set", f"knowledge_db={os.path.join(self.output_dir, 'site_knowledge.db')}"]
+        mode = f"upstream:{self.upstream}" if self.upstream else "regular"
+        if len(ports) == 1:
+            proxy_cmd += ["-p", str(ports[0]), "--mode", mode]
+        else:
+            for port in ports:
+                proxy_cmd += ["--mode", f"{mode}@{port}"]
+
+        with open(os.path.join(workdir, "proxy.log"), "w") as proxy_log:
+            return subprocess.Popen(proxy_cmd, cwd=workdir, stdout=proxy_log, stderr=subprocess.STDOUT)
+
+
+    def stop_proxy(self, proxy):
+        proxy.terminate()
+        try:
+            proxy.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proxy.kill()
+
+
+    def run_target(self, url, workdir, proxy_port, signal_port):
+        driver_cmd = [sys.executable, DRIVER_SCRIPT, url, str(signal_port), str(proxy_port)]
+        proxy = None
+        if self.shared_proxy:
+            # the session is named after the proxy port, which the addon maps flows to
+            signal_port = self.base_signal_port
+            driver_cmd = [sys.executable, DRIVER_SCRIPT, url, str(signal_port), str(proxy_port),
+                          "--session", str(proxy_port), "--configuration", os.path.join(workdir, "config", "configuration.json")]
+        else:
+            proxy = self.start_proxy(workdir, url, signal_port, [proxy_port])
+
+        authorization = self.find_authorization(url, workdir)
+        if self.headless:
+            driver_cmd.append("--headless")
+        if authorization is not None:
+            driver_cmd += ["--authorization", authorization]
+
+        with open(os.path.join(workdir, "driver.log"), "w") as driver_log:
+            driver = None
+            try:
+                if proxy is not None and not wait_for_port(proxy_port, self.startup_timeout):
+                    return "proxy-failed"
+
+                driver = subprocess.Popen(driver_cmd, cwd=workdir, stdin=subprocess.PIPE, stdout=driver_log, stderr=subprocess.STDOUT, text=True)
+                if authorization is None and not self.confirm_login(url, driver):
+                    return "driver-failed"
+
+                if not self.wait_for_result(url, workdir):
+                    return "timeout"
+                return "done"
+            finally:
+                if driver is not None:
+                    self.stop_driver(driver)
+                if proxy is not None:
+                    self.stop_proxy(proxy)
+
+
+    def confirm_login(self, url, driver):
+        '''
+        Ask on the console whether the QRLogin of a target is finished, and tell its driver
+        '''
+        with self.console_lock:
+            if driver.poll() is not None:
+                return False
+            input(f"\033[1;32m[{url}] After finishing QRLogin, press Enter to start FLAW DETECTION...\033[0m")
+            driver.stdin.write("\n")
+            driver.stdin.flush()
+        return True
+
+
+    def wait_for_result(self, url, workdir):
+        res_file = self.result_file(url, workdir)
+        deadline = time.time() + self.detect_timeout
+        while time.time() < deadline:
+            if len(parse_result_file(res_file)[1]) == len(FLAWS):
+                return True
+            time.sleep(1)
+        return False
+
+
+    def stop_driver(self, driver):
+        try:
+            if driver.poll() is None:
+                driver.stdin.write("\n")    # "Press Enter to exit..."
+                driver.stdin.flush()
+            driver.wait(timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            driver.kill()
+
+
+    def write_result(self, row):
+        with self.results_lock, open(self.results_file, "a", newline="") as f:
+            csv.DictWriter(f, fieldnames=RESULT_COLUMNS).writerow(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Audit a list of QRLogin websites with QRLChecker")
+    parser.add_argument("targets", help="csv of domains (e.g. QRlogn_websites.csv) or a file with one URL per line")
+    parser.add_argument("-o", "--output-dir", default="batch", help="directory for per-target working directories and batch_results.csv")
+    parser.add_argument("-j", "--parallel", type=int, default=1, help="number of targets audited at the same time")
+    parser.add_argument("--base-proxy-port", type=int, default=7780, help="proxy port of the first slot, slot i listens on base + i")
+    parser.add_argument("--base-signal-port", type=int, default=8780, help="signal port of the first slot, slot i uses base + i")
+    parser.add_argument("--upstream", default="http://localhost:7890", help="upstream proxy, empty for none")
+    parser.add_argument("--config-dir", default=None, help="directory of per-site <domain>.json configurations")
+    parser.add_argument("--proxy-bin", default="mitmdump", help="mitmproxy binary running the addon")
+    parser.add_argument("--startup-timeout", type=int, default=30, help="seconds to wait for the proxy to listen")
+    parser.add_argument("--detect-timeout", type=int, default=600, help="seconds to wait for flaw detection results")
+    parser.add_argument("--shared-proxy", action="store_true", help="audit all targets through one proxy, one session per slot port")
+    parser.add_argument("--headless", action="store_true", help="run the browsers without a window")
+    parser.add_argument("--authorization-dir", default=None, help="directory of recorded app authorization requests (authorization_xxx.mitm), replayed to audit their targets unattended")
+    args = parser.parse_args()
+
+    targets = read_targets(args.targets)
+    print(f"[BATCH] {len(targets)} targets, {args.parallel} in parallel")
+    auditor = BatchAuditor(targets, args.output_dir, args.parallel, args.base_proxy_port, args.base_signal_port,
+                           args.upstream, args.config_dir, args.proxy_bin, args.startup_timeout, args.detect_timeout, args.shared_proxy,
+                           args.headless, args.authorization_dir)
+    auditor.run()
+    print(f"[BATCH] Results are saved in {auditor.results_file}")
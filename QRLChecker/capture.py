@@ -0,0 +1,175 @@
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+
+from mitmproxy import io
+from mitmproxy.io import tnetstring
+
+CAPTURE_DIR = "./captures"
+AUTHORIZATION_METADATA = "qrlchecker_authorization"
+
+
+def capture_paths(url, directory=CAPTURE_DIR):
+    '''
+    Paths of the flow file and event index of the capture of a url
+    '''
+    name = f"capture_{urllib.parse.quote(url, safe='')}"
+    return os.path.join(directory, name + ".mitm"), os.path.join(directory, name + ".jsonl")
+
+
+class CaptureWriter:
+    '''
+    Writes the recorded session incrementally: flows in mitmproxy's flow format (loadable with mitmweb -r),
+    and an index of the request/response events in the order the addon saw them.
+    Like the TrafficLogWriter, the proxy hooks only enqueue a snapshot of the flow, serializing and writing happen on a background thread.
+    '''
+    def __init__(self, url, directory=CAPTURE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.flow_path, self.index_path = capture_paths(url, directory)
+        self.flow_file = open(self.flow_path, "wb")
+        self.index_file = open(self.index_path, "w", encoding="utf-8")
+
+        self.seq = 0
+        self.pending = {}   # flow.id -> flow whose response has not been seen yet
+        self.closed = False
+        self.queue = queue.Queue()     # unbounded, unlike the traffic log a capture must not lose events
+        self.lock = threading.Lock()
+        self.write_index({"url": url, "started": time.time()})
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def write_index(self, entry):
+        self.index_file.write(json.dumps(entry) + "\n")
+
+
+    def add_event(self, flow, flow_type):
+        """
+        Record that the addon saw the request/response of a flow.
+        A flow is written once its response has been seen, with its offset in the index.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            entry = {"seq": self.seq, "id": flow.id, "type": flow_type, "time": time.time()}
+            self.seq += 1
+            if flow_type == "request":
+                self.pending[flow.id] = flow
+                self.queue.put((entry, None))
+            else:
+                self.pending.pop(flow.id, None)
+                self.queue.put((entry, flow.get_state()))
+
+
+    def end_flow(self, flow):
+        """
+        Write a flow whose request was recorded but whose response will not be: dropped by the filter, or failed
+        """
+        with self.lock:
+            if self.closed or self.pending.pop(flow.id, None) is None:
+                return
+            self.queue.put(({"id": flow.id}, request_state(flow)))
+
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            entry, state = item
+            if state is not None:
+                entry["offset"] = self.flow_file.tell()
+                tnetstring.dump(state, self.flow_file)
+            self.write_index(entry)
+            if self.queue.empty():
+                # flushed once the queue is drained, the capture on disk follows the session
+                self.flow_file.flush()
+                self.index_file.flush()
+        self.flow_file.close()
+        self.index_file.close()
+
+
+    def close(self):
+        """
+        Write the flows still waiting for a response and close the capture once the queue is written
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for flow in self.pending.values():
+                self.queue.put(({"id": flow.id}, request_state(flow)))
+            self.pending = {}
+            self.queue.put(None)
+        self.thread.join()
+
+
+def request_state(flow):
+    '''
+    State of a flow without its response, as the addon recorded it
+    '''
+    state = flow.get_state()
+    state["response"] = None
+    return state
+
+
+def authorization_path(url, directory=CAPTURE_DIR):
+    return os.path.join(directory, f"authorization_{urllib.parse.quote(url, safe='')}.mitm")
+
+
+def save_authorization(url, flow, qrid_name, qrid_value, directory=CAPTURE_DIR):
+    '''
+    Save the app authorization request of a QRLogin, with the qrid it authorized, for a ReplayAuthorizer
+    '''
+    os.makedirs(directory, exist_ok=True)
+    flow.metadata[AUTHORIZATION_METADATA] = {"qrid_name": qrid_name, "qrid": qrid_value}
+    path = authorization_path(url, directory)
+    with open(path, "wb") as f:
+        io.FlowWriter(f).add(flow)
+    return path
+
+
+def load_authorization(path):
+    '''
+    Load a saved app authorization request, returning (flow, qrid_name, qrid_value)
+    '''
+    with open(path, "rb") as f:
+        flow = next(iter(io.FlowReader(f).stream()))
+    authorization = flow.metadata.get(AUTHORIZATION_METADATA, {})
+    return flow, authorization.get("qrid_name", ""), authorization.get("qrid", "")
+
+
+def read_capture(flow_path, index_path):
+    '''
+    Load a capture, returning its url and the (flow, flow_type) events in recording order.
+    Flows are returned without their response at their request event, as the addon saw them.
+    '''
+    with open(flow_path, "rb") as f:
+        flows = {flow.id: flow for flow in io.FlowReader(f).stream()}
+
+    url = ""
+    events = []
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if "url" in entry:
+                url = entry["url"]
+            elif "type" in entry and entry["id"] in flows:
+                events.append((flows[entry["id"]], entry["type"]))
+    return url, events
+
+
+def replay_capture(addon, events):
+    '''
+    Feed the events of a capture to the request/response hooks of an addon
+    '''
+    for flow, flow_type in events:
+        if flow_type == "request":
+            response, flow.response = flow.response, None
+            addon.request(flow)
+            flow.response = response
+        else:
+            addon.response(flow)
@@ -2,13 +2,21 @@ from urllib.parse import urlparse
 from components.polling_manager import PollingManager
 from components.qrcode_manager import QRCodeManager
 from components.app_flow_manager import AppFlowManager
+from components.replay_manager import ReplayManager
+from components.cookie_client import CookieClient
+from signal_channel import SignalChannel, DEFAULT_SESSION
 
 
 class Components:
-    def __init__(self, url, logger):
+    def __init__(self, url, logger, session=DEFAULT_SESSION, replay_manager=None, signal_channel=None, cookie_client=None):
         self.url = url
+        self.session = session
         self.domain = ".".join(urlparse(url).netloc.split(":")[0].split(".")[-2:])    
         
         self.polling_manager = PollingManager()
         self.qrcode_manager = QRCodeManager(logger)   # including generation request for QR code
         self.app_flow_manager = AppFlowManager()
+        # sessions hosted by one proxy share the replay manager, signal channel and cookie client
+        self.replay_manager = replay_manager if replay_manager is not None else ReplayManager(logger)
+        self.signal_channel = signal_channel if signal_channel is not None else SignalChannel(logger)
+        self.cookie_client = cookie_client if cookie_client is not None else CookieClient(logger)
@@ -0,0 +1,141 @@
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from mitmproxy.proxy.mode_specs import ProxyMode, UpstreamMode
+
+DEFAULT_TIMEOUT = 10        # seconds to connect and to wait for the response
+DEFAULT_RETRIES = 1
+DEFAULT_POOL_SIZE = 10      # kept-alive connections per host
+POOL_HOSTS = 100            # hosts whose connections are kept
+NO_COOKIES = DefaultCookiePolicy(allowed_domains=[])
+
+
+def upstream_proxy(modes):
+    '''
+    Upstream proxy of the mitmproxy mode option, e.g. upstream:http://localhost:7890, or None
+    '''
+    if isinstance(modes, str):
+        modes = [modes]
+    for spec in modes:
+        try:
+            mode = ProxyMode.parse(spec)
+        except ValueError:
+            continue
+        if isinstance(mode, UpstreamMode):
+            return mode.data
+    return None
+
+
+class CookieClient:
+    '''
+    Pooled HTTP client through which F1 fetches a fresh session cookie from the site, via the upstream proxy of mitmproxy.
+    Connections are kept alive and reused by later fetches, of this session or of others hosted by the proxy;
+    cookies are never kept, so every fetch starts a new session on the site.
+    With http2 the client is an httpx one, if httpx is installed.
+    '''
+    def __init__(self, logger, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, pool_size=DEFAULT_POOL_SIZE, http2=False):
+        self.logger = logger
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.http2 = http2
+        self.proxy = None
+        self.client = None      # created on the first fetch, once the addon options are applied
+        self.backend = None
+        self.lock = threading.Lock()
+
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+
+    def set_retries(self, retries):
+        self.update(retries=retries)
+
+
+    def set_pool_size(self, pool_size):
+        self.update(pool_size=pool_size)
+
+
+    def set_http2(self, http2):
+        self.update(http2=http2)
+
+
+    def set_proxy(self, proxy):
+        self.update(proxy=proxy)
+
+
+    def update(self, **settings):
+        """
+        Change settings of the pool, the next fetch opens a new one
+        """
+        with self.lock:
+            if all(getattr(self, name) == value for name, value in settings.items()):
+                return
+            for name, value in settings.items():
+                setattr(self, name, value)
+            self.close_client()
+
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                self.client, self.backend = self.create_client()
+            return self.client, self.backend
+
+
+    def create_client(self):
+        if self.http2:
+            try:
+                import httpx    # optional, HTTP/2 also needs the h2 package
+                transport = httpx.HTTPTransport(http2=True, retries=self.retries, proxy=self.proxy,
+                                                limits=httpx.Limits(max_connections=self.pool_size * POOL_HOSTS, max_keepalive_connections=self.pool_size))
+                client = httpx.Client(transport=transport, follow_redirects=True, trust_env=self.proxy is None)
+                client.cookies.jar.set_policy(NO_COOKIES)
+                self.logger.info(f"[COOKIE] HTTP/2 client, proxy: {self.proxy}")
+                return client, "httpx"
+            except ImportError:
+                self.logger.info("[COOKIE] httpx[http2] is not installed, fetching cookies over HTTP/1.1")
+
+        session = requests.Session()
+        retry = Retry(total=self.retries, backoff_factor=0.5, status_forcelist=(502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.cookies.set_policy(NO_COOKIES)
+        if self.proxy:
+            session.proxies = {"http": self.proxy, "https": self.proxy}
+        self.logger.info(f"[COOKIE] HTTP/1.1 client, proxy: {self.proxy}")
+        return session, "requests"
+
+
+    def fetch_cookies(self, url):
+        """
+        Cookies set while getting url, redirects included, or None if the site cannot be reached
+        """
+        client, backend = self.get_client()
+        try:
+            response = client.get(url, timeout=self.timeout)
+        except Exception as e:     # requests.RequestException or httpx.HTTPError
+            self.logger.info(f"[COOKIE] Cannot get {url}: {e}")
+            return None
+
+        cookies = {}
+        for r in list(response.history) + [response]:
+            jar = r.cookies.jar if backend == "httpx" else r.cookies
+            cookies.update({c.name: c.value for c in jar})
+        return cookies
+
+
+    def close_client(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+    def close(self):
+        with self.lock:
+            self.close_client()
@@ -8,6 +8,7 @@ class PollingManager:
 
         self.polling_resp_indicator = ""
         self.polling_resp_status = {}
+        self.polling_classifier = None      # PollingClassifier of the polling responses
 
     def set_polling_url(self, url):
         self.polling_url = url
@@ -28,6 +29,9 @@ class PollingManager:
     def set_polling_resp_status(self, status):
         self.polling_resp_status = status
     
+    def set_polling_classifier(self, classifier):
+        self.polling_classifier = classifier
+    
     def clear_polling_flow(self):
         self.polling_flow = None
         self.polling_url = ""
@@ -49,4 +53,7 @@ class PollingManager:
         return self.polling_resp_indicator
     
     def get_polling_resp_status(self):
-        return self.polling_resp_status
\ No newline at end of file
+        return self.polling_resp_status
+
+    def get_polling_classifier(self):
+        return self.polling_classifier
\ No newline at end of file
@@ -0,0 +1,210 @@
+import json
+import os
+import time
+from urllib.parse import urlparse
+
+from endpoint_counter import normalize_endpoint
+from flow_filter import registrable_domain
+from polling_detector import MIN_POLLS
+from utils import *
+
+DEFAULT_CACHE_DIR = "./config/discovered"
+PLACEHOLDER_URL = "https://xxx"     # polling_url of the template config/configuration.json
+QRID_HINTS = ("qr", "uuid", "token", "ticket", "key", "code", "id")
+MIN_QRID_LENGTH = 4
+MAX_CANDIDATE_ENDPOINTS = 5
+
+
+def is_configured(config):
+    '''
+    Whether a configuration names the components of its site, rather than being missing or the template
+    '''
+    return config.get("base", {}).get("polling_url", "") not in ("", PLACEHOLDER_URL)
+
+
+class ConfigCache:
+    '''
+    Discovered configurations, one <registrable domain>.json per site
+    '''
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+
+    def set_cache_dir(self, cache_dir):
+        self.cache_dir = cache_dir
+
+
+    def path(self, url):
+        return os.path.join(self.cache_dir, registrable_domain(urlparse(url).hostname or "") + ".json")
+
+
+    def load(self, url):
+        """
+        The cached configuration of the site of url, or None, also when it was discovered from another site
+        (files cached before the public suffix list keyed sites, e.g. com.tr.json)
+        """
+        try:
+            with open(self.path(url), "r") as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.path(config.get("discovered_from", "")) != self.path(url):
+            return None
+        return config
+
+
+    def save(self, url, config):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(url)
+        with open(path + ".tmp", "w") as f:
+            json.dump(config, f, indent=2)
+        os.replace(path + ".tmp", path)
+        return path
+
+
+class ConfigDiscovery:
+    '''
+    Infers the configuration of a site from its recorded QRLogin traffic.
+    The detection pipeline finds the qrid by matching the params of the decoded QR code with the polling requests;
+    this addon never sees the QR code payload when the app scans it, so the qrid is instead the polling field
+    whose value was created last before polling. The rest follows the pipeline: the polling endpoint is the one
+    spotted by the PollingDetector (or a most requested one), the generation request is the first flow other than polling
+    carrying the qrid, and the authorization request is the app request carrying the qrid.
+    Discovered configurations hold endpoints (URLs without params), which resolve() maps to the URLs of a session.
+    '''
+    def __init__(self, url, traffic_recorder, app_flow_manager, polling_detector, logger):
+        self.url = url
+        self.traffic_recorder = traffic_recorder
+        self.app_flow_manager = app_flow_manager
+        self.polling_detector = polling_detector
+        self.logger = logger
+
+
+    def polling_flows(self, endpoint, method=None):
+        return [flow for flow in self.traffic_recorder.get_endpoint_flows(endpoint)
+                if flow.request.method != "OPTIONS" and (method is None or flow.request.method == method)]
+
+
+    def discover(self):
+        """
+        Returns the discovered configuration, or None
+        """
+        endpoints = []
+        candidate = self.polling_detector.get_candidate()
+        if candidate is not None:
+            endpoints.append((candidate.method, candidate.endpoint))
+        endpoints += [(None, endpoint) for endpoint, count in self.traffic_recorder.top_endpoints(MAX_CANDIDATE_ENDPOINTS)]
+
+        for method, endpoint in endpoints:
+            polls = self.polling_flows(endpoint, method)
+            if len(polls) < MIN_POLLS:
+                continue
+            method = polls[-1].request.method
+            polls = [flow for flow in polls if flow.request.method == method]
+            qrid = self.find_qrid(endpoint, polls[-MIN_POLLS:])
+            if qrid is None:
+                continue
+
+            qrid_name, qrid_value, generation_flow = qrid
+            authorization_flow = self.find_authorization_flow(qrid_value)
+            self.logger.info(f"[CONFIG] Discovered polling {method} {endpoint}, qrid {qrid_name}, generation {generation_flow}, authorization {authorization_flow}")
+            return {
+                "base": {
+                    "qrid_name": qrid_name,
+                    "polling_url": endpoint,
+                    "generation_url": normalize_endpoint(generation_flow.request.url),
+                    "authorization_url": normalize_endpoint(authorization_flow.request.url) if authorization_flow is not None else "",
+                },
+                "methods": {
+                    "polling": method,
+                    "generation": generation_flow.request.method,
+                    "authorization": authorization_flow.request.method if authorization_flow is not None else "",
+                },
+                "discovered_from": self.url,
+                "discovered_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+        return None
+
+
+    def find_qrid(self, endpoint, polls):
+        """
+        (name, value, generation flow) of the polling field created last before polling, or None
+        """
+        parsed = get_parsed_flow(polls[-1], "request")
+        fields = list(parsed.query) + [(k, v) for k, v, unquoted_v in parsed.content_items] + list(parsed.cookie_dict.items())
+        candidates = []
+        for name, value in fields:
+            value = str(value)
+            if len(value) < MIN_QRID_LENGTH or is_timestamp(value):
+                continue
+            if any(field_value(flow, name) != value for flow in polls):
+                continue
+            generation_flow = self.find_generation_flow(endpoint, polls[-1].request.method, value)
+            if generation_flow is None:
+                continue
+            hint = any(h in str(name).lower() for h in QRID_HINTS)
+            candidates.append(((generation_flow.request.timestamp_start, hint, len(value)), name, value, generation_flow))
+        if not candidates:
+            return None
+        rank, name, value, generation_flow = max(candidates, key=lambda c: c[0])
+        return name, value, generation_flow
+
+
+    def find_generation_flow(self, polling_endpoint, polling_method, value):
+        """
+        The first flow, other than polling, whose request or response carries value.
+        As in the pipeline, a request to the polling endpoint with another method may be the generation, e.g. POST then GET /qrcode.
+        """
+        for flow, flow_type in self.traffic_recorder.get_candidate_flows(value):
+            if flow.request.method == "OPTIONS":
+                continue
+            if normalize_endpoint(flow.request.url) == polling_endpoint and flow.request.method == polling_method:
+                continue
+            if search(flow, flow_type, value):
+                return flow
+        return None
+
+
+    def find_authorization_flow(self, qrid_value):
+        for flow, flow_type in self.app_flow_manager.get_candidate_app_flows(qrid_value, "request"):
+            if flow_type == "request" and search(flow, flow_type, qrid_value):
+                return flow
+        return None
+
+
+    def resolve(self, config):
+        """
+        Map a discovered configuration to the URLs requested in this session, in the layout of configuration.json.
+        Returns None when the traffic does not match it: no polling carrying the qrid, or no generation request carrying it.
+        """
+        base = config.get("base", {})
+        methods = config.get("methods", {})
+        qrid_name = base.get("qrid_name", "")
+        polls = self.polling_flows(base.get("polling_url", ""), methods.get("polling"))
+        polls = [flow for flow in polls if field_value(flow, qrid_name) is not None]
+        if len(polls) < 2:
+            return None
+        qrid_value = str(field_value(polls[-1], qrid_name))
+        polling_flow = next(flow for flow in polls if str(field_value(flow, qrid_name)) == qrid_value)
+
+        generations = [flow for flow in self.traffic_recorder.get_endpoint_flows(base.get("generation_url", ""))
+                       if flow.request.method == methods.get("generation", flow.request.method)]
+        generation_flow = next((flow for flow in generations
+                                if search(flow, "request", qrid_value) or (flow.response is not None and search(flow, "response", qrid_value))),
+                               None)
+        if generation_flow is None:
+            return None     # the qrid is now created elsewhere, the configuration is stale
+
+        authorization_url = ""
+        if base.get("authorization_url"):
+            for flow, flow_type in self.app_flow_manager.get_app_flows():
+                if flow_type == "request" and normalize_endpoint(flow.request.url) == base["authorization_url"]:
+                    authorization_url = flow.request.url
+                    if search(flow, flow_type, qrid_value):
+                        break
+
+        resolved = {"base": {"qrid_name": qrid_name, "polling_url": polling_flow.request.url,
+                             "generation_url": generation_flow.request.url, "authorization_url": authorization_url}}
+        if "polling_response_format" in config:
+            resolved["polling_response_format"] = config["polling_response_format"]
+        return resolved
@@ -3,13 +3,13 @@ import string
 import json
 import re
 
-from mitmproxy import ctx
 import configparser
 from urllib.parse import parse_qsl, urlparse, quote
 import urllib
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from utils import *
+from leakage_scanner import LeakageScanner
 from config.flaws_mitigations import flaws, suggestions
 from datetime import datetime
 
@@ -18,6 +18,8 @@ GREEN = "\033[32m"
 YELLOW = "\033[33m"  
 RESET = "\033[0m"
 
+OFFLINE_CHECKS = ["f3", "f4", "f5", "f6"]
+
 class Detector:
     def __init__(self, components, traffic_recorder, logger):
         self.components = components
@@ -28,11 +30,15 @@ class Detector:
         self.polling_manager = self.components.polling_manager
         self.qrcode_manager = self.components.qrcode_manager
         self.app_flow_manager = self.components.app_flow_manager
+        self.replay_manager = self.components.replay_manager
+        self.cookie_client = self.components.cookie_client
+
+        self.leakage_hits = []
 
 
     def is_ready_for_detection(self):
         self.logger.info("Ready for detection? " + str(self.polling_manager.polling_flow) + str(self.qrcode_manager.qrid_value) + str(self.qrcode_manager.create_qrcode_flow_info))
-        if not is_login_done():
+        if not self.components.signal_channel.is_login_done(self.components.session):
             return False
         self.logger.info("login done")
 
@@ -51,25 +57,41 @@ class Detector:
 
 
 
-    def detect(self):
+    def detect(self, offline=False):
+        '''
+        Run the flaw checks, offline only those not replaying flows (F3-F6), F1/F2 are then None
+        '''
         self.logger.info("Start detecting flaw...")
 
-        f1 = self.F1_Unbound_session_id()
+        checks = [
+            ("f1_new_qrid", self.F1_derive_new_qrid, []),
+            ("f1", self.F1_Unbound_session_id, ["f1_new_qrid"]),
+            ("f2", self.F2_Reusable_qrcode, []),
+            ("f3", self.F3_Predictable_qr_id, []),
+            ("f4", self.F4_Controllable_qr_id, []),
+            ("f5", self.F5_Invalid_token_Validation, []),
+            ("f6", self.F6_Sensitive_Data_Leakage, []),
+        ]
+        if offline:
+            checks = [check for check in checks if check[0] in OFFLINE_CHECKS]
+        results = self.run_checks(checks)
+
+        f1 = results.get("f1")
         self.print_log(RED + "Detect flaw F1 unbound sessionid: " + str(f1) + RESET)
 
-        f2 = self.F2_Reusable_qrcode()
+        f2 = results.get("f2")
         self.print_log(RED + "Detect flaw F2 resuable qrcode: " + str(f2) + RESET)
 
-        f3 = self.F3_Predictable_qr_id()
+        f3 = results["f3"]
         self.print_log(RED + "Detect flaw F3 predictable qrid: " + str(f3) + RESET)
         
-        f4 = self.F4_Controllable_qr_id()
+        f4 = results["f4"]
         self.print_log(RED + "Detect flaw F4 controllable qrid: " + str(f4) + RESET)
 
-        f5 = self.F5_Invalid_token_Validation()
+        f5 = results["f5"]
         self.print_log(RED + "Detect flaw F5 invalid token validation: " + str(f5) + RESET)
         
-        f6_data = self.F6_Sensitive_Data_Leakage()
+        f6_data = results["f6"]
         self.print_log(RED + "Detect flaw F6 sensitive data leakage: " + str(f6_data) + RESET)
         f6 = False
         if f6_data:
@@ -77,13 +99,16 @@ class Detector:
         
         res = [f1, f2, f3, f4, f5, f6]
         
-        self.report(res)
+        self.report(res, offline)
         
         return res
 
 
 
-    def F1_Unbound_session_id(self):
+    def F1_derive_new_qrid(self):
+        """
+        F1 step 1: derive a new qrid, by altering a client-generated qrid or replaying the create qrcode request
+        """
         print("======= Start detecting flaw F1: Unbound session_id =======")
         self.logger.info("Start detecting flaw F1: Unbound session_id")
 
@@ -120,23 +145,18 @@ class Detector:
             
 
             newflow2 = flow.copy()
-            try:
-                if self.qrcode_manager.request_cookie_url != "":
-                    response =  requests.get(self.qrcode_manager.request_cookie_url, timeout=10)
-                else:
-                    response = requests.get(self.url, timeout=10)
-            except requests.Timeout:
-                print("Request timeout!")
-                response = None
+            if self.qrcode_manager.request_cookie_url != "":
+                new_cookie = self.cookie_client.fetch_cookies(self.qrcode_manager.request_cookie_url)
+            else:
+                new_cookie = self.cookie_client.fetch_cookies(self.url)
 
 
-            if response is None:
+            if new_cookie is None:
                 cookie_header = ""
             else:
-                resp_cookie = response.cookies
-                new_cookie = {c.name: c.value for c in resp_cookie}
                 cookie_header = "; ".join([f"{name}={value}" for name, value in new_cookie.items()])
             newflow2.request.headers["Cookie"] = cookie_header
+            invalidate_parsed_flow(newflow2)
 
 
             if self.qrcode_manager.get_qrid_newvalue() != "":
@@ -145,22 +165,23 @@ class Detector:
                 qrid_name = self.qrcode_manager.get_qrid_name()
                 newflow2 = self.replace_field(newflow2, old_value, new_value, qrid_name)
             self.qrcode_manager.set_create_qrcode_flow_replay(newflow2)
-            ctx.master.commands.call("replay.client", [newflow2])
+            self.replay_manager.replay(newflow2)
 
         
-        while self.qrcode_manager.get_qrid_newvalue() == "" and self.qrcode_manager.create_qrcode_flow_replay.response is None:
+        if self.qrcode_manager.get_qrid_newvalue() == "":
             print("Waiting for replayed create qrcode request response...")
-            time.sleep(0.5)
+            self.replay_manager.wait(self.qrcode_manager.create_qrcode_flow_replay)
         
 
         if self.qrcode_manager.get_qrid_newvalue() == "" and self.qrcode_manager.create_qrcode_flow_replay.response is not None:
             self.logger.info("[REPLAY]Get response of replayed create qrcode request" + str(self.qrcode_manager.create_qrcode_flow_replay.response))
-            content_dict = parse_content(self.qrcode_manager.create_qrcode_flow_replay.response)
+            parsed_replay = get_parsed_flow(self.qrcode_manager.create_qrcode_flow_replay, "response")
+            content_dict = parsed_replay.content_dict
             self.logger.info("[REPLAY]content_dict: " + str(content_dict))
             self.logger.info("[DETECT]qrid: " + str(self.qrcode_manager.get_qrid_value()))
             qrid_name = self.qrcode_manager.qrid_name_in_creation      
             old_value = self.qrcode_manager.get_qrid_value()
-            content_dict = flatten_nested_dict(content_dict)
+            content_dict = parsed_replay.flatten_dict
             for key, value in content_dict.items():
                 if isinstance(value, dict):
                     for k1, v1 in value.items():
@@ -170,13 +191,26 @@ class Detector:
                     self.qrcode_manager.set_new_qrid(value)
 
             if self.qrcode_manager.get_qrid_newvalue() == "":
-                cookie_dict = parse_cookie(self.qrcode_manager.create_qrcode_flow_replay, "response")
+                cookie_dict = parsed_replay.cookie_dict
                 for key, value in cookie_dict.items():
                         if key == qrid_name and value != old_value:
                             self.qrcode_manager.set_new_qrid(value)
 
             self.logger.info("[REPLAY] Found new qrid: " + str(self.qrcode_manager.get_qrid_newvalue()))
 
+        return True
+
+
+
+    def F1_Unbound_session_id(self, new_qrid_ready=None):
+        """
+        F1 step 2: replay the polling request with the new qrid and check whether it is accepted
+        """
+        if new_qrid_ready is None:
+            new_qrid_ready = self.F1_derive_new_qrid()
+        if not new_qrid_ready:
+            return False
+
         newqrid = self.qrcode_manager.get_qrid_newvalue()
         if newqrid != "" and self.polling_manager.new_polling_flow_replay is None:     
             qrid_name = self.qrcode_manager.get_qrid_name()
@@ -188,20 +222,20 @@ class Detector:
             newpollingflow = self.replace_field(newpollingflow, old_value, new_value, qrid_name)
 
             print("[REPLAY] send replayed polling request")
-            ctx.master.commands.call("replay.client", [newpollingflow])
+            self.replay_manager.replay(newpollingflow)
 
             self.polling_manager.new_polling_flow_replay = newpollingflow
         else:
             self.logger.info("[ERROR] cannot find new qrid value!!")
 
 
-        while self.polling_manager.new_polling_flow_replay is not None and self.polling_manager.new_polling_flow_replay.response is None:
+        if self.polling_manager.new_polling_flow_replay is not None:
             print("Waiting for replayed polling request response...")
-            time.sleep(0.5)
+            self.replay_manager.wait(self.polling_manager.new_polling_flow_replay)
 
         
         if self.polling_manager.new_polling_flow_replay is not None and self.polling_manager.new_polling_flow_replay.response is not None:  
-            status = self.evaluate_polling_response(self.polling_manager.new_polling_flow_replay.response)
+            status = self.evaluate_polling_response(self.polling_manager.new_polling_flow_replay)
             if status == "unscanned":
                 self.logger.info("F1: Unbound session_id exists!")
                 return True
@@ -224,15 +258,14 @@ class Detector:
         if polling_flow_replay is None:
             copy_polling_flow = self.polling_manager.get_polling_flow().copy()
             print("[REPLAY] send replayed copy polling request")
-            ctx.master.commands.call("replay.client", [copy_polling_flow])
+            self.replay_manager.replay(copy_polling_flow)
             polling_flow_replay = copy_polling_flow
 
-        while polling_flow_replay is not None and polling_flow_replay.response is None:
-            print("Waiting for replayed copy polling request response...")
-            time.sleep(0.5)
+        print("Waiting for replayed copy polling request response...")
+        self.replay_manager.wait(polling_flow_replay)
 
         if polling_flow_replay is not None and polling_flow_replay.response is not None:
-            status = self.evaluate_polling_response(polling_flow_replay.response)
+            status = self.evaluate_polling_response(polling_flow_replay)
             if status == "logged-in":
                 self.logger.info("Flaw F2: Reusable qrcode exists!")
                 return True
@@ -277,7 +310,7 @@ class Detector:
                 flow = flow_info[0]
                 flow_type = flow_info[1]
                 if flow_type == "request":
-                    content = decode_content(flow.request.content)
+                    content = get_parsed_flow(flow, "request").text
                     if phone_num in content:
                         self.logger.info("Flaw F5: Invalid token Validation, phone_num")
                         self.logger.info(f"Flaw F5: Invalid token Validation, {str(flow.request.url)}\n{str(content)}")
@@ -295,27 +328,40 @@ class Detector:
     def F6_Sensitive_Data_Leakage(self):
         config = configparser.ConfigParser()
         config.read('./config/credential.ini')      
-        start_search_flag = False
         leaked_info = []
         flows = self.traffic_recorder.get_flows()
-        for field, value in config.items('Credentials'):
-            for flow_info in flows:
-                flow = flow_info[0]
-                flow_type = flow_info[1]
-                if flow_type == "response":     
-                    if flow.request.url == self.polling_manager.get_polling_url(): 
-                        start_search_flag = True
-                    if not start_search_flag:
-                        continue
-
-                    if flow.request.method == "GET" and flow.request.url.endswith(('.jpg', '.png', '.css', '.js')):
-                        continue
-
-                    if search(flow, flow_type, value) != "":
-                        leaked_info.append(field)
-                        self.logger.info(f"Flaw F6: Sensitive Data Leakage, {field}")
-                        self.logger.info(f"Flaw F6: Sensitive Data Leakage, {str(flow.request.url)}\n{str(decode_content(flow.response.content))}")
-                        break
+
+        start_position = None
+        for position, flow_info in enumerate(flows):
+            if flow_info[1] == "response" and flow_info[0].request.url == self.polling_manager.get_polling_url():
+                start_position = position
+                break
+        if start_position is None:
+            return leaked_info
+
+        credentials = dict(config.items('Credentials'))
+        scanner = LeakageScanner(credentials)
+        leaked_fields = set()
+        for flow_info in flows[start_position:]:
+            flow = flow_info[0]
+            flow_type = flow_info[1]
+            if flow_type != "response":
+                continue
+            if flow.request.method == "GET" and flow.request.url.endswith(('.jpg', '.png', '.css', '.js')):
+                continue
+
+            hits = scanner.scan_flow(flow, flow_type)
+            for hit in hits:
+                if hit["masked"]:
+                    self.logger.info(f"[F6] Masked {hit['field']} at {hit['location']}:{hit['offset']}, {hit['url']}")
+                    continue
+                leaked_fields.add(hit["field"])
+                self.logger.info(f"Flaw F6: Sensitive Data Leakage, {hit['field']} ({hit['encoding']}) at {hit['location']}:{hit['offset']}, {hit['url']}")
+            if any(not hit["masked"] for hit in hits):
+                self.logger.info(f"Flaw F6: Sensitive Data Leakage, {str(flow.request.url)}\n{str(get_parsed_flow(flow, flow_type).text)}")
+            self.leakage_hits.extend(hits)
+
+        leaked_info = [field for field in credentials if field in leaked_fields]
         return leaked_info
         
 
@@ -339,37 +385,59 @@ class Detector:
                 cookie_dict[key] = new_value
         new_cookie_header = "; ".join([f"{name}={value}" for name, value in cookie_dict.items()])
         flow.request.headers["Cookie"] = new_cookie_header
+        invalidate_parsed_flow(flow)
         return flow
 
 
+    def run_checks(self, checks):
+        """
+        Run the flaw checks concurrently, each one starting once its dependencies are done.
+        checks: list of (name, check function, dependency names), dependencies listed first
+        Dependency results are passed to the check function as arguments.
+        """
+        futures = {}
+        with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+            for name, check, dependencies in checks:
+                dependency_futures = [futures[dependency] for dependency in dependencies]
+                futures[name] = executor.submit(self.run_check, name, check, dependency_futures)
+        return {name: future.result() for name, future in futures.items()}
+
+
+    def run_check(self, name, check, dependency_futures):
+        args = [future.result() for future in dependency_futures]
+        try:
+            return check(*args)
+        except Exception as e:
+            self.logger.exception(f"[DETECT] check {name} failed: {e}")
+            return False
+
+
     def print_log(self, content):
         print(content)
         self.logger.info(content)
 
 
-    def evaluate_polling_response(self, replay_response):
+    def evaluate_polling_response(self, replay_flow):
         '''
         return the status of polling response
         '''
-        content_dict = parse_content(replay_response)
+        parsed = get_parsed_flow(replay_flow, "response")
+        content_dict = parsed.content_dict
         self.logger.info("\n\n[DETECT]evaluate polling response: " + str(content_dict))
-        if isinstance(content_dict, dict):
-            flatten_dict = flatten_nested_dict(content_dict)
-            for k, v in flatten_dict.items():
-                if k == self.polling_manager.get_polling_resp_indicator():
-                    statuses = self.polling_manager.get_polling_resp_status()
-                    for status, value in statuses.items():
-                        if value == str(v):
-                            self.logger.info("[DETECT]evaluate polling response status: " + status)
-                            return status
+        classifier = self.polling_manager.get_polling_classifier()
+        if isinstance(content_dict, dict) and classifier is not None:
+            status = classifier.classify(parsed.flatten_dict)
+            if status is not None:
+                self.logger.info("[DETECT]evaluate polling response status: " + status)
+            return status
                         
     
-    def report(self, res):
+    def report(self, res, offline=False):
         '''
         output the detection report, including flaws detected and mitigation suggestions
         '''
         os.makedirs("reports", exist_ok=True)
-        report_path = f"reports/report_{urllib.parse.quote(self.url, safe='')}.md"
+        report_path = f"reports/report_{artifact_name(self.url, not offline)}.md"
 
         with open(report_path, "w") as f:
             f.write("# QRLogin Security Detection Report\n")
@@ -0,0 +1,69 @@
+import functools
+import itertools
+import sys
+from utils import *
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_endpoint(url):
+    '''
+    Endpoint of a URL, i.e. the URL without its params; polling requests repeat the same few URLs
+    '''
+    return sys.intern(remove_params_from_url(url))
+
+
+class EndpointCounter:
+    '''
+    Request counts of endpoints, kept ranked as flows arrive, and the request flows of each endpoint.
+    Endpoints with the same count are grouped in a bucket, so counting is O(1) and the
+    most frequent endpoints are read from the highest buckets without sorting the whole table.
+    '''
+    def __init__(self):
+        self.counts = {}        # endpoint -> count
+        self.first_seen = {}    # endpoint -> order of first appearance, breaks ties between equal counts
+        self.buckets = {}       # count -> {endpoint: None}
+        self.flows = {}         # endpoint -> [flow], in recording order
+
+
+    def add(self, url, flow=None):
+        """
+        Count a request to url, recording its flow under the endpoint.
+        Returns the endpoint.
+        """
+        endpoint = normalize_endpoint(url)
+        count = self.counts.get(endpoint, 0)
+        if count == 0:
+            self.first_seen[endpoint] = len(self.first_seen)
+            self.flows[endpoint] = []
+        else:
+            bucket = self.buckets[count]
+            del bucket[endpoint]
+            if not bucket:
+                del self.buckets[count]
+
+        self.counts[endpoint] = count + 1
+        self.buckets.setdefault(count + 1, {})[endpoint] = None
+        if flow is not None:
+            self.flows[endpoint].append(flow)
+        return endpoint
+
+
+    def ranked(self):
+        """
+        Yield (endpoint, count), most frequent first, endpoints with equal counts in order of first appearance
+        """
+        for count in sorted(self.buckets, reverse=True):
+            for endpoint in sorted(self.buckets[count], key=self.first_seen.__getitem__):
+                yield endpoint, count
+
+
+    def top(self, k):
+        return list(itertools.islice(self.ranked(), k))
+
+
+    def get_count(self, url):
+        return self.counts.get(normalize_endpoint(url), 0)
+
+
+    def get_flows(self, url):
+        return self.flows.get(normalize_endpoint(url), [])
@@ -0,0 +1,161 @@
+import collections
+import functools
+import ipaddress
+import re
+from urllib.parse import urlparse
+
+from publicsuffix2 import get_sld     # installed with mitmproxy
+
+FILTER_METADATA = "qrlchecker_filtered"
+
+# static assets never carry a qrid or credentials; images are kept, they may be the QR code
+STATIC_SUFFIX_PATTERN = re.compile(r"\.(?:css|woff2?|ttf|otf|eot|ico|svg|map|mp4|webm|mp3|m4a|ogg)$", re.IGNORECASE)
+STATIC_CONTENT_TYPES = ("text/css", "font/", "application/font", "application/x-font", "image/svg", "image/x-icon",
+                        "image/vnd.microsoft.icon", "video/", "audio/")
+# iframes of first-party pages pointing to another host, e.g. the QR code widget of an SSO domain
+IFRAME_SRC_PATTERN = re.compile(rb"""<iframe\b[^>]*?\ssrc\s*=\s*["']?((?:https?:)?//[^"'\s>]+)""", re.IGNORECASE)
+FRAME_DESTINATIONS = ("iframe", "frame")
+SUMMARY_DOMAINS = 10    # dropped domains listed by summary()
+
+
+@functools.lru_cache(maxsize=4096)
+def registrable_domain(host):
+    '''
+    Registrable domain of a host by the public suffix list, e.g. passport.example.com.cn -> example.com.cn;
+    IP addresses are kept as is, hosts under an unknown suffix keep their last two labels
+    '''
+    host = host.lower().rstrip(".")
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return host
+    except ValueError:
+        pass
+    return get_sld(host, strict=True) or ".".join(host.split(".")[-2:])
+
+
+class FlowFilter:
+    '''
+    Pre-filter applied in the hooks before flows are recorded: keeps the flows of the target's registrable
+    domain, of the extra domains given and of the domains first-party pages navigate to (redirects, pages opened
+    from them), and drops static assets. With learn_frames, the domains of the iframes of first-party pages
+    are kept too, e.g. an SSO QR code widget; ad iframes are then kept as well.
+    Dropped flows are tagged in flow.metadata and counted per reason and domain, not recorded.
+    '''
+    def __init__(self, url, logger, enabled=True, learn_frames=False):
+        self.logger = logger
+        self.enabled = enabled
+        self.learn_frames = learn_frames
+        self.domains = {registrable_domain(urlparse(url).hostname or "")}
+        self.dropped = collections.Counter()    # reason -> flows
+        self.dropped_domains = collections.Counter()    # registrable domain -> dropped flows
+        self.allowed = 0
+
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+
+
+    def set_learn_frames(self, learn_frames):
+        self.learn_frames = learn_frames
+
+
+    def add_domains(self, domains):
+        """
+        Trust more domains: registrable domains, hosts or URLs
+        """
+        for domain in domains:
+            domain = domain.strip()
+            if not domain:
+                continue
+            host = urlparse(domain).hostname if "://" in domain else domain
+            if host:
+                self.domains.add(registrable_domain(host))
+
+
+    def drop(self, flow, reason, domain):
+        flow.metadata[FILTER_METADATA] = reason
+        self.dropped[reason] += 1
+        self.dropped_domains[domain] += 1
+        return False
+
+
+    def allow_request(self, flow):
+        """
+        Whether the request of a flow is recorded
+        """
+        if not self.enabled:
+            return True
+        domain = registrable_domain(flow.request.pretty_host)
+        if domain not in self.domains and not self.learn_initiator(flow, domain):
+            return self.drop(flow, "third-party", domain)
+        if STATIC_SUFFIX_PATTERN.search(flow.request.path.partition("?")[0]):
+            return self.drop(flow, "static", domain)
+        self.allowed += 1
+        return True
+
+
+    def learn_initiator(self, flow, domain):
+        """
+        Trust the domain of a top-level page a first-party page navigates to, or with learn_frames of a frame it loads.
+        Subresource calls (XHR, fetch, beacons) teach nothing, analytics and ads send them with a first-party Origin.
+        """
+        headers = flow.request.headers
+        if not self.is_first_party_url(headers.get("Referer", "")):
+            return False
+        dest = headers.get("Sec-Fetch-Dest", "")
+        if dest == "document" and headers.get("Sec-Fetch-Mode", "") == "navigate":
+            return self.learn(domain, "opened by the target")
+        if self.learn_frames and dest in FRAME_DESTINATIONS:
+            return self.learn(domain, "framed by the target")
+        return False
+
+
+    def is_first_party_url(self, url):
+        host = urlparse(url).hostname if url else None
+        return host is not None and registrable_domain(host) in self.domains
+
+
+    def allow_response(self, flow):
+        """
+        Whether the response of a flow is recorded, learning the SSO domains first-party responses redirect to
+        """
+        if not self.enabled:
+            return True
+        if FILTER_METADATA in flow.metadata:
+            return False
+        if flow.response is None:
+            return True
+        if 300 <= flow.response.status_code < 400:
+            self.learn_url(flow.response.headers.get("Location", ""), "redirected to by the target")
+        content_type = flow.response.headers.get("Content-Type", "").lower()
+        if content_type.startswith(STATIC_CONTENT_TYPES):
+            self.dropped["static-response"] += 1
+            self.dropped_domains[registrable_domain(flow.request.pretty_host)] += 1
+            return False
+        if self.learn_frames and content_type.startswith("text/html"):
+            for match in IFRAME_SRC_PATTERN.finditer(flow.response.content or b""):
+                src = match.group(1).decode("ascii", "replace")
+                self.learn_url(src if "://" in src else "https:" + src, "framed by the target")
+        return True
+
+
+    def learn_url(self, url, reason):
+        host = urlparse(url).hostname
+        if host:
+            self.learn(registrable_domain(host), reason)
+
+
+    def learn(self, domain, reason):
+        if domain not in self.domains:
+            self.domains.add(domain)
+            self.logger.info(f"[FILTER] Trusting {domain}, {reason}")
+        return True
+
+
+    def summary(self):
+        dropped = ", ".join(f"{reason}: {count}" for reason, count in self.dropped.most_common()) or "none"
+        domains = ", ".join(f"{domain}: {count}" for domain, count in self.dropped_domains.most_common(SUMMARY_DOMAINS))
+        if len(self.dropped_domains) > SUMMARY_DOMAINS:
+            domains += f", {len(self.dropped_domains) - SUMMARY_DOMAINS} more"
+        return f"{self.allowed} requests kept, dropped {dropped}" + (f" (per domain: {domains})" if domains else "") + \
+               f"; first-party domains: {sorted(self.domains)}"
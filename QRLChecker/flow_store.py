@@ -0,0 +1,285 @@
+import mmap
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+from mitmproxy import connection, http
+from mitmproxy.coretypes.multidict import MultiDict
+from mitmproxy.net import encoding
+from mitmproxy.net.http import url as url_utils
+from utils import *
+
+STATIC_CONTENT_TYPES = ("image/", "font/", "video/", "audio/", "text/css", "javascript", "application/wasm")
+MAX_RESIDENT_BODY = 512 * 1024              # larger bodies are spilled to the blob file
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024   # bytes of bodies kept in memory
+DEFAULT_SPILL_BUDGET = 1024 * 1024 * 1024   # bytes of bodies spilled to disk, beyond which bodies are dropped
+
+
+class BlobStore:
+    '''
+    Append-only file of spilled bodies, read back through a memory map
+    '''
+    def __init__(self, path, budget=DEFAULT_SPILL_BUDGET):
+        self.path = path
+        self.budget = budget
+        self.size = 0
+        self.file = None
+        self.mmap = None
+        self.lock = threading.Lock()
+
+
+    def put(self, data):
+        """
+        Append data, returning its (offset, length), or None if the spill budget is exhausted
+        """
+        with self.lock:
+            if self.size + len(data) > self.budget:
+                return None
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self.file = open(self.path, "w+b")
+            self.file.seek(self.size)
+            self.file.write(data)
+            self.file.flush()
+            offset = self.size
+            self.size += len(data)
+            return offset, len(data)
+
+
+    def get(self, ref):
+        offset, length = ref
+        if length == 0:
+            return b""
+        with self.lock:
+            if self.mmap is None or len(self.mmap) < offset + length:
+                if self.mmap is not None:
+                    self.mmap.close()
+                self.mmap = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+            return self.mmap[offset:offset + length]
+
+
+    def close(self):
+        with self.lock:
+            if self.mmap is not None:
+                self.mmap.close()
+                self.mmap = None
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class MessageRecord:
+    '''
+    Compact copy of a request/response: headers and raw (still content-encoded) body,
+    which is kept in memory, spilled to a BlobStore or dropped
+    '''
+    __slots__ = ("http_version", "headers", "timestamp_start", "raw", "blob", "blob_store", "dropped")
+
+    def __init__(self, message):
+        self.http_version = message.http_version
+        self.headers = http.Headers(fields=message.headers.fields)
+        self.timestamp_start = message.timestamp_start
+        self.raw = message.raw_content
+        self.blob = None
+        self.blob_store = None
+        self.dropped = False
+
+
+    @property
+    def resident(self):
+        return self.blob is None and not self.dropped
+
+
+    @property
+    def raw_content(self):
+        if self.blob is not None:
+            return self.blob_store.get(self.blob)
+        return self.raw
+
+
+    @property
+    def content(self):
+        raw = self.raw_content
+        content_encoding = self.headers.get("content-encoding")
+        if raw and content_encoding:
+            try:
+                return encoding.decode(raw, content_encoding)
+            except ValueError:
+                return raw
+        return raw
+
+
+    def get_text(self, strict=False):
+        return decode_message(self)
+
+
+    @property
+    def text(self):
+        return self.get_text()
+
+
+class RequestRecord(MessageRecord):
+    __slots__ = ("method", "url")
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.method = sys.intern(request.method)
+        self.url = sys.intern(request.url)    # polling flows repeat the same url
+
+
+    @property
+    def query(self):
+        return MultiDict(url_utils.decode(urlparse(self.url).query))
+
+
+    @property
+    def host(self):
+        return urlparse(self.url).hostname
+
+
+    def to_request(self):
+        request = http.Request.make(self.method, self.url, b"", http.Headers(fields=self.headers.fields))
+        request.http_version = self.http_version
+        if not self.dropped:
+            request.raw_content = self.raw_content
+            request.headers = http.Headers(fields=self.headers.fields)    # make() set content-length to 0
+        return request
+
+
+class ResponseRecord(MessageRecord):
+    __slots__ = ("status_code", "reason")
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.status_code = response.status_code
+        self.reason = response.reason
+
+
+    def to_response(self):
+        response = http.Response.make(self.status_code, b"", http.Headers(fields=self.headers.fields))
+        response.http_version = self.http_version
+        response.reason = self.reason
+        if not self.dropped:
+            response.raw_content = self.raw_content
+            response.headers = http.Headers(fields=self.headers.fields)    # make() set content-length to 0
+        return response
+
+
+class FlowRecord:
+    '''
+    Compact stand-in for a recorded HTTPFlow, exposing the accessors used by the analysis
+    (.id, .request.url/.method/.headers/.content/.query, .response...)
+    '''
+    __slots__ = ("id", "request", "response", "metadata", "peername", "sockname")
+
+    def __init__(self, flow):
+        self.id = flow.id
+        self.request = RequestRecord(flow.request)
+        self.response = None
+        self.metadata = dict(flow.metadata)
+        self.peername = flow.client_conn.peername
+        self.sockname = flow.client_conn.sockname
+
+
+    def copy(self):
+        """
+        Rebuild a full HTTPFlow (with a new id) that can be modified and replayed
+        """
+        request = self.request.to_request()
+        client = connection.Client(peername=self.peername, sockname=self.sockname, timestamp_start=time.time())
+        server = connection.Server(address=(request.host, request.port))
+        flow = http.HTTPFlow(client, server)
+        flow.request = request
+        if self.response is not None:
+            flow.response = self.response.to_response()
+        flow.metadata = dict(self.metadata)
+        return flow
+
+
+    def __repr__(self):
+        status = self.response.status_code if self.response is not None else "-"
+        return f"<FlowRecord {self.request.method} {self.request.url} {status}>"
+
+
+class FlowStore:
+    '''
+    Compact records of the recorded flows, keeping bodies in memory under a byte budget.
+    Static or large bodies and bodies beyond the budget are spilled to a blob file,
+    or dropped when there is no blob file or it is full.
+    '''
+    def __init__(self, spill_path=None, memory_budget=DEFAULT_MEMORY_BUDGET, spill_budget=DEFAULT_SPILL_BUDGET):
+        self.memory_budget = memory_budget
+        self.blob_store = BlobStore(spill_path, spill_budget) if spill_path is not None else None
+        if spill_path is not None and os.path.exists(spill_path):
+            os.remove(spill_path)
+
+        self.records = {}   # flow.id -> FlowRecord
+        self.resident_bytes = 0
+        self.spilled_bytes = 0
+        self.dropped_bytes = 0
+
+
+    def set_memory_budget(self, memory_budget):
+        self.memory_budget = memory_budget
+
+
+    def add(self, flow, flow_type):
+        """
+        Record the request/response of a flow, returning its FlowRecord.
+        The request and response of a flow share one record.
+        """
+        record = self.records.get(flow.id)
+        if record is None:
+            record = FlowRecord(flow)
+            self.records[flow.id] = record
+            self.store_body(record.request, self.parsed_size(flow, "request"))
+        if flow_type == "response" and record.response is None and flow.response is not None:
+            record.response = ResponseRecord(flow.response)
+            self.store_body(record.response, self.parsed_size(flow, "response"))
+
+        message = record.request if flow_type == "request" else record.response
+        if message is not None and not message.resident:
+            invalidate_parsed_flow(flow, flow_type)     # do not keep the text of spilled bodies in the parse cache
+        return record
+
+
+    def parsed_size(self, flow, flow_type):
+        """
+        Size of the cached parsed view of a message, which stays in memory as long as its body does
+        """
+        parsed = parsed_flows.get((flow.id, flow_type))
+        return parsed.size() if parsed is not None else 0
+
+
+    def is_static(self, message):
+        content_type = message.headers.get("Content-Type", "").lower()
+        return any(t in content_type for t in STATIC_CONTENT_TYPES)
+
+
+    def store_body(self, message, parsed_size=0):
+        size = len(message.raw) if message.raw else 0
+        if size == 0:
+            return
+        keep = size <= MAX_RESIDENT_BODY and self.resident_bytes + size + parsed_size <= self.memory_budget
+        if isinstance(message, ResponseRecord) and self.is_static(message):
+            keep = False
+        if keep:
+            self.resident_bytes += size + parsed_size
+            return
+
+        ref = self.blob_store.put(message.raw) if self.blob_store is not None else None
+        if ref is not None:
+            message.blob = ref
+            message.blob_store = self.blob_store
+            self.spilled_bytes += size
+        else:
+            message.dropped = True
+            self.dropped_bytes += size
+        message.raw = None
+
+
+    def close(self):
+        if self.blob_store is not None:
+            self.blob_store.close()
@@ -1,26 +1,59 @@
 import sys
 import time
+LOAD_START = time.perf_counter()    # startup time is reported from the moment the script is loaded
 from config.logger_config import LoggerConfig
 from traffic_recorder import TrafficRecorder
 from components.components import Components
 from detection import Detector
 import threading
 import urllib
+from mitmproxy import ctx
 import os
 from urllib.parse import unquote, urlparse
 from utils import *
+from signal_channel import DEFAULT_SIGNAL_PORT, DEFAULT_SESSION, SignalChannel
+from components.replay_manager import ReplayManager
+from components.cookie_client import DEFAULT_TIMEOUT, DEFAULT_RETRIES, DEFAULT_POOL_SIZE, CookieClient, upstream_proxy
+from flow_store import DEFAULT_MEMORY_BUDGET
+from traffic_log_writer import DEFAULT_MAX_BODY
+from capture import save_authorization
+from flow_filter import FlowFilter
+from polling_classifier import PollingClassifier
+from polling_detector import PollingDetector
+from config_discovery import DEFAULT_CACHE_DIR, ConfigCache, ConfigDiscovery, is_configured
+from site_knowledge import DEFAULT_KNOWLEDGE_DB, SiteKnowledge
+from endpoint_counter import normalize_endpoint
+import shutil
+
+SESSION_HEADER = "X-QRLChecker-Session"
+SESSION_METADATA = "qrlchecker_session"
 
 class Analyzer:
-    def __init__(self, url, debuggable=False):
+    '''
+    Audit session of one target URL, fed with the flows routed to it by the SessionRouter
+    '''
+    def __init__(self, url, debuggable=False, session=DEFAULT_SESSION, replay_manager=None, signal_channel=None, config_file="./config/configuration.json", live=True, cookie_client=None):
         self.debuggable = debuggable
+        self.config_file = config_file
+        self.live = live
 
         self.url = url
+        self.session = session
 
-        self.logger = LoggerConfig(url).get_logger()
+        self.logger = LoggerConfig(url, "" if live else OFFLINE_PREFIX).get_logger()
 
-        self.components = Components(url, self.logger) 
+        self.components = Components(url, self.logger, session, replay_manager, signal_channel, cookie_client)
+        self.signal_channel = self.components.signal_channel
         
-        self.traffic_recorder = TrafficRecorder(url, self.logger, self.debuggable)
+        self.traffic_recorder = TrafficRecorder(url, self.logger, self.debuggable, live=live)
+        self.flow_filter = FlowFilter(url, self.logger)
+        # without a configuration for the site, its configuration is discovered from the traffic or the cache
+        self.polling_detector = PollingDetector(self.logger, warn_after=0)
+        self.config_cache = ConfigCache()
+        self.discovered_config = None
+        self.resolved_config = None
+        self.site_knowledge = SiteKnowledge()
+        self.known_facts = {}
 
         self.polling_manager = self.components.polling_manager
         self.qrcode_manager = self.components.qrcode_manager
@@ -28,20 +61,37 @@ class Analyzer:
         
 
         os.makedirs("res", exist_ok=True)
-        self.res_file = f"./res/res_{urllib.parse.quote(url, safe='')}.txt"
+        self.res_file = f"./res/res_{artifact_name(url, live)}.txt"
 
         self.check()
         self.read_config()
+        self.config_discovery = ConfigDiscovery(url, self.traffic_recorder, self.app_flow_manager, self.polling_detector, self.logger)
         self.detector = Detector(self.components, self.traffic_recorder, self.logger)
         
         self.lock = threading.Lock()
-        threading.Thread(target=self.run_check_done).start()
+        if live:
+            # keep the configuration with the capture for offline re-analysis
+            if os.path.exists(self.config_file):
+                shutil.copy(self.config_file, os.path.splitext(self.traffic_recorder.capture.flow_path)[0] + ".json")
+            threading.Thread(target=self.run_check_done, daemon=True).start()
     
 
     def read_config(self):
-        config = json.load(open("./config/configuration.json", "r"))
+        config = {}
+        if os.path.exists(self.config_file):
+            with open(self.config_file, "r") as f:
+                config = json.load(f)
+        self.auto_config = not is_configured(config)
+        if self.auto_config:
+            self.logger.info(f"[CONFIG] No configuration in {self.config_file}, it will be discovered from the traffic")
+        else:
+            self.apply_config(config)
+
+
+    def apply_config(self, config):
         base_info = config["base"]
-        polling_resp_info = config["polling_response_format"]
+        # without an indicator, the status field of the polling responses is learned from the session
+        polling_resp_info = config.get("polling_response_format", {})
 
         self.qrcode_manager.set_qrid_name(base_info["qrid_name"])
         self.qrcode_manager.set_create_qrcode_url(base_info["generation_url"])
@@ -50,43 +100,116 @@ class Analyzer:
         
         self.app_flow_manager.set_authorization_url(base_info["authorization_url"])
         
-        self.polling_manager.set_polling_resp_indicator(polling_resp_info["indicator"])
-        self.polling_manager.set_polling_resp_status(polling_resp_info["value"])
+        if polling_resp_info.get("indicator"):
+            self.polling_manager.set_polling_resp_indicator(polling_resp_info["indicator"])
+            self.polling_manager.set_polling_resp_status(polling_resp_info["value"])
+            self.polling_manager.set_polling_classifier(PollingClassifier.from_config(polling_resp_info["indicator"], polling_resp_info["value"]))
+
+        # the configured endpoints may be served by another domain than the target, e.g. a passport domain
+        self.flow_filter.add_domains([base_info["polling_url"], base_info["generation_url"]])
 
 
     def check(self):
         os.makedirs("intermediate_files", exist_ok=True)
 
-        if os.path.exists("./intermediate_files/done_flag.txt"):
-            os.remove("./intermediate_files/done_flag.txt")
-
 
     def run_check_done(self):
         '''
-        Check if QRLogin is done and start flaw detection
+        Wait until QRLogin is done and start flaw detection
         '''        
-        wf = open(self.res_file, 'w')
-        write_head = False
-        while True:
-            if is_login_done():
-                self.logger.info("************* is_login_done: True")
-                self.prepare()
-
-                if not write_head:
-                    wf.write(f"qrid: \n{str(self.qrcode_manager.get_qrid_name())}: {str(self.qrcode_manager.get_qrid_value())}\n\n")
-                    wf.write("F1\t\tF2\t\tF3\t\tF4\t\tF5\t\tF6\n")
-                    write_head = True
-
-                res = self.detector.detect()
-                for i in res:
-                    wf.write(str(i) + "\t")
-                wf.write("\n")
-                break
-            time.sleep(3)
+        self.signal_channel.wait_login_done(self.session)
+        self.logger.info("************* is_login_done: True")
+        self.traffic_recorder.close_capture()
+        self.run_detection()
+        self.release()
 
 
-    def load(self, loader):
-        loader.add_option(name = "url", typespec = str, default = "", help = "The URL to analyze")
+    def release(self):
+        """
+        Free the parsed views and indexes of the session's flows, kept in memory by the proxy until it exits
+        """
+        self.traffic_recorder.release()
+        self.app_flow_manager.release()
+
+
+    def run_offline(self):
+        '''
+        Run detection over the flows fed from a capture, without replaying flows
+        '''
+        self.signal_channel.login_event(self.session).set()
+        return self.run_detection(offline=True)
+
+
+    def run_detection(self, offline=False):
+        self.logger.info(f"[FILTER] {self.flow_filter.summary()}")
+        with open(self.res_file, 'w') as wf:
+            self.prepare()
+            if not offline:
+                self.save_authorization()
+            if self.discovered_config is not None and not offline:
+                # the cache is filled by live audits only
+                self.save_discovered_config()
+
+            wf.write(f"qrid: \n{str(self.qrcode_manager.get_qrid_name())}: {str(self.qrcode_manager.get_qrid_value())}\n\n")
+            wf.write("F1\t\tF2\t\tF3\t\tF4\t\tF5\t\tF6\n")
+
+            res = self.detector.detect(offline)
+            for i in res:
+                wf.write(str(i) + "\t")
+            wf.write("\n")
+        if not offline:
+            self.save_site_knowledge(res)
+        return res
+
+
+    def discover_config(self):
+        """
+        Reuse the cached configuration of the site if it matches the traffic, otherwise discover it
+        """
+        cached = self.config_cache.load(self.url)
+        config = self.config_discovery.resolve(cached) if cached is not None else None
+        if config is not None:
+            self.print_log(f"[CONFIG] Reusing the configuration cached in {self.config_cache.path(self.url)}")
+        else:
+            if cached is not None:
+                self.print_log(f"[CONFIG] The cached configuration does not match the traffic, discovering it again")
+            cached = self.config_discovery.discover()
+            config = self.config_discovery.resolve(cached) if cached is not None else None
+            if config is None:
+                self.print_log("[CONFIG] Cannot discover the configuration from the traffic")
+                return
+            self.print_log(f"[CONFIG] Discovered configuration: {cached['base']}")
+        self.discovered_config = cached
+        self.resolved_config = config
+        self.apply_config(config)
+
+
+    def save_discovered_config(self):
+        """
+        Cache the discovered configuration once the components it names were located, with the learned polling statuses
+        """
+        if self.polling_manager.get_polling_flow() is None or self.qrcode_manager.get_create_qrcode_flow_info() is None:
+            self.logger.info("[CONFIG] Discovered configuration not cached, its components were not located")
+            return
+        classifier = self.polling_manager.get_polling_classifier()
+        if classifier is not None:
+            self.discovered_config["polling_response_format"] = self.resolved_config["polling_response_format"] = classifier.to_config()
+        path = self.config_cache.save(self.url, self.discovered_config)
+        self.logger.info(f"[CONFIG] Cached the discovered configuration in {path}")
+        if self.traffic_recorder.capture is not None:
+            # offline re-analysis of the capture uses the URLs of this session
+            with open(os.path.splitext(self.traffic_recorder.capture.flow_path)[0] + ".json", "w") as f:
+                json.dump(self.resolved_config, f, indent=2)
+
+
+    def save_authorization(self):
+        '''
+        Save the app authorization request, which a ReplayAuthorizer replays to audit the site unattended
+        '''
+        login_request = self.app_flow_manager.get_login_request()
+        if login_request and self.qrcode_manager.get_qrid_value():
+            path = save_authorization(self.url, login_request[0][0].copy(), self.qrcode_manager.get_qrid_name(), self.qrcode_manager.get_qrid_value())
+            self.logger.info(f"[APP] Saved authorization request to {path}")
 
 
     def prepare(self):
@@ -96,16 +219,58 @@ class Analyzer:
         2. Finds the request to create a QR code.
         3. Analyzes app flows to find the login request.
         4. Identifies the request to extract cookie.
+        The facts known from earlier audits of the site are used instead of searching when they match the traffic.
         """
         self.logger.info("Starting preparation...")
 
+        self.load_site_knowledge()
+
+        if self.auto_config and self.discovered_config is None:
+            self.discover_config()
+
         self.locate_polling_request_and_qrid()
 
-        self.locate_create_qrcode_request()
+        self.learn_polling_statuses()
+
+        if not self.reuse_known_creation():
+            self.locate_create_qrcode_request()
 
         self.locate_app_authorization_request()
 
-        self.identify_cookie_request()
+        if not self.reuse_known_cookie_source():
+            self.identify_cookie_request()
+
+
+    def load_site_knowledge(self):
+        self.known_facts = self.site_knowledge.load_facts(self.url)
+        if self.known_facts:
+            self.print_log(f"[KNOWLEDGE] Known facts of the site: {self.known_facts}")
+        for audited_at, qrid, results in self.site_knowledge.get_results(self.url, limit=1):
+            self.print_log(f"[KNOWLEDGE] Last audit of the site at {audited_at}: {results}")
+
+
+    def save_site_knowledge(self, res):
+        """
+        Record the facts located by prepare() and the results of the audit
+        """
+        facts = {}
+        polling_flow = self.polling_manager.get_polling_flow()
+        if polling_flow is not None:
+            facts.update(polling_endpoint=normalize_endpoint(polling_flow.request.url), polling_method=polling_flow.request.method,
+                         qrid_name_in_poll=self.qrcode_manager.get_qrid_name())
+        create_qrcode_flow_info = self.qrcode_manager.get_create_qrcode_flow_info()
+        if create_qrcode_flow_info is not None:
+            flow = create_qrcode_flow_info[0]
+            facts.update(generation_endpoint=normalize_endpoint(flow.request.url), generation_method=flow.request.method,
+                         generation_flow_type=create_qrcode_flow_info[1], qrid_name_in_creation=self.qrcode_manager.qrid_name_in_creation)
+        if self.qrcode_manager.get_request_cookie_url() != "":
+            facts["cookie_source_endpoint"] = normalize_endpoint(self.qrcode_manager.get_request_cookie_url())
+        classifier = self.polling_manager.get_polling_classifier()
+        if classifier is not None:
+            facts.update(polling_indicator=classifier.indicator, polling_statuses=classifier.lookup, polling_default=classifier.default)
+        if facts:
+            self.site_knowledge.save_facts(self.url, facts)
+        self.site_knowledge.add_result(self.url, f"{self.qrcode_manager.get_qrid_name()}: {self.qrcode_manager.get_qrid_value()}", res)
 
 
     
@@ -139,6 +304,40 @@ class Analyzer:
 
 
 
+    def learn_polling_statuses(self):
+        """
+        Learn the status field of the polling responses when it is not configured or the configured one is not found
+        """
+        polling_flow = self.polling_manager.get_polling_flow()
+        if polling_flow is None:
+            return
+        responses = [get_parsed_flow(flow, "response").flatten_dict
+                     for flow in self.traffic_recorder.get_endpoint_flows(polling_flow.request.url)
+                     if flow.response is not None and flow.request.url == polling_flow.request.url and flow.request.method == polling_flow.request.method]
+
+        classifier = self.polling_manager.get_polling_classifier()
+        if classifier is not None and classifier.matches(responses):
+            return
+        if classifier is not None:
+            self.print_log(f"************* Configured polling indicator {classifier.indicator} not found in {len(responses)} polling responses")
+
+        if self.known_facts.get("polling_indicator"):
+            known = PollingClassifier(self.known_facts["polling_indicator"], self.known_facts["polling_statuses"],
+                                      self.known_facts.get("polling_default"), learned=True)
+            if known.matches(responses):
+                self.polling_manager.set_polling_classifier(known)
+                self.print_log(f"[KNOWLEDGE] Reusing known polling statuses: {known}")
+                return
+            self.print_log(f"[KNOWLEDGE] Known polling indicator {known.indicator} not found in the polling responses")
+
+        learned = PollingClassifier.learn(responses)
+        if learned is None:
+            self.print_log("************* Cannot learn the status field of the polling responses")
+            return
+        self.polling_manager.set_polling_classifier(learned)
+        self.print_log(f"************* Learned polling statuses: {learned}")
+
+
     def locate_create_qrcode_request(self):
         """
         Find the request to create a QR code based on qrid
@@ -165,6 +364,29 @@ class Analyzer:
                     break
     
     
+    def reuse_known_creation(self):
+        """
+        Take the known create qrcode flow if it carries the qrid in the known field
+        """
+        flow_type = self.known_facts.get("generation_flow_type")
+        qrid_value = self.qrcode_manager.get_qrid_value()
+        if not self.known_facts.get("qrid_name_in_creation") or not qrid_value:
+            return False
+        for flow_info in self.traffic_recorder.get_candidate_flows(qrid_value, flow_type):
+            flow = flow_info[0]
+            if flow_info[1] != flow_type or flow.request.method != self.known_facts.get("generation_method"):
+                continue
+            if flow.request.url != self.qrcode_manager.get_create_qrcode_url():
+                continue
+            if search(flow, flow_type, qrid_value) == self.known_facts["qrid_name_in_creation"]:
+                self.qrcode_manager.set_qrid_name_in_creation(self.known_facts["qrid_name_in_creation"])
+                self.qrcode_manager.set_create_qrcode_flow_info(flow_info)
+                self.print_log(f"[KNOWLEDGE] Reusing known create qrcode flow: {str(flow_info)}")
+                return True
+        self.print_log("[KNOWLEDGE] Known create qrcode flow does not carry the qrid")
+        return False
+
+
     def locate_app_authorization_request(self):
         """
         Find the request to authorize the app
@@ -188,7 +410,7 @@ class Analyzer:
         if create_qrcode_flow_info is not None:
             flow = create_qrcode_flow_info[0]
             flow_type = create_qrcode_flow_info[1]
-            cookie_dict = parse_cookie(flow, "request")
+            cookie_dict = get_parsed_flow(flow, "request").cookie_dict
 
             if cookie_dict != {}:
                 for flow_info in self.traffic_recorder.get_flows():
@@ -197,8 +419,9 @@ class Analyzer:
                     if flow_type == "request":
                         continue
                     has_found = False
+                    headers_str = get_parsed_flow(flow, "response").headers_str
                     for k, v in cookie_dict.items():
-                        if k not in str(flow.response.headers) or v not in str(flow.response.headers):
+                        if k not in headers_str or v not in headers_str:
                             break
                         self.qrcode_manager.set_request_cookie_url(flow.request.url)
                         has_found = True
@@ -208,54 +431,69 @@ class Analyzer:
     
 
 
+    def reuse_known_cookie_source(self):
+        """
+        Take the known endpoint setting the cookie of the create qrcode request if it still sets it
+        """
+        endpoint = self.known_facts.get("cookie_source_endpoint")
+        create_qrcode_flow_info = self.qrcode_manager.get_create_qrcode_flow_info()
+        if not endpoint or create_qrcode_flow_info is None:
+            return False
+        cookie_dict = get_parsed_flow(create_qrcode_flow_info[0], "request").cookie_dict
+        if cookie_dict == {}:
+            return False
+        k, v = next(iter(cookie_dict.items()))
+        for flow, flow_type in self.traffic_recorder.get_candidate_flows(v, "response"):
+            if flow_type != "response" or normalize_endpoint(flow.request.url) != endpoint:
+                continue
+            headers_str = get_parsed_flow(flow, "response").headers_str
+            if k in headers_str and v in headers_str:
+                self.qrcode_manager.set_request_cookie_url(flow.request.url)
+                self.print_log(f"[KNOWLEDGE] Reusing known cookie source: {flow.request.url}")
+                return True
+        return False
+
+
     def locate_field_value(self, flow, flow_type, field):
         """
         Find the value of a field in the request/response
         """
+        parsed = get_parsed_flow(flow, flow_type)
+
         if flow_type == "request":
-            for k, v in flow.request.query.items():
+            for k, v in parsed.query:
                 if field == str(k):
                     return v
-            if field in str(flow.request.url):
+            if field in parsed.url:
                 return "noValue"
             
-            if flow.request.content:
-                content_dict = parse_content(flow.request)
-                if isinstance(content_dict, dict):
-                    flatten_dict = flatten_nested_dict(content_dict)
-                    for k, v in flatten_dict.items():
-                        if field == str(k):
-                            return v
-
-            for k, v in flow.request.headers.items():
+            for k, v in parsed.flatten_dict.items():
+                if field == str(k):
+                    return v
+
+            for k, v in parsed.headers:
                 if k.lower() in ['cookie', 'set-cookie']:
                     continue
                 if field == str(k):
                     return v
-            cookie_dict = parse_cookie(flow, flow_type)
-            for key, value in cookie_dict.items():
+            for key, value in parsed.cookie_dict.items():
                 if str(key) == str(field):
                     return value
     
         if flow_type == "response":
-            if flow.response.content:
-                content_dict = parse_content(flow.response)
-                if isinstance(content_dict, dict):
-                    flatten_dict = flatten_nested_dict(content_dict)
-                    for k, v in flatten_dict.items():
-                        if field == str(k):
-                            return v
-                        elif field == str(unquote(str(k))):
-                            return v
-
-            for k, v in flow.response.headers.items():
+            for k, v in parsed.flatten_dict.items():
+                if field == str(k):
+                    return v
+                elif field == str(unquote(str(k))):
+                    return v
+
+            for k, v in parsed.headers:
                 if field == str(k):
                     print("##############search result in headers(actually):", k)
                     return v
-            for k, v in flow.response.headers.items():
+            for k, v in parsed.headers:
                 if field in str(v):
-                    cookie_dict = parse_cookie(flow, "response")
-                    for key, value in cookie_dict.items():
+                    for key, value in parsed.cookie_dict.items():
                         if field == str(key):
                             print("##############search result in headers(in set-cookie):", key)
                             return value
@@ -268,50 +506,266 @@ class Analyzer:
         self.logger.info(content)
     
 
+    def is_login_done(self):
+        return self.signal_channel.is_login_done(self.session)
+
+
     def request(self, flow):
-        if is_login_done():
+        if self.is_login_done():
             self.traffic_recorder.write_log_request(flow)
             return
         
         if "Android" in flow.request.headers.get('User-Agent', ''):
             self.app_flow_manager.add_app_flow(flow, "request")
+            self.traffic_recorder.capture_event(flow, "request")
             self.traffic_recorder.write_log_request(flow)
             self.logger.info("[APP]Get request of app flow")
             self.logger.info("[APP]Request: " + str(flow.request))  
             return
 
+        if not self.flow_filter.allow_request(flow):
+            return
         self.traffic_recorder.write_log_request(flow)
         self.traffic_recorder.record_flow(flow, "request")
-        url = flow.request.url
-        self.traffic_recorder.update_url_counts(url)
+        if self.auto_config:
+            self.polling_detector.observe_request(flow)
 
 
     def response(self, flow):
-        if is_login_done():
+        if self.is_login_done():
             self.traffic_recorder.write_log_request(flow)
             return
         
         if "Android" in flow.request.headers.get('User-Agent', ''):
             self.app_flow_manager.add_app_flow(flow, "response")
+            self.traffic_recorder.capture_event(flow, "response")
             self.traffic_recorder.write_log_response(flow)
             return
 
+        if not self.flow_filter.allow_response(flow):
+            self.traffic_recorder.end_capture(flow)
+            return
         self.traffic_recorder.write_log_response(flow)
         self.traffic_recorder.record_flow(flow, "response")
+        if self.auto_config:
+            self.polling_detector.observe_response(flow)
 
         if flow.request == self.qrcode_manager.get_create_qrcode_flow_replay():
             self.logger.info("[REPLAY]Get response of replayed create qrcode request" + str(flow.response))
 
         if flow.request == self.polling_manager.get_new_polling_flow_replay():
             self.logger.info("[REPLAY]Get response of replayed polling request" + str(flow.response))
+
+
+    def error(self, flow):
+        self.traffic_recorder.end_capture(flow)
         
 
 
-if len(sys.argv) > 1:
-    url = sys.argv[4][4:]
-    print("url:", url)
-    debuggable = False
-    addons = [
-        Analyzer(url, debuggable)]
-else:
-    print("[!] No url argument provided.")
\ No newline at end of file
+
+class SessionRouter:
+    '''
+    mitmproxy addon routing each flow to the audit session of its target, so that one proxy can audit many sites.
+    A flow belongs to the session named by (in order):
+    1. the X-QRLChecker-Session header injected by the QRLogin driver (stripped before forwarding)
+    2. the proxy auth user (with --set proxyauth=any)
+    3. the session already seen on the same client connection
+    4. the session named after the proxy port the client connected to (with one --mode ...@port per session)
+    5. the only session whose QRLogin is not done yet, e.g. for app flows, otherwise the default session
+    Sessions are started by the QRLogin driver with "start <session> <url> [<configuration.json>]" on the signal channel,
+    which replies "started" once the session routes flows.
+    '''
+    def __init__(self, url="", debuggable=False):
+        self.debuggable = debuggable
+        self.logger = LoggerConfig("sessions").get_logger()
+
+        self.replay_manager = ReplayManager(self.logger)
+        self.signal_channel = SignalChannel(self.logger)
+        self.signal_channel.handlers["start"] = self.on_start
+        self.cookie_client = CookieClient(self.logger)
+
+        self.sessions = {}      # session -> Analyzer
+        self.connections = {}   # client connection id -> session
+        self.memory_budget = DEFAULT_MEMORY_BUDGET
+        self.log_max_body = DEFAULT_MAX_BODY
+        self.log_compress = False
+        self.filter_enabled = True
+        self.filter_frames = False
+        self.first_party_domains = []
+        self.config_cache_dir = DEFAULT_CACHE_DIR
+        self.knowledge_db = DEFAULT_KNOWLEDGE_DB
+        self.lock = threading.Lock()
+
+        if url != "":
+            self.start_session(DEFAULT_SESSION, url)
+
+
+    def start_session(self, session, url, config_file="./config/configuration.json"):
+        with self.lock:
+            if session in self.sessions and not self.sessions[session].is_login_done():
+                self.logger.info(f"[SESSION] Replacing unfinished session {session}: {self.sessions[session].url}")
+                self.sessions[session].traffic_recorder.close_capture()
+                self.sessions[session].release()
+            self.signal_channel.reset_session(session)
+            self.sessions[session] = Analyzer(url, self.debuggable, session, self.replay_manager, self.signal_channel, config_file, cookie_client=self.cookie_client)
+            self.configure_session(self.sessions[session])
+            for conn_id in [c for c, s in self.connections.items() if s == session]:
+                del self.connections[conn_id]
+        self.logger.info(f"[SESSION] Started session {session}: {url}")
+
+
+    def on_start(self, argument):
+        """
+        Start a session, replying once it routes flows
+        """
+        args = argument.split(" ", 2)
+        if len(args) < 2:
+            self.logger.info(f"[SESSION] No url to start session {argument}")
+            return "error: no url"
+        try:
+            self.start_session(*args[:3])
+        except Exception as e:
+            self.logger.info(f"[SESSION] Cannot start session {argument}: {e}")
+            return f"error: {e}"
+        return "started"
+
+
+    def identify_session(self, flow):
+        session = flow.request.headers.pop(SESSION_HEADER, None)
+        if session is None and "proxyauth" in flow.metadata:
+            session = flow.metadata["proxyauth"][0]
+        if session is None:
+            session = self.connections.get(flow.client_conn.id)
+        if session is None and flow.client_conn.sockname:
+            port = str(flow.client_conn.sockname[1])
+            if port in self.sessions:
+                session = port
+        if session is None:
+            pending = [s for s, analyzer in self.sessions.items() if not analyzer.is_login_done()]
+            session = pending[0] if len(pending) == 1 else DEFAULT_SESSION
+        if session in self.sessions:
+            self.connections[flow.client_conn.id] = session
+        return session
+
+
+    def route(self, flow):
+        """
+        Return the session of a flow, replayed flows keep the session of their original
+        """
+        with self.lock:
+            session = flow.metadata.get(SESSION_METADATA)
+            if session is None:
+                session = self.identify_session(flow)
+                flow.metadata[SESSION_METADATA] = session
+            return self.sessions.get(session)
+
+
+    def load(self, loader):
+        loader.add_option(name = "url", typespec = str, default = "", help = "The URL to analyze")
+        loader.add_option(name = "replay_timeout", typespec = int, default = 30, help = "Seconds to wait for the response of a replayed flow")
+        loader.add_option(name = "signal_port", typespec = int, default = DEFAULT_SIGNAL_PORT, help = "Local port on which the QRLogin driver signals the addon")
+        loader.add_option(name = "flow_memory_budget", typespec = int, default = DEFAULT_MEMORY_BUDGET // (1024 * 1024), help = "MB of recorded bodies kept in memory, further bodies are spilled to disk")
+        loader.add_option(name = "traffic_log_max_body", typespec = int, default = DEFAULT_MAX_BODY, help = "Bytes of each body written to the traffic log (debuggable mode)")
+        loader.add_option(name = "traffic_log_gzip", typespec = bool, default = False, help = "Compress the traffic log (debuggable mode)")
+        loader.add_option(name = "first_party_filter", typespec = bool, default = True, help = "Only record the flows of the target's domains, without static assets")
+        loader.add_option(name = "first_party_frames", typespec = bool, default = False, help = "Also record the flows of the domains framed by the target's pages, e.g. an SSO QR code iframe")
+        loader.add_option(name = "first_party_domains", typespec = str, default = "", help = "Comma-separated domains recorded along with the target's, e.g. its SSO domain")
+        loader.add_option(name = "config_cache_dir", typespec = str, default = DEFAULT_CACHE_DIR, help = "Directory of the configurations discovered for sites without one")
+        loader.add_option(name = "cookie_timeout", typespec = int, default = DEFAULT_TIMEOUT, help = "Seconds to wait for the site when F1 fetches a fresh session cookie")
+        loader.add_option(name = "cookie_retries", typespec = int, default = DEFAULT_RETRIES, help = "Retries of a failed fetch of a fresh session cookie")
+        loader.add_option(name = "cookie_pool_size", typespec = int, default = DEFAULT_POOL_SIZE, help = "Connections kept alive per host for fetching fresh session cookies")
+        loader.add_option(name = "cookie_http2", typespec = bool, default = False, help = "Fetch fresh session cookies over HTTP/2, needs httpx[http2]")
+        loader.add_option(name = "knowledge_db", typespec = str, default = DEFAULT_KNOWLEDGE_DB, help = "SQLite database of what earlier audits learned about each site, empty to disable")
+
+
+    def configure(self, updated):
+        if "replay_timeout" in updated:
+            self.replay_manager.set_timeout(ctx.options.replay_timeout)
+        if "flow_memory_budget" in updated:
+            self.memory_budget = ctx.options.flow_memory_budget * 1024 * 1024
+        if "traffic_log_max_body" in updated:
+            self.log_max_body = ctx.options.traffic_log_max_body
+        if "traffic_log_gzip" in updated:
+            self.log_compress = ctx.options.traffic_log_gzip
+        if "first_party_filter" in updated:
+            self.filter_enabled = ctx.options.first_party_filter
+        if "first_party_frames" in updated:
+            self.filter_frames = ctx.options.first_party_frames
+        if "first_party_domains" in updated:
+            self.first_party_domains = ctx.options.first_party_domains.split(",")
+        if "config_cache_dir" in updated:
+            self.config_cache_dir = ctx.options.config_cache_dir
+        if "knowledge_db" in updated:
+            self.knowledge_db = ctx.options.knowledge_db
+        if "cookie_timeout" in updated:
+            self.cookie_client.set_timeout(ctx.options.cookie_timeout)
+        if "cookie_retries" in updated:
+            self.cookie_client.set_retries(ctx.options.cookie_retries)
+        if "cookie_pool_size" in updated:
+            self.cookie_client.set_pool_size(ctx.options.cookie_pool_size)
+        if "cookie_http2" in updated:
+            self.cookie_client.set_http2(ctx.options.cookie_http2)
+        if "mode" in updated:
+            self.cookie_client.set_proxy(upstream_proxy(ctx.options.mode))     # fetched through the upstream of mitmproxy
+        for analyzer in self.sessions.values():
+            self.configure_session(analyzer)
+
+
+    def configure_session(self, analyzer):
+        analyzer.traffic_recorder.flow_store.set_memory_budget(self.memory_budget)
+        analyzer.traffic_recorder.log_writer.set_max_body(self.log_max_body)
+        analyzer.traffic_recorder.log_writer.set_compress(self.log_compress)
+        analyzer.flow_filter.set_enabled(self.filter_enabled)
+        analyzer.flow_filter.set_learn_frames(self.filter_frames)
+        analyzer.flow_filter.add_domains(self.first_party_domains)
+        analyzer.config_cache.set_cache_dir(self.config_cache_dir)
+        analyzer.site_knowledge.set_path(self.knowledge_db)
+
+
+    def running(self):
+        self.signal_channel.start(ctx.options.signal_port)
+        self.logger.info(f"[STARTUP] Addon running {time.perf_counter() - LOAD_START:.2f}s after the script was loaded")
+
+
+    def done(self):
+        self.signal_channel.stop()
+        self.cookie_client.close()
+        for analyzer in self.sessions.values():
+            analyzer.traffic_recorder.close_capture()
+            analyzer.traffic_recorder.close_log()
+
+
+    def request(self, flow):
+        analyzer = self.route(flow)
+        if analyzer is not None:
+            analyzer.request(flow)
+
+
+    def response(self, flow):
+        if self.replay_manager.resolve(flow):
+            self.logger.info("[REPLAY]Replayed flow completed: " + str(flow.request.url))
+
+        analyzer = self.route(flow)
+        if analyzer is not None:
+            analyzer.response(flow)
+
+
+    def error(self, flow):
+        if self.replay_manager.resolve(flow):
+            self.logger.info("[REPLAY]Replayed flow failed: " + str(flow.error))
+
+        analyzer = self.route(flow)
+        if analyzer is not None:
+            analyzer.error(flow)
+
+
+
+if __name__.startswith("__mitmproxy_script__"):     # loaded by mitmproxy, not imported for offline analysis
+    if len(sys.argv) > 1:
+        url = sys.argv[4][4:]
+        print("url:", url)
+        debuggable = False
+        addons = [
+            SessionRouter(url, debuggable)]
+    else:
+        print("[!] No url argument provided.")
\ No newline at end of file
@@ -0,0 +1,35 @@
+import argparse
+import os
+
+from initialization import Analyzer
+from capture import CAPTURE_DIR, capture_paths, read_capture, replay_capture
+
+
+def analyze_capture(url, capture_dir=CAPTURE_DIR, config_file=None):
+    '''
+    Rebuild the analysis state from a capture and run detection without proxy or browser
+    '''
+    flow_path, index_path = capture_paths(url, capture_dir)
+    capture_url, events = read_capture(flow_path, index_path)
+    print(f"Loaded {len(events)} events of {capture_url} from {flow_path}")
+
+    if config_file is None:
+        # the configuration saved with the capture, unless another one is given
+        config_file = os.path.splitext(flow_path)[0] + ".json"
+        if not os.path.exists(config_file):
+            config_file = "./config/configuration.json"
+
+    analyzer = Analyzer(capture_url or url, config_file=config_file, live=False)
+    replay_capture(analyzer, events)
+    return analyzer.run_offline()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run flaw detection (F3-F6) over a captured QRLogin session")
+    parser.add_argument("urls", nargs="+", help="URLs whose captures are analyzed")
+    parser.add_argument("--capture-dir", default=CAPTURE_DIR, help="directory of the captures")
+    parser.add_argument("--configuration", default=None, help="configuration.json overriding the one saved with the capture")
+    args = parser.parse_args()
+
+    for url in args.urls:
+        analyze_capture(url, args.capture_dir, args.configuration)
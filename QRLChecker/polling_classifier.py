@@ -0,0 +1,94 @@
+import collections
+from utils import is_timestamp
+
+MISSING = "<missing>"       # value of a status field absent from a response
+MAX_STATES = 5              # max distinct values of a status field
+MAX_VALUE_LENGTH = 32
+MIN_PRESENCE = 0.5          # min share of the polling responses holding a status field
+STATUS_HINTS = ("status", "state", "code", "ret", "result", "stat")
+
+
+def status_value(flatten_dict, indicator):
+    value = flatten_dict.get(indicator, MISSING)
+    return value if isinstance(value, str) else str(value)
+
+
+class PollingClassifier:
+    '''
+    Maps a polling response to unscanned / scanned / logged-in / invalid with a dict probe on one field,
+    the indicator, either configured (configuration.json) or learned from the polling responses of the session
+    '''
+    def __init__(self, indicator, lookup, default=None, learned=False):
+        self.indicator = indicator
+        self.lookup = lookup        # indicator value -> status
+        self.default = default      # status of the values never seen
+        self.learned = learned
+
+
+    @classmethod
+    def from_config(cls, indicator, statuses):
+        return cls(indicator, {str(value): status for status, value in statuses.items()})
+
+
+    @classmethod
+    def learn(cls, responses):
+        """
+        Learn the status field from the flattened polling responses recorded until QRLogin was done:
+        a short, low-cardinality field whose first value is unscanned and whose last value is logged-in.
+        Values in between are scanned, or invalid when the first value comes back after them (the QR code was refreshed).
+        Returns None when no field qualifies.
+        """
+        if len(responses) < 2:
+            return None
+        presence = collections.Counter(k for response in responses for k in response)
+        best, best_score = None, None
+        for key, count in presence.items():
+            if count < MIN_PRESENCE * len(responses):
+                continue
+            values = [status_value(response, key) for response in responses]
+            distinct = set(values)
+            if values[0] == values[-1] or len(distinct) > MAX_STATES:
+                continue
+            if any(len(v) > MAX_VALUE_LENGTH or is_timestamp(v) for v in distinct):
+                continue
+            runs = [v for i, v in enumerate(values) if i == 0 or v != values[i - 1]]
+            score = (any(hint in str(key).lower() for hint in STATUS_HINTS), len(runs) == len(distinct), -len(distinct), count)
+            if best_score is None or score > best_score:
+                best, best_score = (key, values), score
+        if best is None:
+            return None
+
+        key, values = best
+        first, last = values[0], values[-1]
+        lookup = {first: "unscanned", last: "logged-in"}
+        for i, value in enumerate(values):
+            if value not in lookup:
+                lookup[value] = "invalid" if first in values[i + 1:] else "scanned"
+        # a replay answered with a state never seen before the login is not accepted by the site
+        return cls(key, lookup, default="invalid", learned=True)
+
+
+    def matches(self, responses):
+        """
+        Whether the indicator holds one of the known values in some of the responses
+        """
+        return any(status_value(response, self.indicator) in self.lookup for response in responses)
+
+
+    def to_config(self):
+        """
+        The polling_response_format of configuration.json, one value per status
+        """
+        statuses = {}
+        for value, status in self.lookup.items():
+            statuses.setdefault(status, value)
+        return {"indicator": self.indicator, "value": statuses}
+
+
+    def classify(self, flatten_dict):
+        return self.lookup.get(status_value(flatten_dict, self.indicator), self.default)
+
+
+    def __repr__(self):
+        source = "learned" if self.learned else "configured"
+        return f"<PollingClassifier {source} {self.indicator}: {self.lookup}>"
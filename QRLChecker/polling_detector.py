@@ -0,0 +1,167 @@
+import collections
+import statistics
+import threading
+from endpoint_counter import normalize_endpoint
+from utils import *
+
+MIN_POLLS = 4               # requests to an endpoint before judging whether it is polled
+MAX_INTERVAL_CV = 0.5       # max coefficient of variation of the intervals of a polled endpoint
+POLL_INTERVAL_RANGE = (0.2, 10)     # seconds between two polls
+MIN_SIMILARITY = 0.5        # min share of request fields unchanged between two polls
+MIN_RESPONSE_SIMILARITY = 0.8       # min share of response fields (keys) shared between two polls
+DEFAULT_WARN_AFTER = 60     # seconds of traffic without polling before warning
+
+
+def field_similarity(previous, current):
+    '''
+    Share of the fields of two messages that are unchanged, 1 when both have none
+    '''
+    fields = previous.keys() | current.keys()
+    if not fields:
+        return 1.0
+    return sum(1 for k in fields if previous.get(k) == current.get(k)) / len(fields)
+
+
+def key_similarity(previous, current):
+    keys = previous | current
+    if not keys:
+        return 1.0
+    return len(previous & current) / len(keys)
+
+
+class EndpointStats:
+    '''
+    Timing and content of the recent requests to one (method, endpoint)
+    '''
+    __slots__ = ("method", "endpoint", "count", "last_time", "intervals", "last_fields", "similarities",
+                 "changing_fields", "constant_fields", "last_response_keys", "response_similarities")
+
+    def __init__(self, method, endpoint, window=8):
+        self.method = method
+        self.endpoint = endpoint
+        self.count = 0
+        self.last_time = None
+        self.intervals = collections.deque(maxlen=window)
+        self.last_fields = None
+        self.similarities = collections.deque(maxlen=window)
+        self.changing_fields = set()
+        self.constant_fields = None
+        self.last_response_keys = None
+        self.response_similarities = collections.deque(maxlen=window)
+
+
+    def add_request(self, timestamp, fields):
+        self.count += 1
+        if self.last_time is not None:
+            self.intervals.append(timestamp - self.last_time)
+        self.last_time = timestamp
+
+        if self.last_fields is not None:
+            self.similarities.append(field_similarity(self.last_fields, fields))
+            changed = {k for k in self.last_fields.keys() | fields.keys() if self.last_fields.get(k) != fields.get(k)}
+            self.changing_fields |= changed
+            self.constant_fields = (self.constant_fields if self.constant_fields is not None else set(fields)) - changed
+        self.last_fields = fields
+
+
+    def add_response(self, keys):
+        if self.last_response_keys is not None:
+            self.response_similarities.append(key_similarity(self.last_response_keys, keys))
+        self.last_response_keys = keys
+
+
+    def is_polled(self):
+        if self.count < MIN_POLLS or len(self.intervals) < MIN_POLLS - 1:
+            return False
+        mean = statistics.fmean(self.intervals)
+        if not POLL_INTERVAL_RANGE[0] <= mean <= POLL_INTERVAL_RANGE[1]:
+            return False
+        if statistics.pstdev(self.intervals) / mean > MAX_INTERVAL_CV:
+            return False
+        if statistics.fmean(self.similarities) < MIN_SIMILARITY:
+            return False
+        return not self.response_similarities or statistics.fmean(self.response_similarities) >= MIN_RESPONSE_SIMILARITY
+
+
+    def __repr__(self):
+        interval = statistics.fmean(self.intervals) if self.intervals else 0
+        return (f"<{self.method} {self.endpoint} x{self.count} every {interval:.2f}s, "
+                f"constant: {sorted(self.constant_fields or [])}, changing: {sorted(self.changing_fields)}>")
+
+
+class PollingDetector:
+    '''
+    Spots the polling request while traffic flows: an endpoint requested at a regular interval
+    with nearly the same request and response each time.
+    Its constant fields are the qrid candidates, its changing fields are timestamps, nonces, etc.
+    Warns when no polling is seen after warn_after seconds of traffic.
+    '''
+    def __init__(self, logger, warn_after=DEFAULT_WARN_AFTER):
+        self.logger = logger
+        self.warn_after = warn_after
+        self.stats = {}         # (method, endpoint) -> EndpointStats
+        self.candidate = None   # EndpointStats of the likely polling endpoint
+        self.timer = None
+        self.lock = threading.Lock()
+
+
+    def set_warn_after(self, warn_after):
+        self.warn_after = warn_after
+
+
+    def observe_request(self, flow):
+        if flow.request.method == "OPTIONS":
+            return
+        parsed = get_parsed_flow(flow, "request")
+        fields = dict(parsed.query)
+        fields.update((k, v) for k, v, unquoted_v in parsed.content_items)
+
+        key = (flow.request.method, normalize_endpoint(flow.request.url))
+        with self.lock:
+            if self.timer is None and self.warn_after > 0:
+                self.timer = threading.Timer(self.warn_after, self.warn_no_polling)
+                self.timer.daemon = True
+                self.timer.start()
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = EndpointStats(*key)
+                self.stats[key] = stats
+            stats.add_request(flow.request.timestamp_start, fields)
+            self.update_candidate(stats)
+
+
+    def observe_response(self, flow):
+        key = (flow.request.method, normalize_endpoint(flow.request.url))
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None or flow.response is None:
+                return
+            stats.add_response({k for k, v, unquoted_v in get_parsed_flow(flow, "response").flatten_items})
+
+
+    def update_candidate(self, stats):
+        if stats is self.candidate or not stats.is_polled():
+            return
+        if self.candidate is not None and self.candidate.count >= stats.count and self.candidate.is_polled():
+            return
+        self.candidate = stats
+        self.logger.info(f"[POLLING] Likely polling endpoint: {stats}")
+
+
+    def get_candidate(self):
+        with self.lock:
+            if self.candidate is not None and self.candidate.is_polled():
+                return self.candidate
+            return None
+
+
+    def warn_no_polling(self):
+        if self.get_candidate() is None:
+            print(f"[WARNING] No polling request seen after {self.warn_after}s, is the QR code displayed?")
+            self.logger.info(f"[POLLING] No polling request seen after {self.warn_after}s")
+
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
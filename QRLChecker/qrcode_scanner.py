@@ -0,0 +1,86 @@
+import base64
+import time
+
+MIN_QRCODE_SIZE = 80         # px, smaller elements are not scanned
+FAST_DECODE_SIZE = 400       # px, images are first decoded downscaled to this size
+
+# elements that may show a QR code: visible, roughly square <img>, <canvas> and <svg>,
+# with the data URL of their image when it can be read from the page
+QR_CANDIDATES_SCRIPT = """
+var minSize = arguments[0];
+var candidates = [];
+document.querySelectorAll('img, canvas, svg').forEach(function (e) {
+    var r = e.getBoundingClientRect();
+    if (r.width < minSize || r.height < minSize || r.width > 1.5 * r.height || r.height > 1.5 * r.width) return;
+    var style = window.getComputedStyle(e);
+    if (style.visibility === 'hidden' || style.display === 'none' || style.opacity === '0') return;
+    var data = null;
+    if (e.tagName === 'IMG' && e.src.startsWith('data:image/') && !e.src.startsWith('data:image/svg')) data = e.src;
+    if (e.tagName === 'CANVAS') { try { data = e.toDataURL('image/png'); } catch (err) {} }
+    candidates.push([e, data]);
+});
+return candidates;
+"""
+
+
+def find_page_qrcode_images(driver):
+    '''
+    Yield (candidate, image bytes) of the elements that may show a QR code, in the page and its iframes
+    '''
+    driver.switch_to.window(driver.window_handles[-1])
+    driver.switch_to.default_content()
+    frames = [None] + driver.find_elements("tag name", "iframe")
+    for i, frame in enumerate(frames):
+        if frame is not None:
+            driver.switch_to.default_content()
+            driver.switch_to.frame(frame)
+        for j, (element, data_url) in enumerate(driver.execute_script(QR_CANDIDATES_SCRIPT, MIN_QRCODE_SIZE)):
+            if data_url:
+                yield (i, j), base64.b64decode(data_url.split(",", 1)[1])
+            else:
+                yield (i, j), element.screenshot_as_png    # cropped to the element
+    driver.switch_to.default_content()
+
+
+def decode_image(data, fast_size=FAST_DECODE_SIZE):
+    '''
+    Decode the largest QR code of an encoded image, first downscaled, then at full size with a quiet zone added
+    '''
+    import cv2
+    import numpy as np
+    from pyzbar.pyzbar import decode
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+
+    passes = [image, cv2.copyMakeBorder(image, 16, 16, 16, 16, cv2.BORDER_CONSTANT, value=255)]
+    scale = fast_size / max(image.shape[:2])
+    if scale < 1:
+        passes.insert(0, cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+    for candidate in passes:
+        decoded_objects = decode(candidate)
+        if decoded_objects:
+            largest_qr = max(decoded_objects, key=lambda x: x.rect[2] * x.rect[3])
+            return largest_qr.data.decode("utf-8", "replace")
+
+    decoded_data = cv2.QRCodeDetector().detectAndDecode(passes[-1])[0]
+    return decoded_data or None
+
+
+def wait_for_qrcode(driver, timeout, poll_interval=1):
+    '''
+    Scan the page until a QR code is decoded, returning its payload, or None after timeout seconds
+    '''
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            for key, image in find_page_qrcode_images(driver):
+                decoded_data = decode_image(image)
+                if decoded_data:
+                    return decoded_data
+        except Exception as e:
+            # the page may navigate or re-render while it is scanned
+            print(f"Error when scanning the page for QR codes: {e}")
+        time.sleep(poll_interval)
+    return None
@@ -1,30 +1,57 @@
-
-import sys
+import argparse
 from config.webdriver_config import configure_webdriver
-import cv2
+from signal_channel import DEFAULT_SIGNAL_PORT, send_signal, request_signal
+from authorizer import ManualAuthorizer, ReplayAuthorizer
+
+SESSION_HEADER = "X-QRLChecker-Session"
 
 
 class QRCodeHandler:
-    def __init__(self, proxy_server="localhost:7778"):
-        self.driver = configure_webdriver(proxy_server)
+    def __init__(self, proxy_server="localhost:7778", signal_port=DEFAULT_SIGNAL_PORT, session=None, session_header=False,
+                 headless=False, authorizer=None):
+        self.signal_port = signal_port
+        self.session = session
+        self.authorizer = authorizer if authorizer is not None else ManualAuthorizer()
+        extra_headers = {SESSION_HEADER: session} if session is not None and session_header else None
+        self.driver = configure_webdriver(proxy_server, extra_headers, headless)
 
-    def perform_qr_login(self, url):
+    def perform_qr_login(self, url, config_file=None):
+        if self.session is not None:
+            # a proxy shared by several audits starts a session for this url, flows sent before it started would be lost
+            reply = request_signal(" ".join(["start", self.session, url] + ([config_file] if config_file else [])), self.signal_port)
+            if reply != "started":
+                print(f"[ERROR] Session {self.session} was not started: {reply}")
+                self.driver.quit()
+                return
         self.driver.get(url)
 
-        input("\033[1;32mAfter finishing QRLogin, press Enter to start FLAW DETECTION...\033[0m")
-        with open('./intermediate_files/done_flag.txt', 'w') as f:
-            f.write('1')
+        if not self.authorizer.authorize(self.driver):
+            print("[ERROR] QRLogin was not authorized")
+        send_signal("done" if self.session is None else f"done {self.session}", self.signal_port)
 
-        input("\033[1;32mPress Enter to exit...\033[0m")
+        if self.authorizer.interactive:
+            input("\033[1;32mPress Enter to exit...\033[0m")
         self.driver.quit()
 
    
     
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        url = sys.argv[1]
-        print("url:", url)
-        qrcode_handler = QRCodeHandler()
-        qrcode_handler.perform_qr_login(url)
-    else:
-        print("No url argument provided.")
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url")
+    parser.add_argument("signal_port", nargs="?", type=int, default=DEFAULT_SIGNAL_PORT)
+    parser.add_argument("proxy_port", nargs="?", default="7778")
+    parser.add_argument("--session", default=None, help="session of this audit in a proxy shared by several audits")
+    parser.add_argument("--session-header", action="store_true", help="identify the session by a request header instead of the proxy port")
+    parser.add_argument("--configuration", default=None, help="configuration.json of the session")
+    parser.add_argument("--headless", action="store_true", help="run Chrome without a window")
+    parser.add_argument("--authorization", default=None, help="recorded app authorization request (captures/authorization_xxx.mitm) replayed instead of scanning the QR code with the app")
+    parser.add_argument("--authorizer-target", default=None, help="send the authorization request to this scheme://host:port (e.g. a local stand-in server) instead of through the proxy")
+    parser.add_argument("--qrcode-timeout", type=int, default=60, help="seconds to wait for the QR code before giving up the replayed authorization")
+    args = parser.parse_args()
+
+    print("url:", args.url)
+    authorizer = None
+    if args.authorization is not None:
+        authorizer = ReplayAuthorizer(args.authorization, f"http://localhost:{args.proxy_port}", args.authorizer_target, args.qrcode_timeout)
+    qrcode_handler = QRCodeHandler(f"localhost:{args.proxy_port}", args.signal_port, args.session, args.session_header, args.headless, authorizer)
+    qrcode_handler.perform_qr_login(args.url, args.configuration)
@@ -2,13 +2,15 @@
 
 
 url=$1
+signal_port=${2:-7779}
+# further arguments are passed to mitmweb, e.g. --set first_party_filter=false
 
-mitmweb -s initialization.py --set url=$url -p 7778 --mode upstream:http://localhost:7890 &
+mitmweb -s initialization.py --set url=$url --set signal_port=$signal_port -p 7778 --mode upstream:http://localhost:7890 "${@:3}" &
 mitmweb_pid=$!
 
 
 # Press enter after the QRLogin process is done to start detection
-python3 qrlogin_process.py $url
+python3 qrlogin_process.py $url $signal_port
 
 
 kill -9 $mitmweb_pid
@@ -0,0 +1,122 @@
+import socket
+import threading
+import time
+
+DEFAULT_SIGNAL_PORT = 7779
+DEFAULT_SESSION = ""
+
+
+class SignalChannel:
+    '''
+    Local socket through which the QRLogin driver signals the addon, e.g. that QRLogin is done.
+    Each message is one line: "<command> [<argument>]"; handlers returning a reply answer it with one line
+    Several audits may share one channel, "done <session>" only concerns the given session
+    '''
+    def __init__(self, logger, host="127.0.0.1"):
+        self.logger = logger
+        self.host = host
+        self.port = None
+        self.server = None
+
+        self.login_done = {}    # session -> threading.Event
+        self.lock = threading.Lock()
+        self.handlers = {"done": self.on_done}
+
+
+    def start(self, port=DEFAULT_SIGNAL_PORT):
+        if self.server is not None:
+            return
+        self.port = port
+        self.server = socket.create_server((self.host, port))
+        threading.Thread(target=self.serve, daemon=True).start()
+        self.logger.info(f"[SIGNAL] Listening on {self.host}:{port}")
+
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+
+
+    def handle_connection(self, conn):
+        with conn, conn.makefile("r", encoding="utf-8") as f:
+            for line in f:
+                command, _, argument = line.strip().partition(" ")
+                handler = self.handlers.get(command)
+                if handler is None:
+                    self.logger.info(f"[SIGNAL] Unknown message: {line.strip()}")
+                    continue
+                reply = handler(argument)
+                if reply is not None:
+                    try:
+                        conn.sendall((reply + "\n").encode("utf-8"))
+                    except OSError:
+                        pass    # the sender did not wait for the reply
+
+
+    def login_event(self, session=DEFAULT_SESSION):
+        with self.lock:
+            return self.login_done.setdefault(session, threading.Event())
+
+
+    def reset_session(self, session):
+        with self.lock:
+            self.login_done[session] = threading.Event()
+
+
+    def on_done(self, argument):
+        self.logger.info(f"[SIGNAL] QRLogin done {argument}")
+        self.login_event(argument).set()
+
+
+    def is_login_done(self, session=DEFAULT_SESSION):
+        return self.login_event(session).is_set()
+
+
+    def wait_login_done(self, session=DEFAULT_SESSION, timeout=None):
+        return self.login_event(session).wait(timeout)
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+
+def send_signal(message, port=DEFAULT_SIGNAL_PORT, host="127.0.0.1", retries=5):
+    '''
+    Send a message to the addon's signal channel
+    '''
+    for i in range(retries):
+        try:
+            with socket.create_connection((host, port), timeout=5) as sock:
+                sock.sendall((message + "\n").encode("utf-8"))
+            return True
+        except OSError as e:
+            print(f"Cannot reach signal channel {host}:{port}: {e}")
+            time.sleep(1)
+    return False
+
+
+def request_signal(message, port=DEFAULT_SIGNAL_PORT, host="127.0.0.1", retries=5, timeout=60):
+    '''
+    Send a message to the addon's signal channel and wait for its reply, None if there is none
+    '''
+    for i in range(retries):
+        try:
+            with socket.create_connection((host, port), timeout=5) as sock:
+                sock.sendall((message + "\n").encode("utf-8"))
+                sock.shutdown(socket.SHUT_WR)
+                sock.settimeout(timeout)
+                with sock.makefile("r", encoding="utf-8") as f:
+                    return f.readline().strip() or None
+        except socket.timeout:
+            print(f"No reply from signal channel {host}:{port} to: {message}")
+            return None
+        except OSError as e:
+            print(f"Cannot reach signal channel {host}:{port}: {e}")
+            time.sleep(1)
+    return None
@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+from flow_filter import registrable_domain
+
+DEFAULT_KNOWLEDGE_DB = "./config/site_knowledge.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS facts (
+    site TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    facts TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    site TEXT NOT NULL,
+    url TEXT NOT NULL,
+    audited_at TEXT NOT NULL,
+    qrid TEXT,
+    f1 INTEGER, f2 INTEGER, f3 INTEGER, f4 INTEGER, f5 INTEGER, f6 INTEGER    -- NULL when the check did not conclude
+);
+CREATE INDEX IF NOT EXISTS results_site ON results (site, audited_at);
+"""
+
+
+def site_key(url):
+    '''
+    Registrable domain of url by the public suffix list, e.g. example.com.tr rather than com.tr
+    '''
+    return registrable_domain(urlparse(url).hostname or "")
+
+
+def result_value(result):
+    '''
+    1/0 for a flaw found or not, NULL for a check that did not conclude (skipped offline, replay timed out)
+    '''
+    return None if result is None else int(bool(result))
+
+
+class SiteKnowledge:
+    '''
+    What earlier audits learned about each site, keyed by registrable domain, in a SQLite database:
+    the facts located by prepare() (polling and generation endpoints, qrid field names, cookie source, polling indicator)
+    and the F1-F6 results of each audit.
+    Facts are hints: prepare() checks each of them against the current traffic before using it.
+    An empty path disables the database.
+    '''
+    def __init__(self, path=DEFAULT_KNOWLEDGE_DB):
+        self.path = path
+
+
+    def set_path(self, path):
+        self.path = path
+
+
+    def connect(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)   # audits of a batch write to the same database
+        conn.executescript(SCHEMA)
+        return conn
+
+
+    def load_facts(self, url):
+        if not self.path:
+            return {}
+        try:
+            conn = self.connect()
+            try:
+                row = conn.execute("SELECT url, facts FROM facts WHERE site = ?", (site_key(url),)).fetchone()
+            finally:
+                conn.close()
+            if row is None or site_key(row[0]) != site_key(url):
+                return {}   # a row keyed before the public suffix list, e.g. com.tr, may hold the facts of another site
+            return json.loads(row[1])
+        except (sqlite3.Error, ValueError) as e:
+            print(f"[KNOWLEDGE] Cannot read {self.path}: {e}")
+            return {}
+
+
+    def save_facts(self, url, facts):
+        """
+        Merge facts into those known about the site
+        """
+        if not self.path:
+            return
+        try:
+            conn = self.connect()
+            try:
+                with conn:
+                    row = conn.execute("SELECT url, facts FROM facts WHERE site = ?", (site_key(url),)).fetchone()
+                    merged = json.loads(row[1]) if row and site_key(row[0]) == site_key(url) else {}
+                    merged.update(facts)
+                    conn.execute("INSERT OR REPLACE INTO facts (site, url, facts, updated_at) VALUES (?, ?, ?, ?)",
+                                 (site_key(url), url, json.dumps(merged), time.strftime("%Y-%m-%d %H:%M:%S")))
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError) as e:
+            print(f"[KNOWLEDGE] Cannot write {self.path}: {e}")
+
+
+    def add_result(self, url, qrid, results):
+        if not self.path:
+            return
+        try:
+            conn = self.connect()
+            try:
+                with conn:
+                    conn.execute("INSERT INTO results (site, url, audited_at, qrid, f1, f2, f3, f4, f5, f6) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (site_key(url), url, time.strftime("%Y-%m-%d %H:%M:%S"), str(qrid), *[result_value(r) for r in results]))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[KNOWLEDGE] Cannot write {self.path}: {e}")
+
+
+    def get_results(self, url, limit=10):
+        """
+        [(audited_at, qrid, [F1..F6])] of the latest audits of the site, most recent first, None for the checks that did not conclude
+        """
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            conn = self.connect()
+            try:
+                rows = conn.execute("SELECT audited_at, qrid, f1, f2, f3, f4, f5, f6 FROM results WHERE site = ? ORDER BY id DESC LIMIT ?",
+                                    (site_key(url), limit)).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[KNOWLEDGE] Cannot read {self.path}: {e}")
+            return []
+        return [(row[0], row[1], [None if r is None else bool(r) for r in row[2:]]) for row in rows]
@@ -1,102 +1,122 @@
 import os
-import urllib.parse
 from utils import *
+from value_index import ValueIndex
+from endpoint_counter import EndpointCounter
+from flow_store import FlowStore, DEFAULT_MEMORY_BUDGET
+from capture import CaptureWriter
+from traffic_log_writer import TrafficLogWriter
 
 class TrafficRecorder:
-    def __init__(self, url, logger, debuggable=True):
+    def __init__(self, url, logger, debuggable=True, memory_budget=DEFAULT_MEMORY_BUDGET, live=True):
         self.url = url
         self.debuggable = debuggable
         self.logger = logger
         
+        # offline analysis writes its own log and blobs, leaving those of the live run in place
+        name = artifact_name(url, live)
         os.makedirs("./logs", exist_ok=True)
-        self.traffic_recording = f"./logs/traffic_{urllib.parse.quote(url, safe='')}.txt"
+        self.traffic_recording = f"./logs/traffic_{name}.txt"
         if os.path.exists(self.traffic_recording):
             os.remove(self.traffic_recording)
+        self.log_writer = TrafficLogWriter(self.traffic_recording, logger)     # hooks only enqueue, a thread writes the log
         
-        self.flows = []  
+        self.flows = []     # [FlowRecord, flow_type]
+        self.value_index = ValueIndex()
+        self.flow_store = FlowStore(f"./intermediate_files/blobs_{name}.bin", memory_budget)
+        self.capture = CaptureWriter(url) if live else None    # offline analysis reads a capture instead
 
-        self.url_counts = {}  
+        self.endpoint_counter = EndpointCounter()    # request counts and flows per endpoint, for ranking polling candidates
 
     def record_flow(self, flow, flow_type):
-        self.flows.append([flow, flow_type])
+        # index the live flow before its bodies may be spilled by the flow store
+        get_parsed_flow(flow, flow_type)
+        self.value_index.add_flow(flow, flow_type, len(self.flows))
+        record = self.flow_store.add(flow, flow_type)
+        self.flows.append([record, flow_type])
+        if flow_type == "request":
+            self.endpoint_counter.add(record.request.url, record)
+        self.capture_event(flow, flow_type)
+
+    def capture_event(self, flow, flow_type):
+        if self.capture is not None:
+            self.capture.add_event(flow, flow_type)
+
+    def release(self):
+        """
+        Drop the parsed views and the value index of the recorded flows once detection is done,
+        the parse cache is shared by the sessions of a proxy
+        """
+        for record, flow_type in self.flows:
+            invalidate_parsed_flow(record, flow_type)
+        self.value_index = ValueIndex()
+
+    def end_capture(self, flow):
+        """
+        Write the flow of a recorded request whose response is not recorded
+        """
+        if self.capture is not None:
+            self.capture.end_flow(flow)
+
+    def close_capture(self):
+        if self.capture is not None:
+            self.capture.close()
 
     def get_traffic_recording(self):
         return self.traffic_recording
 
     def get_flows(self):
         return self.flows
+
+    def get_candidate_flows(self, value, flow_type=None, start=0):
+        """
+        Get the recorded flows that may contain value, in recording order.
+        Falls back to all flows when the value index cannot answer.
+        """
+        positions = self.value_index.lookup(value, flow_type, start)
+        if positions is None:
+            return self.flows[start:]
+        return [self.flows[position] for position in positions]
+
+    def lookup_flow_ids(self, value, flow_type=None):
+        """
+        Get the ids of recorded flows carrying value, or None if the value index cannot answer
+        """
+        positions = self.value_index.lookup(value, flow_type)
+        if positions is None:
+            return None
+        return {self.flows[position][0].id for position in positions}
     
     
-    def update_url_counts(self, url):
-        if url in self.url_counts:
-            self.url_counts[url] += 1
-        else:
-            self.url_counts[url] = 1
+    def rank_endpoints(self):
+        """
+        Yield (endpoint, count) of the recorded requests, most frequent first
+        """
+        return self.endpoint_counter.ranked()
+
+
+    def top_endpoints(self, k):
+        return self.endpoint_counter.top(k)
 
 
-    def sort_url_counts_by_frequency(self):
+    def get_endpoint_flows(self, url):
         """
-        Sort URL counts based on frequency of appearance
+        Get the recorded request flows to the endpoint of url, in recording order
         """
-        filtered_url_counts = {}
-        for url, cnt in self.url_counts.items():
-            filtered_url = remove_params_from_url(url)
-            filtered_url_counts[filtered_url] = filtered_url_counts.get(filtered_url, 0) + self.url_counts[url]
-        sorted_url_counts = sorted(filtered_url_counts.items(), key=lambda x: x[1], reverse=True)
-        return sorted_url_counts
-
-
-
-    def build_url_flow_map(self):
-        url_flow_map = {}
-        for flow_info in self.flows:
-            flow = flow_info[0]
-            flow_type = flow_info[1]
-            if flow_type == "request":
-                url = remove_params_from_url(flow.request.url)
-                url_flow_map[url] = url_flow_map.get(url, []) + [flow]
-        return url_flow_map
+        return self.endpoint_counter.get_flows(url)
     
 
     def write_log_request(self, flow):
         if not self.debuggable:
             return
-        with open(self.traffic_recording, "a") as f:
-            f.write(f"\n[Request{self.num}]{flow.request.url}\n")
-            f.write(f"Method: {flow.request.method}\n")
-            self.logger.debug(f"\n[Request{self.num}]\n{flow.request.url}")
-            self.logger.debug(f"Method: {flow.request.method}")
-
-            headers = dict(flow.request.headers)
-            for key in headers:
-                f.write(f"{key}: {headers[key]}\n")
-                self.logger.debug(f"{key}: {headers[key]}")
-                
-            if flow.request.content:
-                decoded_content = decode_content(flow.request.content)
-                f.write(f"Body:$$${decoded_content}$$$")
-                self.logger.debug(f"Body:$$${decoded_content}$$$\n")
-            else:
-                pass
-            f.write("\n\n\n\n")
+        self.log_writer.log_request(flow)
     
     
     def write_log_response(self, flow):
         if not self.debuggable:
             return
-        with open(self.traffic_recording, "a", encoding="utf-8") as f:
-            f.write(f"\n[Response]\n{flow.request.url}\n")
-            self.logger.debug(f"\n[Response]{flow.request.url}")
-
-            headers = dict(flow.response.headers)
-            for key in headers:
-                f.write(f"{key}: {headers[key]}\n")
-                self.logger.debug(f"{key}: {headers[key]}")
-
-            if flow.response.content:
-                decoded_content = decode_content(flow.response.content)
-                f.write(f"Body:$$${decoded_content}$$$")
-                self.logger.debug(f"Body:$$${decoded_content}$$$\n")
-            else:
-                pass
-            f.write("\n\n\n\n")
\ No newline at end of file
+        self.log_writer.log_response(flow)
+
+
+    def close_log(self):
+        if self.debuggable:
+            self.log_writer.close()
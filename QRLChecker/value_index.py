@@ -0,0 +1,126 @@
+import re
+from bisect import bisect_right
+from utils import *
+
+MAX_INDEXED_VALUE = 64 * 1024   # longer values are not tokenized, their flows are always candidates
+TOKEN_PATTERN = re.compile(r"\w+")
+CHUNK_TOKENS = 4096             # distinct tokens joined per chunk of the vocabulary scanned for embedded probes
+SEPARATOR = "\0"
+
+
+class ValueIndex:
+    '''
+    Incremental index from the tokens (runs of word characters) of the values carried by flows
+    to the (position, flow_type) of the flows carrying them. Every string search() looks into
+    (query params, URL, body fields, headers, cookies) is tokenized once, when its flow is recorded.
+
+    A value containing the probe contains each token of the probe inside one of its tokens, so a lookup intersects,
+    for each probe token, the flows of the tokens containing it: the token itself, found in the map,
+    and the longer tokens it is embedded in (e.g. qrcodeAb12Cd34 for Ab12Cd34), found by scanning the distinct tokens.
+    The scan never rebuilds: new tokens are appended to the vocabulary in fixed-size chunks.
+    '''
+    def __init__(self, min_token_len=4):
+        self.min_token_len = min_token_len
+        self.tokens = {}        # token -> {(position, flow_type)}
+        self.unindexed = []     # (position, flow_type) of the flows holding a value too long to be tokenized
+        self.chunks = []        # (distinct tokens joined by SEPARATOR, their offsets, the tokens) of full chunks
+        self.tail = []          # distinct tokens not in a full chunk yet
+
+
+    def add_flow(self, flow, flow_type, position):
+        """
+        Index the query params, URL, body fields, headers and cookies of a recorded flow
+        """
+        parsed = get_parsed_flow(flow, flow_type)
+        values = set()
+
+        if flow_type == "request":
+            values.add(parsed.url)
+            for k, v in parsed.query:
+                values.add(v)
+            for k, v, unquoted_v in parsed.content_items:
+                values.update((v, unquoted_v))
+        else:
+            for k, v, unquoted_v in parsed.flatten_items:
+                values.update((v, unquoted_v))
+
+        for k, v in parsed.headers:
+            if flow_type == "request" and k.lower() in ['cookie', 'set-cookie']:
+                continue
+            values.add(str(v))
+        for k, v in parsed.cookie_dict.items():
+            values.add(str(v))
+
+        entry = (position, flow_type)
+        tokens = set()
+        for value in values:
+            if len(value) > MAX_INDEXED_VALUE:
+                if not self.unindexed or self.unindexed[-1] != entry:
+                    self.unindexed.append(entry)
+                continue
+            tokens.update(TOKEN_PATTERN.findall(value))
+        for token in tokens:
+            if token not in self.tokens:
+                self.tokens[token] = set()
+                self.add_to_vocabulary(token)
+            self.tokens[token].add(entry)
+
+
+    def add_to_vocabulary(self, token):
+        self.tail.append(token)
+        if len(self.tail) < CHUNK_TOKENS:
+            return
+        offsets = []
+        offset = 0
+        for tail_token in self.tail:
+            offsets.append(offset)
+            offset += len(tail_token) + len(SEPARATOR)
+        self.chunks.append((SEPARATOR.join(self.tail), offsets, self.tail))
+        self.tail = []
+
+
+    def containing_tokens(self, probe_token):
+        """
+        The indexed tokens containing probe_token, itself included
+        """
+        found = [token for token in self.tail if probe_token in token]
+        for text, offsets, chunk_tokens in self.chunks:
+            index = text.find(probe_token)
+            while index != -1:
+                i = bisect_right(offsets, index) - 1
+                found.append(chunk_tokens[i])
+                index = text.find(probe_token, offsets[i] + len(chunk_tokens[i]) + len(SEPARATOR))
+        return found
+
+
+    def is_probeable(self, value):
+        return len(value) >= self.min_token_len and any(len(t) >= self.min_token_len for t in TOKEN_PATTERN.findall(value))
+
+
+    def lookup(self, value, flow_type=None, start=0):
+        """
+        Return the sorted positions of the flows that may carry value, a superset of those where search() finds it,
+        or None if value has no token long enough to be answered by the index
+        """
+        value = str(value)
+        if not self.is_probeable(value):
+            return None
+
+        entries = None
+        # the longest tokens are the most selective, they are intersected first
+        for probe_token in sorted({t for t in TOKEN_PATTERN.findall(value) if len(t) >= self.min_token_len}, key=len, reverse=True):
+            token_entries = set()
+            for token in self.containing_tokens(probe_token):
+                token_entries |= self.tokens[token]
+            entries = token_entries if entries is None else entries & token_entries
+            if not entries:
+                break
+        entries = entries | set(self.unindexed)
+
+        positions = set()
+        for position, entry_type in entries:
+            if position < start:
+                continue
+            if flow_type is None or entry_type == flow_type:
+                positions.add(position)
+        return sorted(positions)
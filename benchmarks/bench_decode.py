@@ -0,0 +1,91 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "QRLChecker"))
+
+import chardet
+from mitmproxy import io
+from utils import decode_content
+
+
+def chardet_first_decode(content):
+    '''
+    decode_content before the fast path: chardet on the whole body, then a fixed list of encodings
+    '''
+    if content is None:
+        return ''
+    encoding = chardet.detect(content)['encoding']
+    if encoding is not None:
+        try:
+            return content.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            pass
+    for encoding in ['utf-8', 'gbk', 'latin1']:
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+
+
+def load_corpus(paths):
+    '''
+    (body, Content-Type) of every request/response in the given captures
+    '''
+    corpus = []
+    for path in paths:
+        with open(path, "rb") as f:
+            for flow in io.FlowReader(f).stream():
+                for message in [flow.request, flow.response]:
+                    if message is not None and message.raw_content:
+                        corpus.append((message.get_content(strict=False), message.headers.get("Content-Type", "")))
+    return corpus
+
+
+def synthetic_corpus():
+    '''
+    Bodies typical of QRLogin pages, used when no capture is given
+    '''
+    status = json.dumps({"code": 0, "data": {"qrid": "a1b2c3d4e5f6", "status": "1", "msg": "扫码成功"}}, ensure_ascii=False)
+    page = "<html><head><title>扫码登录</title></head><body>" + "<div class='qr'>请使用手机App扫码登录</div>" * 200 + "</body></html>"
+    script = "!function(e){var t={};" + "function n(r){if(t[r])return t[r].exports}" * 2000 + "}([]);"
+    return [
+        (status.encode("utf-8"), "application/json"),
+        (status.encode("utf-8"), "application/json;charset=UTF-8"),
+        (page.encode("utf-8"), "text/html; charset=utf-8"),
+        (page.encode("gbk"), "text/html"),
+        (page.encode("gbk"), "text/html; charset=GBK"),
+        (script.encode("utf-8"), "application/javascript"),
+        (b"qrid=a1b2c3d4e5f6&t=1700000000", "application/x-www-form-urlencoded"),
+    ] * 20
+
+
+def bench(name, decode, corpus, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for content, content_type in corpus:
+            decode(content, content_type)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:<16}{elapsed * 1000:>10.1f} ms   {elapsed / len(corpus) * 1e6:>10.1f} us/body")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare body decoding with and without the charset/UTF-8 fast path")
+    parser.add_argument("captures", nargs="*", help="capture_xxx.mitm files or directories of them (default: synthetic bodies)")
+    parser.add_argument("-n", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.captures:
+        paths += sorted(glob.glob(os.path.join(path, "*.mitm"))) if os.path.isdir(path) else [path]
+    corpus = load_corpus(paths) if paths else synthetic_corpus()
+    print(f"{len(corpus)} bodies, {sum(len(c) for c, _ in corpus) / 1024:.0f} KB")
+
+    baseline = bench("chardet first", lambda content, content_type: chardet_first_decode(content), corpus, args.repeat)
+    fast = bench("fast path", decode_content, corpus, args.repeat)
+    differing = sum(1 for content, content_type in corpus if chardet_first_decode(content) != decode_content(content, content_type))
+    print(f"speedup: {baseline / fast:.1f}x, {differing} bodies decoded differently")
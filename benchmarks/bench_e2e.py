@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "QRLChecker"))
+
+from batch_audit import FLAWS, parse_result_file, wait_for_port
+from bench_startup import free_port
+from mock_qrlogin_server import QRID_FORMATS, STATUS, MockQRLoginServer, MockSettings
+from signal_channel import send_signal
+
+CREDENTIALS = {"phone_num": "13812345678", "password": "mock-password", "id_card": "110101199003071234"}
+BROWSER_UA = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+APP_UA = "Dalvik/2.1.0 (Linux; U; Android 13; Pixel 7)"
+
+
+def write_workdir(workdir, base_url, polling_statuses=True, configuration=True):
+    '''
+    Configuration and credentials of the mock site, in the layout the addon expects.
+    Without polling_statuses, the addon learns the status field of the polling responses,
+    without configuration, it discovers the whole configuration.
+    '''
+    os.makedirs(os.path.join(workdir, "config"), exist_ok=True)
+    config = {
+        "base": {
+            "qrid_name": "qrid",
+            "polling_url": base_url + "/qrcode/poll",
+            "generation_url": base_url + "/qrcode/create",
+            "authorization_url": base_url + "/app/authorize",
+        },
+    }
+    if polling_statuses:
+        config["polling_response_format"] = {"indicator": "status", "value": STATUS}
+    if configuration:
+        with open(os.path.join(workdir, "config", "configuration.json"), "w") as f:
+            json.dump(config, f, indent=2)
+    with open(os.path.join(workdir, "config", "credential.ini"), "w") as f:
+        f.write("[Credentials]\n" + "".join(f"{k} = {v}\n" for k, v in CREDENTIALS.items()))
+
+
+def rss_kb(pid):
+    '''
+    Resident memory of a process in kB, from /proc (Linux only)
+    '''
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class TrafficDriver:
+    '''
+    Plays the browser and the app of a QRLogin through the proxy: the login page, QR code creation,
+    polling every poll_interval seconds, the app authorization after scan_after seconds,
+    and background requests (scripts, images, API calls) at rate requests per second
+    '''
+    def __init__(self, base_url, proxy, settings, poll_interval=1.0, scan_after=5.0, rate=20, workers=4, token_in_authorization=True):
+        self.base_url = base_url
+        self.proxies = {"http": proxy, "https": proxy}
+        self.settings = settings
+        self.poll_interval = poll_interval
+        self.scan_after = scan_after
+        self.rate = rate
+        self.workers = workers
+        self.token_in_authorization = token_in_authorization
+
+        self.latencies = []     # seconds per request through the proxy
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+
+    def session(self, user_agent):
+        import requests
+        session = requests.Session()
+        session.proxies.update(self.proxies)
+        session.headers["User-Agent"] = user_agent
+        return session
+
+
+    def send(self, session, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, self.base_url + path, timeout=30, **kwargs)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            return None
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return response
+
+
+    def background(self, index):
+        session = self.session(BROWSER_UA)
+        paths = ["/static/app.js", "/api/feed?page={}", "/static/img/{}.png", "/api/feed?page={}"]
+        interval = self.workers / self.rate if self.rate > 0 else None
+        i = 0
+        while interval is not None and not self.stopped.is_set():
+            start = time.perf_counter()
+            self.send(session, "GET", paths[i % len(paths)].format(index * 100000 + i))
+            i += 1
+            self.stopped.wait(max(0, interval - (time.perf_counter() - start)))
+
+
+    def run(self):
+        '''
+        Run one QRLogin, returning the qrid, or None if the browser did not see the login
+        '''
+        browser = self.session(BROWSER_UA)
+        self.send(browser, "GET", "/login")
+        qrid = None
+        if self.settings.client_qrid:
+            qrid = QRID_FORMATS[self.settings.qrid_format]()
+        response = self.send(browser, "POST", "/qrcode/create", json={"qrid": qrid} if qrid else {})
+        if response is None:
+            return None
+        qrid = response.json()["qrid"]
+
+        threads = [threading.Thread(target=self.background, args=(i,), daemon=True) for i in range(self.workers)]
+        for t in threads:
+            t.start()
+
+        app = self.session(APP_UA)
+        start = time.perf_counter()
+        authorized = False
+        logged_in = False
+        try:
+            while time.perf_counter() - start < self.scan_after + 30:
+                response = self.send(browser, "POST", "/qrcode/poll", json={"qrid": qrid})
+                if response is not None and response.json().get("status") == STATUS["logged-in"]:
+                    logged_in = True
+                    break
+                if not authorized and time.perf_counter() - start >= self.scan_after:
+                    authorization = {"qrid": qrid}
+                    if self.token_in_authorization:
+                        authorization["token"] = os.urandom(16).hex()
+                    else:   # F5, the app identifies the user by their phone number
+                        authorization["phone"] = CREDENTIALS["phone_num"]
+                    self.send(app, "POST", "/app/authorize", json=authorization)
+                    authorized = True
+                time.sleep(self.poll_interval)
+        finally:
+            self.stopped.set()
+            for t in threads:
+                t.join()
+        return qrid if logged_in else None
+
+
+def expected_flaws(flaws):
+    return [flaw in flaws for flaw in FLAWS]
+
+
+def run_benchmark(args):
+    flaws = set(args.flaws.split(",")) if args.flaws else set()
+    settings = MockSettings(client_qrid="F4" in flaws, qrid_format="numeric6" if "F3" in flaws else args.qrid_format,
+                            cookie_binding="F1" not in flaws, reusable="F2" in flaws, qrid_ttl=args.qrid_ttl,
+                            leak="F6" in flaws, credentials=CREDENTIALS)
+    server = MockQRLoginServer(("127.0.0.1", args.port), settings).start()
+    login_url = server.base_url + "/login"
+
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    write_workdir(workdir, server.base_url, not args.learn_polling_statuses, not args.discover_config)
+    proxy_port, signal_port = free_port(), free_port()
+    # url must stay the first --set option, the addon reads it from sys.argv[4]
+    cmd = [args.proxy_bin, "-s", os.path.join(ROOT, "QRLChecker", "initialization.py"), "--set", f"url={login_url}",
+           "--set", f"signal_port={signal_port}", "-p", str(proxy_port), "--mode", "regular"]
+    if args.config_cache_dir:
+        cmd += ["--set", f"config_cache_dir={os.path.abspath(args.config_cache_dir)}"]
+    if args.knowledge_db:
+        cmd += ["--set", f"knowledge_db={os.path.abspath(args.knowledge_db)}"]
+    with open(os.path.join(workdir, "proxy.log"), "w") as proxy_log:
+        proxy = subprocess.Popen(cmd, cwd=workdir, stdout=proxy_log, stderr=subprocess.STDOUT)
+
+    try:
+        if not wait_for_port(proxy_port, args.startup_timeout):
+            print(f"Proxy failed to start, see {workdir}/proxy.log")
+            return False
+        idle_rss = rss_kb(proxy.pid)
+
+        driver = TrafficDriver(server.base_url, f"http://127.0.0.1:{proxy_port}", settings, args.poll_interval, args.scan_after,
+                               args.rate, args.workers, token_in_authorization="F5" not in flaws)
+        traffic_start = time.perf_counter()
+        qrid = driver.run()
+        traffic_time = time.perf_counter() - traffic_start
+        loaded_rss = rss_kb(proxy.pid)
+        if qrid is None:
+            print("The browser never saw the QRLogin succeed")
+            return False
+
+        detect_start = time.perf_counter()
+        send_signal("done", signal_port)
+        res_file = os.path.join(workdir, "res", f"res_{urllib.parse.quote(login_url, safe='')}.txt")
+        results = []
+        while time.perf_counter() - detect_start < args.detect_timeout:
+            results = parse_result_file(res_file)[1]
+            if len(results) == len(FLAWS):
+                break
+            time.sleep(0.05)
+        detection_latency = time.perf_counter() - detect_start
+    finally:
+        proxy.terminate()
+        try:
+            proxy.wait(timeout=5)
+        except subprocess.TimeoutExpired:   # the addon's threads may keep mitmdump alive
+            proxy.kill()
+        server.shutdown()
+
+    flows = len(driver.latencies)
+    latencies = sorted(driver.latencies)
+    print(f"Mock site {login_url}, flaws on: {','.join(sorted(flaws)) or 'none'}, workdir {workdir}")
+    print(f"  traffic:    {flows} flows in {traffic_time:.1f}s ({flows / traffic_time:.1f} flows/s), {driver.errors} errors")
+    if latencies:
+        print(f"  proxy:      p50 {statistics.median(latencies) * 1000:.1f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms per request")
+    if idle_rss and loaded_rss:
+        print(f"  memory:     {idle_rss / 1024:.1f} MB idle, {loaded_rss / 1024:.1f} MB after traffic, "
+              f"{(loaded_rss - idle_rss) / max(flows, 1):.1f} kB per flow")
+    if len(results) != len(FLAWS):
+        print(f"  detection:  no result after {args.detect_timeout}s, see {workdir}/proxy.log")
+        return False
+
+    expected = expected_flaws(flaws)
+    detected = [r == "True" for r in results]
+    print(f"  detection:  {detection_latency:.2f}s from the login signal to the result")
+    print("  " + "  ".join(f"{flaw}: {d}{'' if d == e else ' (expected ' + str(e) + ')'}" for flaw, d, e in zip(FLAWS, detected, expected)))
+    return detected == expected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of QRLChecker against a local mock QRLogin site")
+    parser.add_argument("--flaws", default="F1,F2,F3,F4,F5,F6", help="comma-separated flaws the mock site has, empty for none")
+    parser.add_argument("--qrid-format", choices=["uuid", "token"], default="uuid", help="qrid format when F3 is off")
+    parser.add_argument("--qrid-ttl", type=int, default=120, help="seconds before a qrid expires")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between two polling requests")
+    parser.add_argument("--scan-after", type=float, default=5.0, help="seconds before the app authorizes the QRLogin")
+    parser.add_argument("--rate", type=float, default=20, help="background requests per second, 0 for none")
+    parser.add_argument("--workers", type=int, default=4, help="threads sending the background requests")
+    parser.add_argument("--learn-polling-statuses", action="store_true", help="leave the polling response format out of the configuration")
+    parser.add_argument("--discover-config", action="store_true", help="run without configuration.json, the addon discovers it")
+    parser.add_argument("--config-cache-dir", default=None, help="directory of the discovered configurations, to reuse them across runs")
+    parser.add_argument("--knowledge-db", default=None, help="site knowledge database, to reuse the facts of earlier runs")
+    parser.add_argument("--port", type=int, default=0, help="port of the mock site, fixed to reuse its discovered configuration")
+    parser.add_argument("--proxy-bin", default="mitmdump")
+    parser.add_argument("--startup-timeout", type=int, default=30)
+    parser.add_argument("--detect-timeout", type=int, default=120)
+    args = parser.parse_args()
+
+    sys.exit(0 if run_benchmark(args) else 1)
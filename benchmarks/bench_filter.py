@@ -0,0 +1,81 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "QRLChecker"))
+
+from mitmproxy import http
+from flow_filter import FlowFilter, registrable_domain
+
+# host -> registrable domain, including suffixes a hand-written list misses
+REGISTRABLE_DOMAINS = {
+    "www.example.com": "example.com",
+    "passport.example.com.cn": "example.com.cn",
+    "www.example.com.tr": "example.com.tr",
+    "a.gov.uk": "a.gov.uk",
+    "www.dft.gov.uk": "dft.gov.uk",
+    "shop.co.za": "shop.co.za",
+    "x.com.vn": "x.com.vn",
+    "m.example.co.jp": "example.co.jp",
+    "user.github.io": "user.github.io",
+    "127.0.0.1": "127.0.0.1",
+    "localhost": "localhost",
+    "intranet.corp": "intranet.corp",
+}
+TARGET = "https://www.example.com.tr/login"
+
+
+def make_flow(url, **headers):
+    flow = http.HTTPFlow(None, None)
+    flow.request = http.Request.make("GET", url, b"", {k.replace("_", "-"): v for k, v in headers.items()})
+    return flow
+
+
+def filter_cases():
+    '''
+    (description, learn_frames, flow, expected allow_request) checked in order on one filter per learn_frames value
+    '''
+    referer = {"Referer": TARGET}
+    return [
+        ("other site under the same suffix", False, make_flow("https://www.other.com.tr/api"), False),
+        ("first-party subdomain", False, make_flow("https://api.example.com.tr/qrcode/poll"), True),
+        ("beacon with a first-party Origin", False, make_flow("https://collect.analytics.net/b", Origin="https://www.example.com.tr", **referer), False),
+        ("fetch with a first-party Origin", False, make_flow("https://ads.adnet.com/bid", Origin="https://www.example.com.tr", Sec_Fetch_Dest="empty", **referer), False),
+        ("ad iframe", False, make_flow("https://frame.adnet.com/ad", Sec_Fetch_Dest="iframe", **referer), False),
+        ("navigation to the SSO page", False, make_flow("https://passport.sso.com.tr/qr", Sec_Fetch_Dest="document", Sec_Fetch_Mode="navigate", **referer), True),
+        ("later call to the SSO domain", False, make_flow("https://api.sso.com.tr/poll"), True),
+        ("SSO iframe with learn_frames", True, make_flow("https://widget.sso.net/qr", Sec_Fetch_Dest="iframe", **referer), True),
+        ("beacon with learn_frames", True, make_flow("https://collect.analytics.net/b", Origin="https://www.example.com.tr", **referer), False),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the registrable domains and first-party rules of the flow filter, and time it")
+    parser.add_argument("-n", "--repeat", type=int, default=20000, help="requests filtered for the timing")
+    args = parser.parse_args()
+
+    failures = []
+    for host, expected in REGISTRABLE_DOMAINS.items():
+        if registrable_domain(host) != expected:
+            failures.append(f"registrable_domain({host}) = {registrable_domain(host)}, expected {expected}")
+
+    logger = logging.getLogger("bench_filter")
+    filters = {learn_frames: FlowFilter(TARGET, logger, learn_frames=learn_frames) for learn_frames in (False, True)}
+    for description, learn_frames, flow, expected in filter_cases():
+        if filters[learn_frames].allow_request(flow) != expected:
+            failures.append(f"{description}: {flow.request.url} {'kept' if not expected else 'dropped'}, expected {'kept' if expected else 'dropped'}")
+
+    flows = [make_flow(f"https://{host}/path/{i}") for i, host in enumerate(["cdn.thirdparty.com", "www.example.com.tr", "s.example.com.tr"] * (args.repeat // 3))]
+    flow_filter = FlowFilter(TARGET, logger)
+    start = time.perf_counter()
+    for flow in flows:
+        flow_filter.allow_request(flow)
+    elapsed = time.perf_counter() - start
+    print(f"allow_request    {elapsed / max(len(flows), 1) * 1e6:>8.2f} us per request, {flow_filter.summary()}")
+
+    print(f"{len(REGISTRABLE_DOMAINS) + len(filter_cases())} checks, {len(failures)} failed")
+    for failure in failures:
+        print("  " + failure)
+    sys.exit(1 if failures else 0)
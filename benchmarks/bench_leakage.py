@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "QRLChecker"))
+
+from mitmproxy import http
+from utils import get_parsed_flow, search
+from leakage_scanner import LeakageScanner
+
+CREDENTIALS = {"phone": "13812345678", "email": "alice@example.com", "name": "Alice", "id": "110101199003071234", "uid": "42"}
+
+
+def large_response(size, rng):
+    '''
+    A JSON feed of about size bytes, leaking some of the credentials near its end
+    '''
+    items = []
+    length = 0
+    while length < size:
+        item = {"id": "".join(rng.choice(string.ascii_letters) for _ in range(16)), "text": " ".join(rng.choice(["qr", "login", "feed", "news"]) for _ in range(40))}
+        items.append(item)
+        length += len(json.dumps(item))
+    items.append({"owner": {"mobile": "138****5678", "mail": CREDENTIALS["email"], "uid": CREDENTIALS["uid"]}})
+    flow = http.HTTPFlow(None, None)
+    flow.request = http.Request.make("GET", "https://example.com/api/feed")
+    flow.response = http.Response.make(200, json.dumps({"items": items}).encode(), {"Content-Type": "application/json"})
+    return flow
+
+
+def bench(name, scan, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fields = scan()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:<16}{elapsed * 1000:>10.1f} ms   {sorted(fields)}")
+    return elapsed, fields
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the leakage scanner with one search() per credential on a large response")
+    parser.add_argument("--size", type=int, default=1300 * 1024, help="bytes of the response body")
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    flow = large_response(args.size, random.Random(1))
+    get_parsed_flow(flow, "response")     # both sides read the cached parsed view
+    scanner = LeakageScanner(CREDENTIALS)
+    print(f"{len(flow.response.raw_content) / 1024:.0f} KB response, {len(CREDENTIALS)} credentials, {len(scanner.variants)} variants")
+
+    baseline, baseline_fields = bench("search() each", lambda: {field for field, value in CREDENTIALS.items() if search(flow, "response", value)}, args.repeat)
+    scanned, scanned_fields = bench("scanner", lambda: {hit["field"] for hit in scanner.scan_flow(flow) if not hit["masked"]}, args.repeat)
+    masked_fields = sorted({hit["field"] for hit in scanner.scan_flow(flow) if hit["masked"]})
+    print(f"scanner/search() time: {scanned / baseline:.1f}x, missed fields: {sorted(baseline_fields - scanned_fields)}, masked fields: {masked_fields}")
@@ -0,0 +1,118 @@
+import argparse
+import glob
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "QRLChecker"))
+
+from mitmproxy import http, io
+from utils import search
+from value_index import ValueIndex
+
+
+def make_flow(method, url, request_body=b"", status_code=200, response_body=b"", content_type="application/json", response_headers=()):
+    flow = http.HTTPFlow(None, None)
+    flow.request = http.Request.make(method, url, request_body, {"Content-Type": "application/x-www-form-urlencoded"} if request_body else {})
+    flow.response = http.Response.make(status_code, response_body, {"Content-Type": content_type, **dict(response_headers)})
+    return flow
+
+
+def random_value(rng, length=12):
+    return "".join(rng.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def synthetic_flows(count, seed=1):
+    '''
+    Flows typical of QRLogin pages, including values embedded in longer tokens
+    '''
+    rng = random.Random(seed)
+    flows = [
+        make_flow("GET", "https://example.com/qrcode/image", response_body=b'{"img":"qrcodeAb12Cd34Ef56"}'),
+        make_flow("GET", "https://example.com/profile", response_body=b'{"phone":"+8613812345678","name":"Zhang San"}'),
+    ]
+    for i in range(count):
+        qrid = random_value(rng)
+        kind = i % 4
+        if kind == 0:
+            flows.append(make_flow("POST", "https://example.com/qrcode/create", f"t={rng.randrange(10**12)}".encode(),
+                                   response_body=json.dumps({"code": 0, "data": {"qrid": qrid, "url": f"https://example.com/scan?k={qrid}"}}).encode(),
+                                   response_headers=[("Set-Cookie", f"sid={random_value(rng, 24)}; Path=/")]))
+        elif kind == 1:
+            flows.append(make_flow("GET", f"https://example.com/qrcode/poll?qrid={qrid}&_={rng.randrange(10**12)}",
+                                   response_body=json.dumps({"status": rng.choice("0123")}).encode()))
+        elif kind == 2:
+            page = "<html><body>" + "".join(f"<div id='{random_value(rng, 8)}'>{random_value(rng, 30)}</div>" for _ in range(50)) + "</body></html>"
+            flows.append(make_flow("GET", f"https://example.com/page/{random_value(rng, 6)}", response_body=page.encode(), content_type="text/html"))
+        else:
+            flows.append(make_flow("POST", "https://example.com/api/feed", f"cursor=prefix{qrid}suffix".encode(),
+                                   response_body=json.dumps({"items": [{"id": random_value(rng, 16), "token": f"tk_{qrid}_x"}]}).encode()))
+    return flows
+
+
+def load_flows(paths):
+    flows = []
+    for path in paths:
+        with open(path, "rb") as f:
+            flows += [flow for flow in io.FlowReader(f).stream() if isinstance(flow, http.HTTPFlow)]
+    return flows
+
+
+def probes_of(records, count, seed=2):
+    '''
+    Values to look up: substrings of the recorded values, and the substrings of the known embedded cases
+    '''
+    rng = random.Random(seed)
+    probes = ["Ab12Cd34Ef56", "13812345678", "absent-value-1234"]
+    texts = [flow.request.url for flow, flow_type in records] + \
+            [flow.response.get_text(strict=False) for flow, flow_type in records if flow_type == "response" and flow.response.raw_content]
+    while len(probes) < count and texts:
+        text = rng.choice(texts)
+        if len(text) < 4:
+            continue
+        length = rng.randint(4, min(24, len(text)))
+        begin = rng.randrange(len(text) - length + 1)
+        probes.append(text[begin:begin + length])
+    return probes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that value index lookups find every flow a linear search() finds, and time both")
+    parser.add_argument("captures", nargs="*", help="capture_xxx.mitm files or directories of them (default: synthetic flows)")
+    parser.add_argument("--flows", type=int, default=400, help="number of synthetic flows")
+    parser.add_argument("--probes", type=int, default=200)
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.captures:
+        paths += sorted(glob.glob(os.path.join(path, "*.mitm"))) if os.path.isdir(path) else [path]
+    flows = load_flows(paths) if paths else synthetic_flows(args.flows)
+
+    records = []
+    index = ValueIndex()
+    for flow in flows:
+        for flow_type in ["request", "response"]:
+            if flow_type == "response" and flow.response is None:
+                continue
+            index.add_flow(flow, flow_type, len(records))
+            records.append((flow, flow_type))
+    probes = probes_of(records, args.probes)
+    print(f"{len(records)} requests/responses, {len(probes)} probes")
+
+    start = time.perf_counter()
+    linear = [[i for i, (flow, flow_type) in enumerate(records) if search(flow, flow_type, probe)] for probe in probes]
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [index.lookup(probe) for probe in probes]
+    index_time = time.perf_counter() - start
+
+    missed = [probe for probe, found, candidates in zip(probes, linear, indexed) if candidates is not None and not set(found) <= set(candidates)]
+    candidates = sum(len(c) for c in indexed if c is not None)
+    print(f"linear search()  {linear_time * 1000:>10.1f} ms")
+    print(f"index lookup     {index_time * 1000:>10.1f} ms, {candidates} candidates for {sum(map(len, linear))} matches")
+    print(f"{len(missed)} probes with matches missed by the index" + (f": {missed[:5]}" if missed else ""))
+    sys.exit(1 if missed else 0)
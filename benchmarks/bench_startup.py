@@ -0,0 +1,98 @@
+import argparse
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ADDONS = {
+    "detection_pipeline": "analyzer",
+    "QRLChecker": "initialization",
+}
+IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_report(tree, module, top):
+    '''
+    Import the addon module with -X importtime, returning its import time and the slowest of its direct imports
+    '''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=os.path.join(ROOT, tree), capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1])
+
+    total = 0
+    imports = []
+    children = []   # importtime prints the imports of a module before the module itself
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match is None:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if indent == 1:
+            if name == module:
+                total, imports = cumulative, children
+            children = []
+        elif indent == 3:   # nested imports are included in their parent
+            children.append((cumulative, name))
+    return total, sorted(imports, reverse=True)[:top]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_listen(tree, module, proxy_bin, timeout):
+    '''
+    Seconds from launching the proxy with the addon until its port accepts connections
+    '''
+    port, signal_port = free_port(), free_port()
+    cmd = [proxy_bin, "-s", f"{module}.py", "--set", "url=https://example.com", "--set", f"signal_port={signal_port}",
+           "-p", str(port), "--mode", "regular"]
+    start = time.perf_counter()
+    proxy = subprocess.Popen(cmd, cwd=os.path.join(ROOT, tree), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        return None
+    finally:
+        proxy.terminate()
+        try:
+            proxy.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proxy.kill()    # the live analyzer keeps waiting for the QRLogin to finish
+            proxy.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup time of the mitmproxy addons: import profile and time until the proxy listens")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to show")
+    parser.add_argument("--proxy-bin", default="mitmdump", help="mitmproxy binary used to measure the time to listen")
+    parser.add_argument("--runs", type=int, default=3, help="proxy launches per addon")
+    parser.add_argument("--timeout", type=int, default=60, help="seconds to wait for the proxy to listen")
+    args = parser.parse_args()
+
+    for tree, module in ADDONS.items():
+        total, imports = import_report(tree, module, args.top)
+        print(f"[{tree}] import {module}: {total / 1e6:.3f}s")
+        for cumulative, name in imports:
+            print(f"    {cumulative / 1e6:8.3f}s  {name}")
+
+        if shutil.which(args.proxy_bin) is None:
+            print(f"    {args.proxy_bin} not found, skipping time to listen")
+            continue
+        times = [time_to_listen(tree, module, args.proxy_bin, args.timeout) for _ in range(args.runs)]
+        times = [t for t in times if t is not None]
+        if times:
+            print(f"    {args.proxy_bin} listening after {min(times):.2f}s (best of {len(times)})")
+        else:
+            print(f"    {args.proxy_bin} did not listen within {args.timeout}s")
@@ -0,0 +1,200 @@
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+# polling statuses, as in QRLChecker/config/configuration.json
+STATUS = {"unscanned": "0", "scanned": "1", "logged-in": "2", "invalid": "3"}
+QRID_FORMATS = {
+    "uuid": lambda: secrets.token_hex(16),
+    "token": lambda: secrets.token_urlsafe(16),
+    "numeric6": lambda: "%06d" % random.randrange(10 ** 6),    # F3 predictable qrid
+}
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title>Mock QRLogin</title></head>
+<body><img id="qrcode" width="200" height="200"><p id="status">Scan the QR code with the app</p></body></html>
+"""
+
+
+class MockSettings:
+    '''
+    Behaviour of the mock QRLogin site, each flag turning one flaw on:
+    F1 cookie_binding=False, F2 reusable=True, F3 qrid_format="numeric6", F4 client_qrid=True, F6 leak=True
+    (F5 depends on the authorization request sent by the app, see bench_e2e.py)
+    '''
+    def __init__(self, client_qrid=False, qrid_format="uuid", cookie_binding=True, reusable=False, qrid_ttl=120,
+                 leak=False, credentials=None, static_size=50 * 1024):
+        self.client_qrid = client_qrid
+        self.qrid_format = qrid_format
+        self.cookie_binding = cookie_binding
+        self.reusable = reusable
+        self.qrid_ttl = qrid_ttl
+        self.leak = leak
+        self.credentials = credentials or {}
+        self.static_size = static_size
+
+
+class QRLoginState:
+    '''
+    The QR ids of the site: the session (sid cookie) that created each one, its status and age
+    '''
+    def __init__(self, settings):
+        self.settings = settings
+        self.qrids = {}     # qrid -> {"owner", "status", "created", "consumed"}
+        self.lock = threading.Lock()
+
+
+    def create(self, sid, qrid=None):
+        if qrid is None or not self.settings.client_qrid:
+            qrid = QRID_FORMATS[self.settings.qrid_format]()
+        with self.lock:
+            self.qrids[qrid] = {"owner": sid, "status": "unscanned", "created": time.time(), "consumed": False}
+        return qrid
+
+
+    def poll(self, sid, qrid):
+        with self.lock:
+            entry = self.qrids.get(qrid)
+            if entry is None or time.time() - entry["created"] > self.settings.qrid_ttl:
+                return "invalid"
+            if self.settings.cookie_binding and entry["owner"] != sid:
+                return "invalid"
+            if entry["status"] == "logged-in":
+                if entry["consumed"] and not self.settings.reusable:
+                    return "invalid"
+                entry["consumed"] = True
+            return entry["status"]
+
+
+    def authorize(self, qrid):
+        with self.lock:
+            entry = self.qrids.get(qrid)
+            if entry is None or entry["status"] != "unscanned":
+                return False
+            entry["status"] = "logged-in"
+            return True
+
+
+class MockQRLoginHandler(BaseHTTPRequestHandler):
+    '''
+    GET  /login              login page, sets the sid cookie
+    POST /qrcode/create      {"qrid": ...} with a client-generated qrid -> {"code": 0, "qrid": ...}
+    POST /qrcode/poll        {"qrid": ...} -> {"code": 0, "status": ...}
+    POST /app/authorize      {"qrid": ..., "token": ...}, sent by the app
+    GET  /static/...         static content (JavaScript, images)
+    GET  /api/feed?page=N    small JSON responses
+    '''
+    protocol_version = "HTTP/1.1"
+    server_version = "MockQRLogin/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def get_sid(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return cookie["sid"].value if "sid" in cookie else None
+
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+
+    def send(self, body, content_type="application/json", headers=None):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        settings = self.server.settings
+        url = urlparse(self.path)
+        if url.path == "/login":
+            headers = {}
+            if self.get_sid() is None:
+                headers["Set-Cookie"] = f"sid={secrets.token_hex(12)}; Path=/; HttpOnly"
+            self.send(LOGIN_PAGE, "text/html; charset=utf-8", headers)
+        elif url.path.startswith("/static/") and url.path.endswith(".js"):
+            self.send(b"/*" + b"x" * (settings.static_size - 4) + b"*/", "application/javascript")
+        elif url.path.startswith("/static/"):
+            self.send(b"\x89PNG\r\n\x1a\n" + b"\x00" * (settings.static_size // 4), "image/png")
+        elif url.path == "/api/feed":
+            page = dict(parse_qsl(url.query)).get("page", "0")
+            self.send({"code": 0, "page": page, "items": [{"id": i, "title": f"item {page}-{i}"} for i in range(20)]})
+        else:
+            self.send_error(404)
+
+
+    def do_POST(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        data = self.read_json()
+        if url.path == "/qrcode/create":
+            self.send({"code": 0, "qrid": state.create(self.get_sid(), data.get("qrid"))})
+        elif url.path == "/qrcode/poll":
+            status = state.poll(self.get_sid(), data.get("qrid"))
+            response = {"code": 0, "status": STATUS[status]}
+            if status == "logged-in" and self.server.settings.leak:
+                response["user"] = {"phone": self.server.settings.credentials.get("phone_num", ""),
+                                    "id_card": self.server.settings.credentials.get("id_card", "")}
+            self.send(response)
+        elif url.path == "/app/authorize":
+            self.send({"code": 0 if state.authorize(data.get("qrid")) else 1})
+        else:
+            self.send_error(404)
+
+
+class MockQRLoginServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, settings):
+        super().__init__(address, MockQRLoginHandler)
+        self.settings = settings
+        self.state = QRLoginState(settings)
+
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local QRLogin site whose flaws can be turned on one by one")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--client-qrid", action="store_true", help="accept the qrid generated by the client (F4)")
+    parser.add_argument("--qrid-format", choices=list(QRID_FORMATS), default="uuid", help="numeric6 makes qrids predictable (F3)")
+    parser.add_argument("--no-cookie-binding", action="store_true", help="do not bind qrids to the session that created them (F1)")
+    parser.add_argument("--reusable", action="store_true", help="keep reporting a used qrid as logged in (F2)")
+    parser.add_argument("--qrid-ttl", type=int, default=120, help="seconds before a qrid expires")
+    parser.add_argument("--leak", action="store_true", help="return the credentials in the logged-in polling response (F6)")
+    args = parser.parse_args()
+
+    settings = MockSettings(args.client_qrid, args.qrid_format, not args.no_cookie_binding, args.reusable, args.qrid_ttl, args.leak,
+                            {"phone_num": "13812345678", "id_card": "110101199003071234"})
+    server = MockQRLoginServer((args.host, args.port), settings)
+    print(f"Mock QRLogin site at {server.base_url}/login")
+    server.serve_forever()
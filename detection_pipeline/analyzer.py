@@ -1,44 +1,65 @@
 import sys
 import time
+LOAD_START = time.perf_counter()    # startup time is reported from the moment the script is loaded
 from config.logger_config import LoggerConfig
 from traffic_recorder import TrafficRecorder
 from components.components import Components
 from detector import Detector
+import itertools
 import threading
 import urllib
+from mitmproxy import ctx
 import os
 from urllib.parse import unquote, urlparse
 from utils import *
+from signal_channel import DEFAULT_SIGNAL_PORT
+from flow_store import DEFAULT_MEMORY_BUDGET
+from traffic_log_writer import DEFAULT_MAX_BODY
+from polling_detector import PollingDetector, DEFAULT_WARN_AFTER, MIN_POLLS
+from endpoint_counter import normalize_endpoint
+from traffic_qrcode_decoder import TrafficQRCodeDecoder
+from capture import save_authorization
+from flow_filter import FlowFilter
+from components.cookie_client import DEFAULT_TIMEOUT, DEFAULT_RETRIES, DEFAULT_POOL_SIZE, upstream_proxy
+from site_knowledge import DEFAULT_KNOWLEDGE_DB, SiteKnowledge
+import shutil
 
 class Analyzer:
-    def __init__(self, url, debuggable=False):
+    def __init__(self, url, debuggable=False, live=True):
         self.debuggable = debuggable
+        self.live = live
 
         self.url = url
         self.domain = ".".join(urlparse(url).netloc.split(":")[0].split(".")[-2:])    
 
-        self.logger = LoggerConfig(url).get_logger()
+        self.logger = LoggerConfig(url, "" if live else OFFLINE_PREFIX).get_logger()
 
         self.components = Components(url, self.logger) 
         
         
-        self.traffic_recorder = TrafficRecorder(url, self.logger, self.debuggable)
+        self.traffic_recorder = TrafficRecorder(url, self.logger, self.debuggable, live=live)
+        self.flow_filter = FlowFilter(url, self.logger)
+        self.polling_detector = PollingDetector(self.logger, DEFAULT_WARN_AFTER if live else 0)
+        self.components.signal_channel.handlers["qrcode"] = self.on_qrcode
+        self.site_knowledge = SiteKnowledge()
+        self.known_facts = {}
 
         self.polling_manager = self.components.polling_manager
         self.qrcode_manager = self.components.qrcode_manager
         self.app_flow_manager = self.components.app_flow_manager
+        self.qrcode_decoder = TrafficQRCodeDecoder(self.qrcode_manager.add_decoded_qrcode, self.logger)
         
 
         self.detector = Detector(self.components, self.traffic_recorder, self.logger)
 
         os.makedirs("res", exist_ok=True)
-        self.res_file = f"./res/res_{urllib.parse.quote(url, safe='')}.txt"
+        self.res_file = f"./res/res_{artifact_name(url, live)}.txt"
 
         self.num = 0
-        self.check()
-        
         self.lock = threading.Lock()
-        threading.Thread(target=self.run_check_done).start()
+        if live:
+            self.check()
+            threading.Thread(target=self.run_check_done, daemon=True).start()
 
 
     def check(self):
@@ -46,35 +67,132 @@ class Analyzer:
         screenshot_path = "./intermediate_files/screenshot.png"
         if os.path.exists(screenshot_path):
             os.remove(screenshot_path)
-        if os.path.exists("./intermediate_files/done_flag.txt"):
-            os.remove("./intermediate_files/done_flag.txt")
 
 
     def run_check_done(self):
         '''
-        Check if QRLogin is done and start flaw detection
+        Wait until QRLogin is done and start flaw detection
         '''
-        wf = open(self.res_file, 'w')
-        write_head = False
-        while True:
-            if is_login_done():
-                self.logger.info("is_login_done: True")
-                self.prepare()
-                if not write_head:
-                    wf.write("qrid: \n" + str(self.qrcode_manager.get_qrid()) + "\n\n")
-                    wf.write("F1\t\tF2\t\tF3\t\tF4\t\tF5\t\tF6\n")
-                    write_head = True
-                res = self.detector.detect()
-                for i in res:
-                    wf.write(str(i) + "\t")
-                wf.write("\n")
-                self.print_log("Detection result: " + str(res))
-                break
-            time.sleep(3)
+        self.components.signal_channel.wait_login_done()
+        self.logger.info("is_login_done: True")
+        self.polling_detector.close()
+        self.traffic_recorder.close_capture()
+        screenshot_path = self.qrcode_manager.screenshot_path
+        if os.path.exists(screenshot_path):
+            shutil.copy(screenshot_path, os.path.splitext(self.traffic_recorder.capture.flow_path)[0] + ".png")
+        self.run_detection()
+        self.traffic_recorder.release()
+        self.app_flow_manager.release()
+
+
+    def on_qrcode(self, argument):
+        '''
+        "qrcode <quoted payload>" is sent by the QR code handler for each QR code decoded from the page
+        '''
+        self.qrcode_manager.add_decoded_qrcode(unquote(argument))
+
+
+    def run_offline(self, screenshot_path=None):
+        '''
+        Run detection over the flows fed from a capture, without replaying flows
+        '''
+        if screenshot_path is not None:
+            self.qrcode_manager.screenshot_path = screenshot_path
+        self.components.signal_channel.login_event().set()
+        return self.run_detection(offline=True)
+
+
+    def run_detection(self, offline=False):
+        self.logger.info(f"[FILTER] {self.flow_filter.summary()}")
+        with open(self.res_file, 'w') as wf:
+            self.prepare()
+            if not offline:
+                self.save_authorization()
+            wf.write("qrid: \n" + str(self.qrcode_manager.get_qrid()) + "\n\n")
+            wf.write("F1\t\tF2\t\tF3\t\tF4\t\tF5\t\tF6\n")
+            res = self.detector.detect(offline)
+            for i in res:
+                wf.write(str(i) + "\t")
+            wf.write("\n")
+            self.print_log("Detection result: " + str(res))
+        if not offline:
+            self.save_site_knowledge(res)
+        return res
+
+
+    def save_authorization(self):
+        '''
+        Save the app authorization request, which a ReplayAuthorizer replays to audit the site unattended
+        '''
+        login_request = self.app_flow_manager.get_login_request()
+        if login_request and self.qrcode_manager.get_qrid():
+            path = save_authorization(self.url, login_request[0][0].copy(), self.qrcode_manager.get_qrid_name(), self.qrcode_manager.get_qrid_value())
+            self.logger.info(f"[APP] Saved authorization request to {path}")
 
 
     def load(self, loader):
         loader.add_option(name = "url", typespec = str, default = "", help = "The URL to analyze")
+        loader.add_option(name = "replay_timeout", typespec = int, default = 30, help = "Seconds to wait for the response of a replayed flow")
+        loader.add_option(name = "signal_port", typespec = int, default = DEFAULT_SIGNAL_PORT, help = "Local port on which the QRLogin driver signals the addon")
+        loader.add_option(name = "flow_memory_budget", typespec = int, default = DEFAULT_MEMORY_BUDGET // (1024 * 1024), help = "MB of recorded bodies kept in memory, further bodies are spilled to disk")
+        loader.add_option(name = "traffic_log_max_body", typespec = int, default = DEFAULT_MAX_BODY, help = "Bytes of each body written to the traffic log (debuggable mode)")
+        loader.add_option(name = "traffic_log_gzip", typespec = bool, default = False, help = "Compress the traffic log (debuggable mode)")
+        loader.add_option(name = "first_party_filter", typespec = bool, default = True, help = "Only record the flows of the target's domains, without static assets")
+        loader.add_option(name = "first_party_frames", typespec = bool, default = False, help = "Also record the flows of the domains framed by the target's pages, e.g. an SSO QR code iframe")
+        loader.add_option(name = "first_party_domains", typespec = str, default = "", help = "Comma-separated domains recorded along with the target's, e.g. its SSO domain")
+        loader.add_option(name = "polling_warn_after", typespec = int, default = DEFAULT_WARN_AFTER, help = "Seconds of traffic without polling before warning, 0 to disable")
+        loader.add_option(name = "cookie_timeout", typespec = int, default = DEFAULT_TIMEOUT, help = "Seconds to wait for the site when F1 fetches a fresh session cookie")
+        loader.add_option(name = "cookie_retries", typespec = int, default = DEFAULT_RETRIES, help = "Retries of a failed fetch of a fresh session cookie")
+        loader.add_option(name = "cookie_pool_size", typespec = int, default = DEFAULT_POOL_SIZE, help = "Connections kept alive per host for fetching fresh session cookies")
+        loader.add_option(name = "cookie_http2", typespec = bool, default = False, help = "Fetch fresh session cookies over HTTP/2, needs httpx[http2]")
+        loader.add_option(name = "knowledge_db", typespec = str, default = DEFAULT_KNOWLEDGE_DB, help = "SQLite database of what earlier audits learned about each site, empty to disable")
+
+
+    def configure(self, updated):
+        if "replay_timeout" in updated:
+            self.components.replay_manager.set_timeout(ctx.options.replay_timeout)
+        if "flow_memory_budget" in updated:
+            self.traffic_recorder.flow_store.set_memory_budget(ctx.options.flow_memory_budget * 1024 * 1024)
+        if "traffic_log_max_body" in updated:
+            self.traffic_recorder.log_writer.set_max_body(ctx.options.traffic_log_max_body)
+        if "traffic_log_gzip" in updated:
+            self.traffic_recorder.log_writer.set_compress(ctx.options.traffic_log_gzip)
+        if "first_party_filter" in updated:
+            self.flow_filter.set_enabled(ctx.options.first_party_filter)
+        if "first_party_frames" in updated:
+            self.flow_filter.set_learn_frames(ctx.options.first_party_frames)
+        if "first_party_domains" in updated:
+            self.flow_filter.add_domains(ctx.options.first_party_domains.split(","))
+        if "polling_warn_after" in updated and self.live:
+            self.polling_detector.set_warn_after(ctx.options.polling_warn_after)
+        if "knowledge_db" in updated:
+            self.site_knowledge.set_path(ctx.options.knowledge_db)
+        if "cookie_timeout" in updated:
+            self.components.cookie_client.set_timeout(ctx.options.cookie_timeout)
+        if "cookie_retries" in updated:
+            self.components.cookie_client.set_retries(ctx.options.cookie_retries)
+        if "cookie_pool_size" in updated:
+            self.components.cookie_client.set_pool_size(ctx.options.cookie_pool_size)
+        if "cookie_http2" in updated:
+            self.components.cookie_client.set_http2(ctx.options.cookie_http2)
+        if "mode" in updated:
+            self.components.cookie_client.set_proxy(upstream_proxy(ctx.options.mode))     # fetched through the upstream of mitmproxy
+
+
+    def running(self):
+        self.components.signal_channel.start(ctx.options.signal_port)
+        self.logger.info(f"[STARTUP] Addon running {time.perf_counter() - LOAD_START:.2f}s after the script was loaded")
+        # load the lexicon used to filter qrcode params while QRLogin is in progress, not in prepare()
+        threading.Thread(target=get_english_words, daemon=True).start()
+
+
+    def done(self):
+        self.components.signal_channel.stop()
+        self.polling_detector.close()
+        self.qrcode_decoder.close()
+        self.components.cookie_client.close()
+        self.traffic_recorder.close_capture()
+        self.traffic_recorder.close_log()
 
 
     
@@ -83,24 +201,136 @@ class Analyzer:
     def prepare(self):
         """
         Preparation for flaw detection:
-        1. Decodes QR code.
+        1. Selects the QR code among those decoded, or decodes the screenshot.
         2. Identifies polling request and associated qrid.
         3. Finds the request to create a QR code.
         4. Analyzes app flows to find the login request.
+        Steps 1-3 are skipped when the facts known from earlier audits of the site match the traffic.
         """
         self.logger.info("Starting preparation...")
 
-        self.qrcode_manager.decode_qrcode()
+        self.load_site_knowledge()
 
-        self.identify_polling_request_and_qrid()
+        if not self.reuse_known_polling():
+            self.qrcode_decoder.wait(timeout=30)
+            self.qrcode_manager.select_qrcode(self.traffic_recorder)
+            self.qrcode_manager.decode_qrcode()
 
-        self.find_create_qrcode_request()
+            self.identify_polling_request_and_qrid()
 
-        self.extract_cookie()
+        if not self.reuse_known_creation():
+            self.qrcode_decoder.wait(timeout=30)
+            self.find_create_qrcode_request()
+
+        if not self.reuse_known_cookie_source():
+            self.extract_cookie()
 
         self.analyze_app_flows_for_login_request()
 
 
+    def load_site_knowledge(self):
+        self.known_facts = self.site_knowledge.load_facts(self.url)
+        if self.known_facts:
+            self.print_log(f"[KNOWLEDGE] Known facts of the site: {self.known_facts}")
+        for audited_at, qrid, results in self.site_knowledge.get_results(self.url, limit=1):
+            self.print_log(f"[KNOWLEDGE] Last audit of the site at {audited_at}: {results}")
+
+
+    def reuse_known_polling(self):
+        """
+        Take the known polling endpoint and qrid field if the latest polls to it carry the same qrid
+        """
+        endpoint = self.known_facts.get("polling_endpoint")
+        qrid_name = self.known_facts.get("qrid_name_in_poll")
+        if not endpoint or not qrid_name:
+            return False
+        polls = [flow for flow in self.traffic_recorder.get_endpoint_flows(endpoint)
+                 if flow.request.method == self.known_facts.get("polling_method") and field_value(flow, qrid_name) is not None]
+        if len(polls) < MIN_POLLS:
+            self.print_log(f"[KNOWLEDGE] Known polling {endpoint} not found in the traffic")
+            return False
+        qrid_value = str(field_value(polls[-1], qrid_name))
+        polls = [flow for flow in polls if str(field_value(flow, qrid_name)) == qrid_value]
+        if len(polls) < MIN_POLLS:
+            self.print_log(f"[KNOWLEDGE] Known qrid {qrid_name} is not polled in the traffic")
+            return False
+
+        self.polling_manager.set_polling_flow(polls[0])
+        self.qrcode_manager.clear_qrid()
+        self.qrcode_manager.set_qrid(qrid_name, qrid_value)
+        self.qrcode_manager.set_qrid_name_in_poll(qrid_name)
+        self.print_log(f"[KNOWLEDGE] Reusing known polling flow: {str(polls[0])}, qrid: {self.qrcode_manager.get_qrid()}")
+        return True
+
+
+    def reuse_known_creation(self):
+        """
+        Take the known create qrcode endpoint if it carries the qrid in the known field
+        """
+        endpoint = self.known_facts.get("generation_endpoint")
+        flow_type = self.known_facts.get("generation_flow_type")
+        if not endpoint or not self.qrcode_manager.get_qrid():
+            return False
+        qrid_value = self.qrcode_manager.get_qrid_value()
+        for flow_info in self.traffic_recorder.get_candidate_flows(qrid_value, flow_type):
+            flow = flow_info[0]
+            if flow_info[1] != flow_type or flow.request.method != self.known_facts.get("generation_method"):
+                continue
+            if normalize_endpoint(flow.request.url) != endpoint:
+                continue
+            if search(flow, flow_type, qrid_value) == self.known_facts.get("qrid_name_in_creation"):
+                self.qrcode_manager.set_qrid_name_in_creation(self.known_facts["qrid_name_in_creation"])
+                self.qrcode_manager.set_create_qrcode_flow_info(flow_info)
+                self.print_log(f"[KNOWLEDGE] Reusing known create qrcode flow: {str(flow_info)}")
+                return True
+        self.print_log(f"[KNOWLEDGE] Known create qrcode flow {endpoint} does not carry the qrid")
+        return False
+
+
+    def reuse_known_cookie_source(self):
+        """
+        Take the known endpoint setting the cookie of the create qrcode request if it still sets it
+        """
+        endpoint = self.known_facts.get("cookie_source_endpoint")
+        create_qrcode_flow_info = self.qrcode_manager.get_create_qrcode_flow_info()
+        if not endpoint or create_qrcode_flow_info is None:
+            return False
+        cookie_dict = get_parsed_flow(create_qrcode_flow_info[0], "request").cookie_dict
+        if cookie_dict == {}:
+            return False
+        k, v = next(iter(cookie_dict.items()))
+        for flow, flow_type in self.traffic_recorder.get_candidate_flows(v, "response"):
+            if flow_type != "response" or normalize_endpoint(flow.request.url) != endpoint:
+                continue
+            headers_str = get_parsed_flow(flow, "response").headers_str
+            if k in headers_str and v in headers_str:
+                self.qrcode_manager.request_cookie_url = flow.request.url
+                self.print_log(f"[KNOWLEDGE] Reusing known cookie source: {flow.request.url}")
+                return True
+        return False
+
+
+    def save_site_knowledge(self, res):
+        """
+        Record the facts located by prepare() and the results of the audit
+        """
+        facts = {}
+        polling_flow = self.polling_manager.get_polling_flow()
+        if polling_flow is not None:
+            facts.update(polling_endpoint=normalize_endpoint(polling_flow.request.url), polling_method=polling_flow.request.method,
+                         qrid_name_in_poll=self.qrcode_manager.qrid_name_in_poll)
+        create_qrcode_flow_info = self.qrcode_manager.get_create_qrcode_flow_info()
+        if create_qrcode_flow_info is not None:
+            flow = create_qrcode_flow_info[0]
+            facts.update(generation_endpoint=normalize_endpoint(flow.request.url), generation_method=flow.request.method,
+                         generation_flow_type=create_qrcode_flow_info[1], qrid_name_in_creation=self.qrcode_manager.qrid_name_in_creation)
+        if self.qrcode_manager.request_cookie_url != "":
+            facts["cookie_source_endpoint"] = normalize_endpoint(self.qrcode_manager.request_cookie_url)
+        if facts:
+            self.site_knowledge.save_facts(self.url, facts)
+        self.site_knowledge.add_result(self.url, self.qrcode_manager.get_qrid(), res)
+
+
 
     def identify_polling_request_and_qrid(self):
         """
@@ -109,32 +339,39 @@ class Analyzer:
         if not self.qrcode_manager.get_qrid() or not self.polling_manager.get_polling_flow():
             self.qrcode_manager.filter_qrcode_params()
 
-            sorted_url_counts = self.traffic_recorder.sort_url_counts_by_frequency()
-            self.logger.info(f"Sorted filtered_url_counts: {sorted_url_counts}")
+            self.logger.info(f"Most requested endpoints: {self.traffic_recorder.top_endpoints(10)}")
+
+            ranked_endpoints = self.traffic_recorder.rank_endpoints()
+            candidate = self.polling_detector.get_candidate()
+            if candidate is not None:
+                # the endpoint spotted polling while traffic was flowing is tried first
+                self.logger.info(f"Polling endpoint spotted online: {candidate}")
+                ranked_endpoints = itertools.chain([(candidate.endpoint, candidate.count)], ranked_endpoints)
 
-            self.determine_polling_flow_and_qrid(sorted_url_counts)
+            self.determine_polling_flow_and_qrid(ranked_endpoints)
 
 
    
     
 
-    def determine_polling_flow_and_qrid(self, sorted_url_counts):
+    def determine_polling_flow_and_qrid(self, ranked_endpoints):
         """
-        Determine the polling flow and qrid by matching params with flows.
+        Determine the polling flow and qrid by matching params with flows,
+        trying the most requested endpoints first.
         """
-        url_flow_map = self.traffic_recorder.build_url_flow_map()
+        param_flow_ids = self.qrcode_manager.locate_qrcode_params(self.traffic_recorder)
 
-        for url, count in sorted_url_counts:
+        for url, count in ranked_endpoints:
             if self.polling_manager.get_polling_flow():
                 break
 
-            url_flows = url_flow_map.get(url, [])
+            url_flows = self.traffic_recorder.get_endpoint_flows(url)
 
             for flow in url_flows:
                 if flow.request.method == "OPTIONS":
                     continue
 
-                match_field_cnt = self.qrcode_manager.match_qrcode_params_with_flow(flow)
+                match_field_cnt = self.qrcode_manager.match_qrcode_params_with_flow(flow, param_flow_ids)
                 if match_field_cnt > 0:
                     self.process_matched_qrid(flow, match_field_cnt, url_flows)
                     if self.polling_manager.get_polling_flow():
@@ -215,7 +452,10 @@ class Analyzer:
         if self.qrcode_manager.get_qrid() and not self.qrcode_manager.get_create_qrcode_flow_info():
             self.logger.info("Searching create qrcode flow...")
 
-            for flow_info in self.traffic_recorder.get_flows():
+            qrid_value = list(self.qrcode_manager.get_qrid().values())[0]
+            if self.find_qrcode_image_flow(qrid_value):
+                return
+            for flow_info in self.traffic_recorder.get_candidate_flows(qrid_value):
                 flow = flow_info[0]
                 flow_type = flow_info[1]
                 if flow.request.method == "OPTIONS":
@@ -224,7 +464,7 @@ class Analyzer:
                     remove_params_from_url(flow.request.url) == remove_params_from_url(self.polling_manager.get_polling_url()) and
                     flow.request.method == self.polling_manager.get_polling_flow().request.method):
                     continue
-                field = search(flow, flow_type, list(self.qrcode_manager.get_qrid().values())[0])
+                field = search(flow, flow_type, qrid_value)
                 if field:
                     self.qrcode_manager.set_qrid_name_in_creation(field)
                     self.logger.info(f"Found qrid_name_in_creation: {field}")
@@ -233,6 +473,25 @@ class Analyzer:
                     break
 
     
+    def find_qrcode_image_flow(self, qrid_value):
+        """
+        The response carrying the image of the QR code holding qrid is the create qrcode flow
+        """
+        for flow_id, decoded_data in self.qrcode_manager.get_qrcode_flows():
+            if qrid_value not in decoded_data:
+                continue
+            flow_info = self.traffic_recorder.get_flow_info(flow_id, "response")
+            if flow_info is None:
+                continue
+            qrid_names = [k for k, v in flatten_nested_dict(extract_para(decoded_data)).items() if str(v) == qrid_value]
+            self.qrcode_manager.set_qrid_name_in_creation(qrid_names[0] if qrid_names else self.qrcode_manager.get_qrid_name())
+            self.logger.info(f"Found qrid_name_in_creation: {self.qrcode_manager.qrid_name_in_creation}")
+            self.qrcode_manager.set_create_qrcode_flow_info(flow_info)
+            self.logger.info(f"Found create qrcode flow carrying the QR code image: {str(flow_info)}")
+            return True
+        return False
+
+
     def extract_cookie(self):
         """
         Extract cookie from the request to create a QR code or else requests
@@ -242,7 +501,7 @@ class Analyzer:
         if create_qrcode_flow_info is not None:
             flow = create_qrcode_flow_info[0]
             flow_type = create_qrcode_flow_info[1]
-            cookie_dict = parse_cookie(flow, "request")
+            cookie_dict = get_parsed_flow(flow, "request").cookie_dict
 
             if cookie_dict != {}:
                 for flow_info in self.traffic_recorder.get_flows():
@@ -251,10 +510,11 @@ class Analyzer:
                     if flow_type == "request":
                         continue
                     has_found = False
+                    headers_str = get_parsed_flow(flow, "response").headers_str
                     for k, v in cookie_dict.items():
-                        if k not in str(flow.response.headers) or v not in str(flow.response.headers):
+                        if k not in headers_str or v not in headers_str:
                             break
-                        self.request_cookie_url = flow.request.url
+                        self.qrcode_manager.request_cookie_url = flow.request.url
                         has_found = True
                         break
                     if has_found == True:
@@ -267,7 +527,7 @@ class Analyzer:
         """
         if not self.app_flow_manager.get_login_request() and self.qrcode_manager.get_qrid():
             qrid_value = self.qrcode_manager.get_qrid_value()
-            for flow_info in self.app_flow_manager.get_app_flows():
+            for flow_info in self.app_flow_manager.get_candidate_app_flows(qrid_value, "request"):
                 flow = flow_info[0]
                 flow_type = flow_info[1]
                 if flow_type == "request" and search(flow, flow_type, qrid_value):
@@ -290,41 +550,48 @@ class Analyzer:
     
 
     def request(self, flow):
-        # if self.domain not in flow.request.url:
-        #     return
-        if is_login_done():
+        if self.components.signal_channel.is_login_done():
             self.traffic_recorder.write_log_request(flow)
             return
         
         if "Android" in flow.request.headers.get('User-Agent', ''):
             self.app_flow_manager.add_app_flow(flow, "request")
+            self.traffic_recorder.capture_event(flow, "request")
             self.traffic_recorder.write_log_request(flow)
             self.logger.info("[APP]Get request of app flow")
             self.logger.info("[APP]Request: " + str(flow.request))  
             return
+        if not self.flow_filter.allow_request(flow):
+            return
         self.num = self.num + 1
 
 
         self.traffic_recorder.write_log_request(flow)
 
         self.traffic_recorder.record_flow(flow, "request")
-        url = flow.request.url
-        self.traffic_recorder.update_url_counts(url)
+        self.polling_detector.observe_request(flow)
 
 
     def response(self, flow):
-        # if self.domain not in flow.request.url:
-        #     return
-        if is_login_done():
+        if self.components.replay_manager.resolve(flow):
+            self.logger.info("[REPLAY]Replayed flow completed: " + str(flow.request.url))
+
+        if self.components.signal_channel.is_login_done():
             self.traffic_recorder.write_log_request(flow)
             return
         
         if "Android" in flow.request.headers.get('User-Agent', ''):
             self.app_flow_manager.add_app_flow(flow, "response")
+            self.traffic_recorder.capture_event(flow, "response")
             self.traffic_recorder.write_log_response(flow)
             return
 
+        if not self.flow_filter.allow_response(flow):
+            self.traffic_recorder.end_capture(flow)
+            return
         self.traffic_recorder.write_log_response(flow)
+        self.polling_detector.observe_response(flow)
+        self.qrcode_decoder.submit(flow)
         self.traffic_recorder.record_flow(flow, "response")
 
         if flow.request == self.qrcode_manager.create_qrcode_flow_replay:
@@ -334,12 +601,19 @@ class Analyzer:
             self.logger.info("[REPLAY]Get response of replayed polling request" + str(flow.response))
         
 
+    def error(self, flow):
+        if self.components.replay_manager.resolve(flow):
+            self.logger.info("[REPLAY]Replayed flow failed: " + str(flow.error))
+        self.traffic_recorder.end_capture(flow)
+        
+
 
-if len(sys.argv) > 1:
-    url = sys.argv[4][4:]
-    print("url:", url)
-    debuggable = False
-    addons = [
-        Analyzer(url, debuggable)]
-else:
-    print("[!] No url argument provided.")
\ No newline at end of file
+if __name__.startswith("__mitmproxy_script__"):     # loaded by mitmproxy, not imported for offline analysis
+    if len(sys.argv) > 1:
+        url = sys.argv[4][4:]
+        print("url:", url)
+        debuggable = False
+        addons = [
+            Analyzer(url, debuggable)]
+    else:
+        print("[!] No url argument provided.")
\ No newline at end of file
@@ -0,0 +1,108 @@
+import re
+import time
+from urllib.parse import parse_qsl, quote, urlparse, urlunparse
+
+from capture import load_authorization
+from qrcode_scanner import wait_for_qrcode
+
+QRID_TOKEN_PATTERN = re.compile(r"[0-9A-Za-z_\-]+")
+
+
+class Authorizer:
+    '''
+    Stands in for the user scanning the QR code and authorizing the QRLogin with the vendor app
+    '''
+    interactive = True
+
+    def authorize(self, driver, decoded_data=None):
+        """
+        Authorize the QRLogin shown by driver, decoded_data is the payload of its QR code if already decoded.
+        Returns whether the QRLogin was authorized.
+        """
+        raise NotImplementedError
+
+
+class ManualAuthorizer(Authorizer):
+    '''
+    The user scans the QR code with the app and confirms on the console
+    '''
+    def authorize(self, driver, decoded_data=None):
+        input("\033[1;32mAfter finishing QRLogin, press Enter to start FLAW DETECTION...\033[0m")
+        return True
+
+
+def find_qrid(decoded_data, qrid_name, old_value):
+    '''
+    Find the qrid in the payload of a QR code: the param named qrid_name,
+    otherwise the last token as long as the recorded qrid
+    '''
+    if old_value and old_value in decoded_data:
+        return old_value
+    params = dict(parse_qsl(urlparse(decoded_data).query)) if "://" in decoded_data else {}
+    if qrid_name in params:
+        return params[qrid_name]
+    tokens = [t for t in QRID_TOKEN_PATTERN.findall(decoded_data) if len(t) == len(old_value)]
+    return tokens[-1] if tokens else None
+
+
+class ReplayAuthorizer(Authorizer):
+    '''
+    Replays the recorded app authorization request of a site (saved by the addon in captures/authorization_xxx.mitm)
+    with the qrid of the QR code currently shown, so that QRLogin runs without a user or a phone.
+    The request is sent through the audit proxy, where the addon records it as an app flow,
+    or directly to target (scheme://host:port), e.g. a local stand-in server.
+    '''
+    interactive = False
+
+    def __init__(self, authorization_file, proxy=None, target=None, qrcode_timeout=60, settle=5):
+        self.flow, self.qrid_name, self.qrid_value = load_authorization(authorization_file)
+        self.proxy = proxy if target is None else None
+        self.target = target
+        self.qrcode_timeout = qrcode_timeout
+        self.settle = settle    # seconds for the page to notice the authorization through polling
+
+
+    def authorize(self, driver, decoded_data=None):
+        if decoded_data is None:
+            decoded_data = wait_for_qrcode(driver, self.qrcode_timeout)
+        if decoded_data is None:
+            print(f"[AUTHORIZER] No QR code decoded from the page in {self.qrcode_timeout}s")
+            return False
+
+        qrid = find_qrid(decoded_data, self.qrid_name, self.qrid_value)
+        if qrid is None:
+            print(f"[AUTHORIZER] No qrid found in the QR code: {decoded_data}")
+            return False
+
+        import requests
+        method, url, headers, content = self.build_request(qrid)
+        try:
+            proxies = {"http": self.proxy, "https": self.proxy} if self.proxy else None
+            response = requests.request(method, url, headers=headers, data=content, proxies=proxies, verify=False, timeout=30)
+        except requests.RequestException as e:
+            print(f"[AUTHORIZER] Authorization request failed: {e}")
+            return False
+        print(f"[AUTHORIZER] Authorized qrid {qrid}: {method} {url} -> {response.status_code}")
+
+        time.sleep(self.settle)
+        return response.ok
+
+
+    def build_request(self, qrid):
+        """
+        The recorded authorization request, with the recorded qrid replaced by qrid
+        """
+        request = self.flow.request
+        old_value = self.qrid_value
+        url = request.url
+        content = request.content or b""
+        headers = {k: v for k, v in request.headers.items(multi=False) if k.lower() not in ("content-length", "content-encoding", "host")}
+        if old_value:
+            url = url.replace(old_value, qrid).replace(quote(old_value, safe=''), quote(qrid, safe=''))
+            content = content.replace(old_value.encode(), qrid.encode())
+            headers = {k: v.replace(old_value, qrid) for k, v in headers.items()}
+
+        if self.target is not None:
+            target = urlparse(self.target)
+            url = urlunparse(urlparse(url)._replace(scheme=target.scheme, netloc=target.netloc))
+        return request.method, url, headers, content
@@ -1,16 +1,35 @@
+from value_index import ValueIndex
+from flow_store import FlowStore
+from utils import invalidate_parsed_flow
+
+
 class AppFlowManager:
     def __init__(self):
         self.app_flows = []
+        self.value_index = ValueIndex()
+        self.flow_store = FlowStore()   # app traffic is small, static bodies are dropped
         self.login_request = []  
 
     def add_app_flow(self, flow, type):
-        self.app_flows.append([flow, type])
+        self.value_index.add_flow(flow, type, len(self.app_flows))
+        self.app_flows.append([self.flow_store.add(flow, type), type])
+
+    def release(self):
+        for record, flow_type in self.app_flows:
+            invalidate_parsed_flow(record, flow_type)
+        self.value_index = ValueIndex()
 
     def add_login_request(self, request):
         self.login_request.append(request)
 
     def get_app_flows(self):
         return self.app_flows
+
+    def get_candidate_app_flows(self, value, flow_type=None):
+        positions = self.value_index.lookup(value, flow_type)
+        if positions is None:
+            return self.app_flows
+        return [self.app_flows[position] for position in positions]
     
     def get_login_request(self):
         return self.login_request
\ No newline at end of file
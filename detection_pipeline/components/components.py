@@ -2,6 +2,9 @@ from urllib.parse import urlparse
 from components.polling_manager import PollingManager
 from components.qrcode_manager import QRCodeManager
 from components.app_flow_manager import AppFlowManager
+from components.replay_manager import ReplayManager
+from components.cookie_client import CookieClient
+from signal_channel import SignalChannel
 
 
 class Components:
@@ -12,3 +15,6 @@ class Components:
         self.polling_manager = PollingManager()
         self.qrcode_manager = QRCodeManager(logger)   # including generation request for QR code
         self.app_flow_manager = AppFlowManager()
+        self.replay_manager = ReplayManager(logger)
+        self.signal_channel = SignalChannel(logger)
+        self.cookie_client = CookieClient(logger)
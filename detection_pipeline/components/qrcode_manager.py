@@ -1,9 +1,24 @@
 import os
+import threading
 
 from qrcode_handler import QRCodeHandler
 from utils import *
 
 
+def relevant_params(params):
+    '''
+    Flattened params of a QR code without the fields that cannot be a qrid: words, short values, the language
+    '''
+    params = flatten_nested_dict(params)
+    keys_to_delete = []
+    for key, value in params.items():
+        if is_english_phrase(str(value)) or len(str(value)) <= 2 or str(value) == 'zh-CN':
+            keys_to_delete.append(key)
+    for key in keys_to_delete:
+        del params[key]
+    return params
+
+
 class QRCodeManager:
     def __init__(self, logger):
         self.logger = logger
@@ -19,6 +34,9 @@ class QRCodeManager:
         self.create_qrcode_flow_replay = None  
 
         self.screenshot_path = "./intermediate_files/screenshot.png"
+        self.decoded_qrcodes = []   # payloads of the QR codes decoded from the live page and from responses, in decoding order
+        self.qrcode_flows = []      # (flow id, payload) of every response carrying a QR code
+        self.lock = threading.Lock()
 
     def set_qrid(self, key, value):
         self.qrid[key] = value
@@ -65,6 +83,44 @@ class QRCodeManager:
     
 
 
+    def get_qrcode_flows(self):
+        return self.qrcode_flows
+
+    def add_decoded_qrcode(self, decoded_data, flow_id=None):
+        """
+        Add a candidate QR code decoded from the live page or from the response of flow_id,
+        its params are used once select_qrcode() picks it
+        """
+        with self.lock:
+            if flow_id is not None:
+                self.qrcode_flows.append((flow_id, decoded_data))
+            if decoded_data in self.decoded_qrcodes:
+                return
+            self.decoded_qrcodes.append(decoded_data)
+            source = "page" if flow_id is None else "traffic"
+            self.logger.info(f"[QRCODE] QR code {len(self.decoded_qrcodes)} decoded from the {source}: {decoded_data}")
+
+
+    def select_qrcode(self, traffic_recorder):
+        """
+        Take the params of the decoded QR code whose values are carried by the most recorded requests,
+        the latest decoded one on a tie, e.g. the refreshed QR code that is polled for rather than another QR code of the page
+        """
+        with self.lock:
+            candidates = list(self.decoded_qrcodes)
+        if self.qrcode_params or not candidates:
+            return
+
+        selected, selected_count = None, -1
+        for decoded_data in candidates:
+            params = relevant_params(extract_para(decoded_data))
+            count = sum(1 for value in params.values() if traffic_recorder.lookup_flow_ids(str(value), "request"))
+            if count >= selected_count:
+                selected, selected_count = decoded_data, count
+        self.qrcode_params = extract_para(selected)
+        self.logger.info(f"[QRCODE] Selected QR code {selected} out of {len(candidates)}, {selected_count} params in requests: {self.qrcode_params}")
+
+
     def decode_qrcode(self):
         """
         Decodes the QR code from screenshot
@@ -78,22 +134,30 @@ class QRCodeManager:
         """
         Filter out irrelevant fields from qrcode_params
         """
-        self.qrcode_params = flatten_nested_dict(self.qrcode_params)
-        keys_to_delete = []
-        for key, value in self.qrcode_params.items():
-            if is_english_phrase(str(value)) or len(str(value)) <= 2 or str(value) == 'zh-CN':
-                keys_to_delete.append(key)
-        for key in keys_to_delete:
-            del self.qrcode_params[key]
+        self.qrcode_params = relevant_params(self.qrcode_params)
         self.logger.info(f"Filtered qrcode_params: {self.qrcode_params}")
 
 
-    def match_qrcode_params_with_flow(self, flow):
+    def locate_qrcode_params(self, traffic_recorder):
+        """
+        Look up the ids of recorded requests carrying each qrcode param
+        """
+        param_flow_ids = {}
+        for key, value in self.qrcode_params.items():
+            param_flow_ids[key] = traffic_recorder.lookup_flow_ids(str(value), "request")
+        return param_flow_ids
+
+
+    def match_qrcode_params_with_flow(self, flow, param_flow_ids=None):
         """
         Match qrcode_params with a given flow
         """
         match_field_cnt = 0
         for key, value in self.qrcode_params.items():
+            if param_flow_ids is not None:
+                flow_ids = param_flow_ids.get(key)
+                if flow_ids is not None and flow.id not in flow_ids:
+                    continue
             qrid_name = str(search(flow, "request", str(value)))
             if qrid_name:
                 match_field_cnt += 1
@@ -0,0 +1,54 @@
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from mitmproxy import ctx
+
+
+class ReplayManager:
+    def __init__(self, logger, timeout=30):
+        self.logger = logger
+        self.timeout = timeout
+        self.pending = {}   # flow.id -> Future resolved with the replayed response
+        self.lock = threading.Lock()
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+    def replay(self, flow):
+        """
+        Replay a flow through mitmproxy, returning a future of its response
+        """
+        future = Future()
+        with self.lock:     # checks may replay concurrently, hand flows to mitmproxy one at a time
+            self.pending[flow.id] = future
+            ctx.master.commands.call("replay.client", [flow])
+        return future
+
+    def resolve(self, flow):
+        """
+        Resolve the future of a replayed flow, called from the response/error hooks
+        """
+        with self.lock:
+            future = self.pending.pop(flow.id, None)
+        if future is None:
+            return False
+        if not future.done():
+            future.set_result(flow.response)
+        return True
+
+    def wait(self, flow, timeout=None):
+        """
+        Wait for the response of a replayed flow, returns None if the deadline passes
+        """
+        with self.lock:
+            future = self.pending.get(flow.id)
+        if future is None:
+            return flow.response
+
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            self.logger.info(f"[REPLAY] No response within {timeout}s: {flow.request.url}")
+            return None
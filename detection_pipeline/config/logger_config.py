@@ -3,7 +3,7 @@ import os
 import urllib.parse
 
 class LoggerConfig:
-    def __init__(self, url):
+    def __init__(self, url, prefix=""):
         self.url = url
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(level=logging.DEBUG)
@@ -13,7 +13,7 @@ class LoggerConfig:
             self.logger.removeHandler(handler)
 
         os.makedirs("./logs", exist_ok=True)
-        fh = logging.FileHandler(f"./logs/log_{urllib.parse.quote(url, safe='')}.log", mode='w')
+        fh = logging.FileHandler(f"./logs/log_{prefix}{urllib.parse.quote(url, safe='')}.log", mode='w')
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         fh.setFormatter(formatter)
         self.logger.addHandler(fh)
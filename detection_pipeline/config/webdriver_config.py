@@ -1,15 +1,22 @@
 # selenium/webdriver_config.py
 
-from selenium import webdriver
+def configure_webdriver(proxy_server="localhost:7778", headless=False):
+    from selenium import webdriver
 
-def configure_webdriver(proxy_server="localhost:7778"):
     options = webdriver.ChromeOptions()
     options.add_argument(f"--proxy-server={proxy_server}")
     options.add_argument('--disable-blink-features=AutomationControlled')
     options.add_argument('--ignore-certificate-errors')
     options.page_load_strategy = 'none'
+    if headless:
+        # no display, e.g. unattended audits on a server
+        options.add_argument('--headless=new')
+        options.add_argument('--window-size=1920,1080')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
 
     driver = webdriver.Chrome(options=options)
-    driver.maximize_window()
+    if not headless:
+        driver.maximize_window()
     
     return driver
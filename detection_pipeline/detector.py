@@ -3,19 +3,22 @@ import string
 import json
 import re
 
-from mitmproxy import ctx
 import configparser
 from urllib.parse import parse_qsl, urlparse, quote
 import urllib
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from utils import *
+from leakage_scanner import LeakageScanner
+from traffic_qrcode_decoder import decode_message_qrcodes
 
 RED = "\033[31m" 
 GREEN = "\033[32m" 
 YELLOW = "\033[33m"  
 RESET = "\033[0m"
 
+OFFLINE_CHECKS = ["f3", "f4", "f5", "f6"]
+
 class Detector:
     def __init__(self, components, traffic_recorder, logger):
         self.components = components
@@ -26,11 +29,15 @@ class Detector:
         self.polling_manager = self.components.polling_manager
         self.qrcode_manager = self.components.qrcode_manager
         self.app_flow_manager = self.components.app_flow_manager
+        self.replay_manager = self.components.replay_manager
+        self.cookie_client = self.components.cookie_client
+
+        self.leakage_hits = []
 
 
     def is_ready_for_detection(self):
         self.logger.info("Ready for detection? " + str(self.polling_manager.polling_flow) + str(self.qrcode_manager.qrid) + str(self.qrcode_manager.create_qrcode_flow_info))
-        if not is_login_done():
+        if not self.components.signal_channel.is_login_done():
             return False
         self.logger.info("login done")
 
@@ -49,25 +56,41 @@ class Detector:
 
 
 
-    def detect(self):
+    def detect(self, offline=False):
+        '''
+        Run the flaw checks, offline only those not replaying flows (F3-F6), F1/F2 are then None
+        '''
         self.logger.info("Start detecting flaw...")
 
-        f1 = self.F1_Unbound_session_id()
+        checks = [
+            ("f1_new_qrid", self.F1_derive_new_qrid, []),
+            ("f1", self.F1_Unbound_session_id, ["f1_new_qrid"]),
+            ("f2", self.F2_Reusable_qrcode, []),
+            ("f3", self.F3_Predictable_qr_id, []),
+            ("f4", self.F4_Controllable_qr_id, []),
+            ("f5", self.F5_Invalid_token_Validation, []),
+            ("f6", self.F6_Sensitive_Data_Leakage, []),
+        ]
+        if offline:
+            checks = [check for check in checks if check[0] in OFFLINE_CHECKS]
+        results = self.run_checks(checks)
+
+        f1 = results.get("f1")
         self.print_log(RED + "Detect flaw F1 unbound sessionid: " + str(f1) + RESET)
 
-        f2 = self.F2_Reusable_qrcode()
+        f2 = results.get("f2")
         self.print_log(RED + "Detect flaw F2 resuable qrcode: " + str(f2) + RESET)
 
-        f3 = self.F3_Predictable_qr_id()
+        f3 = results["f3"]
         self.print_log(RED + "Detect flaw F3 predictable qrid: " + str(f3) + RESET)
         
-        f4 = self.F4_Controllable_qr_id()
+        f4 = results["f4"]
         self.print_log(RED + "Detect flaw F4 controllable qrid: " + str(f4) + RESET)
 
-        f5 = self.F5_Invalid_token_Validation()
+        f5 = results["f5"]
         self.print_log(RED + "Detect flaw F5 invalid token validation: " + str(f5) + RESET)
         
-        f6_data = self.F6_Sensitive_Data_Leakage()
+        f6_data = results["f6"]
         self.print_log(RED + "Detect flaw F6 sensitive data leakage: " + str(f6_data) + RESET)
         f6 = False
         if f6_data:
@@ -77,7 +100,10 @@ class Detector:
 
 
 
-    def F1_Unbound_session_id(self):
+    def F1_derive_new_qrid(self):
+        """
+        F1 step 1: derive a new qrid, by altering a client-generated qrid or replaying the create qrcode request
+        """
         print("======= Start detecting flaw F1: Unbound session_id =======")
         self.logger.info("Start detecting flaw F1: Unbound session_id")
 
@@ -110,27 +136,22 @@ class Detector:
                             qrid_name = self.qrcode_manager.qrid_name_in_creation
                             self.qrcode_manager.set_new_qrid(qrid_name, newvalue)
                             break
-                self.print_log("create newqrid: " + str(self.newqrid))
+                self.print_log("create newqrid: " + str(self.qrcode_manager.get_newqrid()))
             
 
             newflow2 = flow.copy()
-            try:
-                if self.qrcode_manager.request_cookie_url != "":
-                    response =  requests.get(self.qrcode_manager.request_cookie_url, timeout=10)
-                else:
-                    response = requests.get(self.url, timeout=10)
-            except requests.Timeout:
-                print("Request timeout!")
-                response = None
+            if self.qrcode_manager.request_cookie_url != "":
+                new_cookie = self.cookie_client.fetch_cookies(self.qrcode_manager.request_cookie_url)
+            else:
+                new_cookie = self.cookie_client.fetch_cookies(self.url)
 
 
-            if response is None:
+            if new_cookie is None:
                 cookie_header = ""
             else:
-                resp_cookie = response.cookies
-                new_cookie = {c.name: c.value for c in resp_cookie}
                 cookie_header = "; ".join([f"{name}={value}" for name, value in new_cookie.items()])
             newflow2.request.headers["Cookie"] = cookie_header
+            invalidate_parsed_flow(newflow2)
 
 
             if self.qrcode_manager.newqrid != {}:
@@ -139,22 +160,23 @@ class Detector:
                 qrid_name = self.qrcode_manager.get_qrid_name()
                 newflow2 = self.replace_field(newflow2, old_value, new_value, qrid_name)
             self.qrcode_manager.create_qrcode_flow_replay = newflow2
-            ctx.master.commands.call("replay.client", [newflow2])
+            self.replay_manager.replay(newflow2)
 
         
-        while self.qrcode_manager.newqrid == {} and self.qrcode_manager.create_qrcode_flow_replay.response is None:
+        if self.qrcode_manager.newqrid == {}:
             print("Waiting for replayed create qrcode request response...")
-            time.sleep(0.5)
+            self.replay_manager.wait(self.qrcode_manager.create_qrcode_flow_replay)
         
 
         if self.qrcode_manager.newqrid == {} and self.qrcode_manager.create_qrcode_flow_replay.response is not None:
             self.logger.info("[REPLAY]Get response of replayed create qrcode request" + str(self.qrcode_manager.create_qrcode_flow_replay.response))
-            content_dict = parse_content(self.qrcode_manager.create_qrcode_flow_replay.response)
+            parsed_replay = get_parsed_flow(self.qrcode_manager.create_qrcode_flow_replay, "response")
+            content_dict = parsed_replay.content_dict
             self.logger.info("[REPLAY]content_dict: " + str(content_dict))
             self.logger.info("[DETECT]qrid: " + str(self.qrcode_manager.get_qrid()))
             qrid_name = self.qrcode_manager.qrid_name_in_creation      
             old_value = self.qrcode_manager.get_qrid_value()
-            content_dict = flatten_nested_dict(content_dict)
+            content_dict = parsed_replay.flatten_dict
             for key, value in content_dict.items():
                 if isinstance(value, dict):
                     for k1, v1 in value.items():
@@ -164,13 +186,34 @@ class Detector:
                     self.qrcode_manager.set_new_qrid(key, value)
 
             if self.qrcode_manager.get_newqrid() == {}:
-                cookie_dict = parse_cookie(self.qrcode_manager.create_qrcode_flow_replay, "response")
+                cookie_dict = parsed_replay.cookie_dict
                 for key, value in cookie_dict.items():
                         if key == qrid_name and value != old_value:
                             self.qrcode_manager.set_new_qrid(key, value)
 
+            if self.qrcode_manager.get_newqrid() == {}:
+                # the create qrcode request may return the image of the QR code
+                for decoded_data in decode_message_qrcodes(self.qrcode_manager.create_qrcode_flow_replay.response):
+                    value = flatten_nested_dict(extract_para(decoded_data)).get(qrid_name)
+                    if value and str(value) != old_value:
+                        self.qrcode_manager.set_new_qrid(qrid_name, str(value))
+                        break
+
             self.logger.info("[REPLAY] Found new qrid: " + str(self.qrcode_manager.get_newqrid()))
 
+        return True
+
+
+
+    def F1_Unbound_session_id(self, new_qrid_ready=None):
+        """
+        F1 step 2: replay the polling request with the new qrid and check whether it is accepted
+        """
+        if new_qrid_ready is None:
+            new_qrid_ready = self.F1_derive_new_qrid()
+        if not new_qrid_ready:
+            return False
+
         newqrid = self.qrcode_manager.get_newqrid()
         if newqrid != {} and self.polling_manager.new_polling_flow_replay is None:     
             qrid_name = self.qrcode_manager.get_newqrid_name()
@@ -182,34 +225,34 @@ class Detector:
             newpollingflow = self.replace_field(newpollingflow, old_value, new_value, qrid_name)
 
             print("[REPLAY] send replayed polling request")
-            ctx.master.commands.call("replay.client", [newpollingflow])
+            self.replay_manager.replay(newpollingflow)
 
             self.polling_manager.new_polling_flow_replay = newpollingflow
 
 
-        while self.polling_manager.new_polling_flow_replay is not None and self.polling_manager.new_polling_flow_replay.response is None:
+        if self.polling_manager.new_polling_flow_replay is not None:
             print("Waiting for replayed polling request response...")
-            time.sleep(0.5)
+            self.replay_manager.wait(self.polling_manager.new_polling_flow_replay)
 
 
         if self.polling_manager.new_polling_flow_replay is not None and self.polling_manager.new_polling_flow_replay.response is not None:  
-            legal_response = None
+            legal_flow = None
             flows = self.traffic_recorder.get_flows()
             for flow_info in flows:
                 flow = flow_info[0]
                 flow_type = flow_info[1]
                 if flow_type == "response":
                     if flow.request.url == self.polling_manager.polling_url and flow.request.method == self.polling_manager.polling_flow.request.method:
-                        legal_response = flow.response
+                        legal_flow = flow
                         if not flow.response.content:
                             continue
-                        self.logger.info("Found legal response: " + str(decode_content(flow.response.content)))
+                        self.logger.info("Found legal response: " + str(get_parsed_flow(flow, "response").text))
                         break
-            replay_response = self.polling_manager.new_polling_flow_replay.response
-            self.logger.info("Replayed new polling response: " + str(decode_content(replay_response.content)))
+            replay_flow = self.polling_manager.new_polling_flow_replay
+            self.logger.info("Replayed new polling response: " + str(get_parsed_flow(replay_flow, "response").text))
 
-            parsed_legal_response = parse_content(legal_response)
-            parsed_replay_response = parse_content(replay_response)
+            parsed_legal_response = get_parsed_flow(legal_flow, "response").content_dict
+            parsed_replay_response = get_parsed_flow(replay_flow, "response").content_dict
             self.print_log("F1: parsed_legal_response: " + str(parsed_legal_response))
             self.print_log("F1: parsed_replay_response: " + str(parsed_replay_response))
             legal_response_content = self.filter_response_content(parsed_legal_response)
@@ -241,31 +284,29 @@ class Detector:
         if polling_flow_replay is None:
             copy_polling_flow = self.polling_manager.get_polling_flow().copy()
             print("[REPLAY] send replayed copy polling request")
-            ctx.master.commands.call("replay.client", [copy_polling_flow])
+            self.replay_manager.replay(copy_polling_flow)
             polling_flow_replay = copy_polling_flow
 
-        while polling_flow_replay is not None and polling_flow_replay.response is None:
-            print("Waiting for replayed copy polling request response...")
-            time.sleep(0.5)
+        print("Waiting for replayed copy polling request response...")
+        self.replay_manager.wait(polling_flow_replay)
 
         if polling_flow_replay is not None and polling_flow_replay.response is not None:
-            success_response = None
+            success_flow = None
             flows = self.traffic_recorder.get_flows()
             for flow_info in flows[::-1]:
                 flow = flow_info[0]
                 flow_type = flow_info[1]
                 if flow_type == "response":
                     if remove_params_from_url(flow.request.url) == remove_params_from_url(self.polling_manager.polling_url):
-                        success_response = flow.response
-                        self.polling_manager.set_login_success_response(success_response)
-                        self.logger.info("F2: Found success response: " + str(decode_content(flow.response.content)))
+                        success_flow = flow
+                        self.polling_manager.set_login_success_response(flow.response)
+                        self.logger.info("F2: Found success response: " + str(get_parsed_flow(flow, "response").text))
                         break
-            replay_response = polling_flow_replay.response
-            self.logger.info("F2: Replayed polling response: " + str(decode_content(replay_response.content)))
+            self.logger.info("F2: Replayed polling response: " + str(get_parsed_flow(polling_flow_replay, "response").text))
 
 
-            parsed_success_response = parse_content(success_response)
-            parsed_replay_response = parse_content(replay_response)
+            parsed_success_response = get_parsed_flow(success_flow, "response").content_dict
+            parsed_replay_response = get_parsed_flow(polling_flow_replay, "response").content_dict
             self.logger.info("F2: parsed_success_response: " + str(parsed_success_response))
             self.logger.info("F2: parsed_replay_response: " + str(parsed_replay_response))
             
@@ -322,7 +363,7 @@ class Detector:
                 flow = flow_info[0]
                 flow_type = flow_info[1]
                 if flow_type == "request":
-                    content = decode_content(flow.request.content)
+                    content = get_parsed_flow(flow, "request").text
                     if phone_num in content:
                         self.logger.info("Flaw F5: Invalid token Validation, phone_num")
                         self.logger.info(f"Flaw F5: Invalid token Validation, {str(flow.request.url)}\n{str(content)}")
@@ -340,27 +381,40 @@ class Detector:
     def F6_Sensitive_Data_Leakage(self):
         config = configparser.ConfigParser()
         config.read('credential.ini')      
-        start_search_flag = False
         leaked_info = []
         flows = self.traffic_recorder.get_flows()
-        for field, value in config.items('Credentials'):
-            for flow_info in flows:
-                flow = flow_info[0]
-                flow_type = flow_info[1]
-                if flow_type == "response":     
-                    if flow.request.url == self.polling_manager.get_polling_url(): 
-                        start_search_flag = True
-                    if not start_search_flag:
-                        continue
-
-                    if flow.request.method == "GET" and flow.request.url.endswith(('.jpg', '.png', '.css', '.js')):
-                        continue
-
-                    if search(flow, flow_type, value) != "":
-                        leaked_info.append(field)
-                        self.logger.info(f"Flaw F6: Sensitive Data Leakage, {field}")
-                        self.logger.info(f"Flaw F6: Sensitive Data Leakage, {str(flow.request.url)}\n{str(decode_content(flow.response.content))}")
-                        break
+
+        start_position = None
+        for position, flow_info in enumerate(flows):
+            if flow_info[1] == "response" and flow_info[0].request.url == self.polling_manager.get_polling_url():
+                start_position = position
+                break
+        if start_position is None:
+            return leaked_info
+
+        credentials = dict(config.items('Credentials'))
+        scanner = LeakageScanner(credentials)
+        leaked_fields = set()
+        for flow_info in flows[start_position:]:
+            flow = flow_info[0]
+            flow_type = flow_info[1]
+            if flow_type != "response":
+                continue
+            if flow.request.method == "GET" and flow.request.url.endswith(('.jpg', '.png', '.css', '.js')):
+                continue
+
+            hits = scanner.scan_flow(flow, flow_type)
+            for hit in hits:
+                if hit["masked"]:
+                    self.logger.info(f"[F6] Masked {hit['field']} at {hit['location']}:{hit['offset']}, {hit['url']}")
+                    continue
+                leaked_fields.add(hit["field"])
+                self.logger.info(f"Flaw F6: Sensitive Data Leakage, {hit['field']} ({hit['encoding']}) at {hit['location']}:{hit['offset']}, {hit['url']}")
+            if any(not hit["masked"] for hit in hits):
+                self.logger.info(f"Flaw F6: Sensitive Data Leakage, {str(flow.request.url)}\n{str(get_parsed_flow(flow, flow_type).text)}")
+            self.leakage_hits.extend(hits)
+
+        leaked_info = [field for field in credentials if field in leaked_fields]
         return leaked_info
         
 
@@ -414,9 +468,33 @@ class Detector:
                 cookie_dict[key] = new_value
         new_cookie_header = "; ".join([f"{name}={value}" for name, value in cookie_dict.items()])
         flow.request.headers["Cookie"] = new_cookie_header
+        invalidate_parsed_flow(flow)
         return flow
 
 
+    def run_checks(self, checks):
+        """
+        Run the flaw checks concurrently, each one starting once its dependencies are done.
+        checks: list of (name, check function, dependency names), dependencies listed first
+        Dependency results are passed to the check function as arguments.
+        """
+        futures = {}
+        with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+            for name, check, dependencies in checks:
+                dependency_futures = [futures[dependency] for dependency in dependencies]
+                futures[name] = executor.submit(self.run_check, name, check, dependency_futures)
+        return {name: future.result() for name, future in futures.items()}
+
+
+    def run_check(self, name, check, dependency_futures):
+        args = [future.result() for future in dependency_futures]
+        try:
+            return check(*args)
+        except Exception as e:
+            self.logger.exception(f"[DETECT] check {name} failed: {e}")
+            return False
+
+
     def print_log(self, content):
         print(content)
         self.logger.info(content)
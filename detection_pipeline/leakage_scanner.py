@@ -0,0 +1,74 @@
+import base64
+import json
+import re
+from urllib.parse import quote, quote_plus
+from utils import *
+
+MIN_ENCODED_LEN = 4
+
+
+def credential_variants(value):
+    '''
+    Encoded forms of a credential value as it may appear in traffic
+    '''
+    value = str(value)
+    variants = {value: "plain"}
+
+    for encoded in (quote(value, safe=''), quote_plus(value, safe='')):
+        variants.setdefault(encoded, "url-encoded")
+
+    b64 = base64.b64encode(value.encode()).decode()
+    for encoded in (b64, b64.rstrip("="), base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")):
+        variants.setdefault(encoded, "base64")
+
+    escaped = json.dumps(value)[1:-1]
+    variants.setdefault(escaped, "unicode-escaped")
+    variants.setdefault(re.sub(r"\\u([0-9a-f]{4})", lambda m: "\\u" + m.group(1).upper(), escaped), "unicode-escaped")
+
+    # masked forms (138****5678, 110101********1234) are what a site should show, they are reported apart from leaks
+    if value.isdigit() and len(value) >= 7:
+        for prefix, suffix in ((3, 4), (6, 4)):
+            if prefix + suffix < len(value):
+                variants.setdefault(value[:prefix] + "*" * (len(value) - prefix - suffix) + value[-suffix:], "masked")
+        variants.setdefault(value[:3] + "****" + value[-4:], "masked")
+
+    return variants
+
+
+class LeakageScanner:
+    '''
+    Scans flows for all credential values and their encoded variants, with str.find for each distinct variant
+    '''
+    def __init__(self, credentials):
+        self.variants = {}      # variant -> [(field, encoding)]
+        for field, value in credentials.items():
+            for variant, encoding in credential_variants(value).items():
+                # short plain values are still looked for, as search() did; short encodings would match anywhere
+                if variant and (encoding == "plain" or len(variant) >= MIN_ENCODED_LEN):
+                    self.variants.setdefault(variant, []).append((field, encoding))
+
+
+    def iter_matches(self, text):
+        """
+        Yield (offset, (field, encoding)) for the first occurrence of each variant in text
+        """
+        for variant, payloads in self.variants.items():
+            offset = text.find(variant)
+            if offset != -1:
+                for payload in payloads:
+                    yield offset, payload
+
+
+    def scan_flow(self, flow, flow_type="response"):
+        """
+        Return every leakage hit in the body and headers of a flow, with "masked" set for masked forms.
+        Hits keep the flow id and URL, not the flow, so they can be held after the flow is released
+        """
+        parsed = get_parsed_flow(flow, flow_type)
+        hits = []
+        locations = [("body", parsed.text)] + [(f"header:{k}", str(v)) for k, v in parsed.headers]
+        for location, text in locations:
+            for offset, (field, encoding) in self.iter_matches(text):
+                hits.append({"field": field, "encoding": encoding, "masked": encoding == "masked", "flow_id": flow.id,
+                             "url": flow.request.url, "location": location, "offset": offset})
+        return hits
@@ -0,0 +1,30 @@
+import argparse
+import os
+
+from analyzer import Analyzer
+from capture import CAPTURE_DIR, capture_paths, read_capture, replay_capture
+
+
+def analyze_capture(url, capture_dir=CAPTURE_DIR):
+    '''
+    Rebuild the analysis state from a capture and run detection without proxy or browser
+    '''
+    flow_path, index_path = capture_paths(url, capture_dir)
+    capture_url, events = read_capture(flow_path, index_path)
+    print(f"Loaded {len(events)} events of {capture_url} from {flow_path}")
+
+    analyzer = Analyzer(capture_url or url, live=False)
+    replay_capture(analyzer, events)
+
+    screenshot_path = os.path.splitext(flow_path)[0] + ".png"
+    return analyzer.run_offline(screenshot_path if os.path.exists(screenshot_path) else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run flaw detection (F3-F6) over a captured QRLogin session")
+    parser.add_argument("urls", nargs="+", help="URLs whose captures are analyzed")
+    parser.add_argument("--capture-dir", default=CAPTURE_DIR, help="directory of the captures")
+    args = parser.parse_args()
+
+    for url in args.urls:
+        analyze_capture(url, args.capture_dir)
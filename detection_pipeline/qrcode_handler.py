@@ -1,31 +1,69 @@
-
-import sys
+import argparse
+import hashlib
+import threading
+import urllib.parse
 from config.webdriver_config import configure_webdriver
-import cv2
-from pyzbar.pyzbar import decode
 from utils import extract_para
+from signal_channel import DEFAULT_SIGNAL_PORT, send_signal
+from qrcode_scanner import decode_image, find_page_qrcode_images
+from authorizer import ManualAuthorizer, ReplayAuthorizer
+
+
+QR_POLL_INTERVAL = 1         # seconds between two scans of the page
+QR_WAIT_TIMEOUT = 60         # seconds to wait for a QR code before falling back to a manual screenshot
 
 
 class QRCodeHandler:
-    def __init__(self, proxy_server="localhost:7778"):
-        self.driver = configure_webdriver(proxy_server)
+    def __init__(self, proxy_server="localhost:7778", signal_port=DEFAULT_SIGNAL_PORT, headless=False, authorizer=None):
+        self.driver = configure_webdriver(proxy_server, headless)
+        self.signal_port = signal_port
+        self.authorizer = authorizer if authorizer is not None else ManualAuthorizer()
         self.screenshot_path = "./intermediate_files/screenshot.png"
+        self.qrcode_found = threading.Event()
+        self.qrcode_data = None     # payload of the last QR code decoded from the page
+
+
+    def capture_qrcode(self, url, timeout=QR_WAIT_TIMEOUT):
+        """
+        Watch the page for QR codes while QRLogin is performed, sending each new payload to the addon.
+        Falls back to a manual screenshot when no QR code is decoded within timeout.
+        """
+        try:
+            self.driver.get(url)
+            stop = threading.Event()
+            watcher = threading.Thread(target=self.watch_qrcode, args=(stop,), daemon=True)
+            watcher.start()
+
+            if not self.qrcode_found.wait(timeout):
+                stop.set()
+                watcher.join()
+                print(f"No QR code decoded from the page in {timeout}s")
+                if self.authorizer.interactive:
+                    self.take_screenshot()
+                else:
+                    self.driver.save_screenshot(self.screenshot_path)
+
+            if not self.authorizer.authorize(self.driver, self.qrcode_data):
+                print("[ERROR] QRLogin was not authorized")
+            stop.set()
+            watcher.join()
+            send_signal("done", self.signal_port)
+
+            if self.authorizer.interactive:
+                input("\033[1;32mPress Enter to exit...\033[0m")
+            self.driver.quit()
+
+        except Exception as e:
+            print(f"Error when capturing QR code: {e}")
 
 
     def capture_screenshot(self, url):
         try:
             self.driver.get(url)
-            input("\033[1;32mWhen QR Code appears on the screen, press Enter to continue...\033[0m")
-            
-            window_handles = self.driver.window_handles
-            self.driver.switch_to.window(window_handles[-1])
-            
-            self.driver.save_screenshot(self.screenshot_path)
-            print(f"Screenshot captured: {self.screenshot_path}")
+            self.take_screenshot()
 
             input("\033[1;32mAfter finishing QRLogin, press Enter to start FLAW DETECTION...\033[0m")
-            with open('./intermediate_files/done_flag.txt', 'w') as f:
-                f.write('1')
+            send_signal("done", self.signal_port)
 
             input("\033[1;32mPress Enter to exit...\033[0m")
             self.driver.quit()
@@ -34,8 +72,52 @@ class QRCodeHandler:
             print(f"Error when capturing screenshot: {e}")
 
 
+    def take_screenshot(self):
+        input("\033[1;32mWhen QR Code appears on the screen, press Enter to continue...\033[0m")
+
+        window_handles = self.driver.window_handles
+        self.driver.switch_to.window(window_handles[-1])
+
+        self.driver.save_screenshot(self.screenshot_path)
+        print(f"Screenshot captured: {self.screenshot_path}")
+
+
+    def watch_qrcode(self, stop, poll_interval=QR_POLL_INTERVAL):
+        """
+        Scan the page until stop is set. Images are decoded again when they change,
+        so that a refreshed QR code (new qrid) is sent as well.
+        """
+        seen = {}       # candidate -> digest of its last image
+        payload = None
+        while not stop.is_set():
+            try:
+                for key, image in find_page_qrcode_images(self.driver):
+                    digest = hashlib.sha1(image).digest()
+                    if seen.get(key) == digest:
+                        continue
+                    seen[key] = digest
+
+                    decoded_data = decode_image(image)
+                    if decoded_data is None or decoded_data == payload:
+                        continue
+                    payload = decoded_data
+                    self.qrcode_data = decoded_data
+                    with open(self.screenshot_path, "wb") as f:
+                        f.write(image)
+                    print(f"QR code decoded from the page: {decoded_data}")
+                    send_signal("qrcode " + urllib.parse.quote(decoded_data, safe=''), self.signal_port)
+                    self.qrcode_found.set()
+            except Exception as e:
+                # the page may navigate or re-render while it is scanned
+                print(f"Error when scanning the page for QR codes: {e}")
+            stop.wait(poll_interval)
+
+
     @staticmethod
     def decode_qrcode(screenshot_path):
+        import cv2
+        from pyzbar.pyzbar import decode
+
         print(f"File {screenshot_path} prepared for decoding")
 
         image = cv2.imread(screenshot_path)
@@ -71,10 +153,24 @@ class QRCodeHandler:
 
     
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        url = sys.argv[1]
-        print("url:", url)
-        qrcode_handler = QRCodeHandler()
-        qrcode_handler.capture_screenshot(url)
+    parser = argparse.ArgumentParser(description="Open the QRLogin page and send the QR code and QRLogin signals to the addon")
+    parser.add_argument("url", help="login page of the target")
+    parser.add_argument("signal_port", nargs="?", type=int, default=DEFAULT_SIGNAL_PORT, help="signal port of the addon")
+    parser.add_argument("--manual", action="store_true", help="take a screenshot when Enter is pressed instead of watching the page for QR codes")
+    parser.add_argument("--qrcode-timeout", type=int, default=QR_WAIT_TIMEOUT, help="seconds to wait for a QR code before falling back to a manual screenshot")
+    parser.add_argument("--proxy-port", type=int, default=7778, help="port of the proxy running the addon")
+    parser.add_argument("--headless", action="store_true", help="run Chrome without a window")
+    parser.add_argument("--authorization", default=None, help="recorded app authorization request (captures/authorization_xxx.mitm) replayed instead of scanning the QR code with the app")
+    parser.add_argument("--authorizer-target", default=None, help="send the authorization request to this scheme://host:port (e.g. a local stand-in server) instead of through the proxy")
+    args = parser.parse_args()
+
+    print("url:", args.url)
+    proxy_server = f"localhost:{args.proxy_port}"
+    authorizer = None
+    if args.authorization is not None:
+        authorizer = ReplayAuthorizer(args.authorization, f"http://{proxy_server}", args.authorizer_target, args.qrcode_timeout)
+    qrcode_handler = QRCodeHandler(proxy_server, args.signal_port, args.headless, authorizer)
+    if args.manual:
+        qrcode_handler.capture_screenshot(args.url)
     else:
-        print("No url argument provided.")
\ No newline at end of file
+        qrcode_handler.capture_qrcode(args.url, args.qrcode_timeout)
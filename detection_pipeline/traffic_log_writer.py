@@ -0,0 +1,131 @@
+import gzip
+import queue
+import threading
+
+from mitmproxy.net import encoding
+from utils import *
+
+DEFAULT_MAX_BODY = 64 * 1024    # bytes of each body written to the traffic log
+
+
+class TrafficLogWriter:
+    '''
+    Writes the traffic log from a background thread.
+    The proxy hooks only enqueue a snapshot of the message; decoding, formatting and
+    writing happen in batches on the writer thread. When the queue is full, entries are dropped.
+    '''
+    def __init__(self, path, logger, max_queue=10000, batch_size=256, flush_interval=0.5, max_body=DEFAULT_MAX_BODY, compress=False):
+        self.path = path
+        self.logger = logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_body = max_body
+        self.compress = compress
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.num = 0
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+
+    def set_max_body(self, max_body):
+        self.max_body = max_body
+
+
+    def set_compress(self, compress):
+        self.compress = compress
+
+
+    def log_request(self, flow):
+        self.num += 1
+        request = flow.request
+        self.enqueue(("request", self.num, request.url, request.method, request.headers.fields,
+                      request.raw_content, request.headers.get("content-encoding"), request.headers.get("content-type", "")))
+
+
+    def log_response(self, flow):
+        response = flow.response
+        self.enqueue(("response", None, flow.request.url, None, response.headers.fields,
+                      response.raw_content, response.headers.get("content-encoding"), response.headers.get("content-type", "")))
+
+
+    def enqueue(self, entry):
+        self.start()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+
+    def run(self):
+        if self.compress:
+            f = gzip.open(self.path + ".gz", "at", encoding="utf-8")
+        else:
+            f = open(self.path, "a", encoding="utf-8")
+
+        with f:
+            while True:
+                try:
+                    batch = [self.queue.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    continue
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = None in batch
+                f.write("".join(self.format_entry(entry) for entry in batch if entry is not None))
+                f.flush()
+                if stop:
+                    break
+
+
+    def format_entry(self, entry):
+        kind, num, url, method, header_fields, raw, content_encoding, content_type = entry
+        if kind == "request":
+            lines = [f"\n[Request{num}]{url}\n", f"Method: {method}\n"]
+            self.logger.debug(f"[Request{num}] {method} {url}")
+        else:
+            lines = [f"\n[Response]\n{url}\n"]
+            self.logger.debug(f"[Response] {url}")
+
+        for k, v in header_fields:
+            lines.append(f"{k.decode('utf-8', 'replace')}: {v.decode('utf-8', 'replace')}\n")
+
+        if raw:
+            try:
+                content = encoding.decode(raw, content_encoding) if content_encoding else raw
+            except ValueError:
+                content = raw
+            truncated = len(content) > self.max_body
+            text = decode_content(content[:self.max_body], content_type)
+            if truncated:
+                text += f"...[{len(content) - self.max_body} bytes truncated]"
+            lines.append(f"Body:$$${text}$$$")
+        lines.append("\n\n\n\n")
+        return "".join(lines)
+
+
+    def close(self):
+        """
+        Write the queued entries and stop the writer thread
+        """
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.dropped:
+            self.logger.info(f"[LOG] {self.dropped} traffic log entries dropped")
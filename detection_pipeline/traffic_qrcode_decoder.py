@@ -0,0 +1,129 @@
+import base64
+import binascii
+import concurrent.futures
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from mitmproxy.net import encoding
+from qrcode_scanner import decode_image
+from utils import *
+
+QR_IMAGE_TYPES = ("image/png", "image/jpeg", "image/jpg", "image/gif", "image/bmp", "image/webp")
+QR_TEXT_TYPES = ("json", "text/", "javascript")
+MIN_QR_IMAGE = 100                  # bytes, smaller images are icons
+MAX_QR_IMAGE = 2 * 1024 * 1024      # bytes, larger images are photos
+# base64 images embedded in a body, as data URLs or as bare base64 PNG/JPEG (JSON may escape "/" as "\/")
+EMBEDDED_IMAGE_PATTERN = re.compile(rb'data:image/(?:png|jpe?g|gif|bmp|webp);base64,([A-Za-z0-9+/=\\]+)|"((?:iVBORw0KGgo|/9j/|\\/9j\\/)[A-Za-z0-9+/=\\]+)"')
+EMBEDDED_IMAGE_MARKERS = (b"data:image/", b"iVBORw0KGgo", b'"/9j/', b'"\\/9j\\/')
+
+
+def is_qrcode_source(content_type):
+    content_type = content_type.lower()
+    return any(t in content_type for t in QR_IMAGE_TYPES + QR_TEXT_TYPES)
+
+
+def find_qrcode_images(content_type, content):
+    '''
+    Images of a response body that may be a QR code: the body itself, or the base64 images embedded in it
+    '''
+    if not content:
+        return []
+    if any(t in content_type.lower() for t in QR_IMAGE_TYPES):
+        return [content] if MIN_QR_IMAGE <= len(content) <= MAX_QR_IMAGE else []
+    if not any(marker in content for marker in EMBEDDED_IMAGE_MARKERS):
+        return []
+
+    images = []
+    for match in EMBEDDED_IMAGE_PATTERN.finditer(content):
+        try:
+            image = base64.b64decode((match.group(1) or match.group(2)).replace(b"\\", b""))
+        except (binascii.Error, ValueError):
+            continue
+        if MIN_QR_IMAGE <= len(image) <= MAX_QR_IMAGE:
+            images.append(image)
+    return images
+
+
+def decode_message_qrcodes(message):
+    '''
+    Payloads of the QR codes carried by a response
+    '''
+    if message is None:
+        return []
+    images = find_qrcode_images(message.headers.get("Content-Type", ""), message.content)
+    return [decoded_data for decoded_data in map(decode_image, images) if decoded_data]
+
+
+class TrafficQRCodeDecoder:
+    '''
+    Decodes QR codes from responses in a worker pool as they arrive: image bodies and base64 images in JSON/HTML bodies.
+    The hooks only hand the raw body to the pool; each decoded payload is passed to on_decoded(decoded_data, flow_id).
+    '''
+    def __init__(self, on_decoded, logger, max_workers=2):
+        self.on_decoded = on_decoded
+        self.logger = logger
+        self.max_workers = max_workers
+        self.executor = None
+        self.futures = set()
+        self.decoded = {}       # digest -> payload of the images already decoded, e.g. the same QR code fetched twice
+        self.lock = threading.Lock()
+
+
+    def submit(self, flow):
+        response = flow.response
+        if response is None or not response.raw_content or not is_qrcode_source(response.headers.get("Content-Type", "")):
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="qrcode")
+            future = self.executor.submit(self.decode, flow.id, flow.request.url, response.headers.get("Content-Type", ""),
+                                          response.raw_content, response.headers.get("content-encoding"))
+            self.futures.add(future)
+        future.add_done_callback(self.discard)
+
+
+    def discard(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+
+    def decode(self, flow_id, url, content_type, raw, content_encoding):
+        try:
+            content = encoding.decode(raw, content_encoding) if content_encoding else raw
+        except ValueError:
+            return
+        for image in find_qrcode_images(content_type, content):
+            digest = hashlib.sha1(image).digest()
+            with self.lock:
+                known = digest in self.decoded
+                decoded_data = self.decoded.get(digest)
+            if not known:
+                try:
+                    decoded_data = decode_image(image)
+                except Exception as e:
+                    self.logger.info(f"[QRCODE] Cannot decode image of {url}: {e}")
+                    decoded_data = None
+                with self.lock:
+                    self.decoded[digest] = decoded_data
+                if decoded_data:
+                    self.logger.info(f"[QRCODE] QR code decoded from the response of {url}")
+            if decoded_data:
+                # an image served again is not decoded again, but every flow serving it is reported
+                self.on_decoded(decoded_data, flow_id)
+
+
+    def wait(self, timeout=None):
+        """
+        Wait for the images submitted so far to be decoded
+        """
+        with self.lock:
+            futures = list(self.futures)
+        concurrent.futures.wait(futures, timeout)
+
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
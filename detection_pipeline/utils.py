@@ -1,16 +1,15 @@
 import datetime
+import functools
 from http.cookies import SimpleCookie
 import os
 import re
 from urllib.parse import urlparse, parse_qsl
 import base64
 import json
-from urllib.parse import unquote
-import chardet
+from urllib.parse import unquote, quote
 
-import nltk
-from nltk.corpus import words
-import wordninja
+# chardet, nltk and wordninja are slow to import and only needed on some paths,
+# they are imported where used so that the addon starts proxying sooner
 
 
 def extract_para(decoded_data):
@@ -97,18 +96,34 @@ def parse_cookie(flow, flow_type):
     return cookie_dict
 
 
-def is_english_phrase(phrase):
+@functools.lru_cache(maxsize=1)
+def get_english_words():
     '''
-    Check if a phrase is composed of English words
+    The English lexicon, loaded once and shared by all calls
     '''
-    if not nltk.data.find('corpora/words'):
+    import nltk
+    from nltk.corpus import words
+
+    try:
+        nltk.data.find('corpora/words')
+    except LookupError:
         nltk.download('words')
-    if not nltk.data.find('tokenizers/punkt'):
-        nltk.download('punkt')
+    return frozenset(words.words())
 
-    words_set = set(words.words())
-    split_phrase = wordninja.split(phrase)
-    return all(word.lower() in words_set for word in split_phrase)
+
+@functools.lru_cache(maxsize=4096)
+def split_words(phrase):
+    import wordninja
+    return tuple(wordninja.split(phrase))
+
+
+@functools.lru_cache(maxsize=4096)
+def is_english_phrase(phrase):
+    '''
+    Check if a phrase is composed of English words
+    '''
+    words_set = get_english_words()
+    return all(word.lower() in words_set for word in split_words(phrase))
 
 
 def flatten_nested_dict(nested_dict):
@@ -132,16 +147,57 @@ def remove_params_from_url(url):
     return parsed_url.scheme + "://" + parsed_url.netloc + parsed_url.path
 
 
-def decode_content(content):
+OFFLINE_PREFIX = "offline_"     # offline analysis keeps its artifacts apart from those of the live run
+
+
+def artifact_name(url, live=True):
+    '''
+    Name of the logs, blobs, results and reports of a url
+    '''
+    return ("" if live else OFFLINE_PREFIX) + quote(url, safe='')
+
+
+CHARSET_PATTERN = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+DETECT_SAMPLE_SIZE = 4096   # bytes given to chardet, which is slow on large bodies
+
+
+def get_charset(content_type):
+    '''
+    Get the charset declared in a Content-Type header, if any
+    '''
+    match = CHARSET_PATTERN.search(content_type or "")
+    if match is None:
+        return None
+    charset = match.group(1).lower()
+    if charset in ["gb2312", "gbk"]:      # same as mitmproxy: GB 18030 is the superset of both
+        return "gb18030"
+    return charset
+
+
+def decode_content(content, content_type=""):
+    '''
+    Decode a body: declared charset first, then UTF-8, and only then charset detection on a sample
+    '''
     if content is None:
         return ''
-    encoding = chardet.detect(content)['encoding']
+    charset = get_charset(content_type)
+    if charset is not None:
+        try:
+            return content.decode(charset)
+        except (UnicodeDecodeError, LookupError):
+            pass
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    import chardet
+    encoding = chardet.detect(content[:DETECT_SAMPLE_SIZE])['encoding']
     if encoding is not None:
         try:
             return content.decode(encoding)
-        except UnicodeDecodeError:
+        except (UnicodeDecodeError, LookupError):
             pass
-    encodings = ['utf-8', 'gbk', 'latin1', 'ascii'] 
+    encodings = ['gbk', 'latin1'] 
     for encoding in encodings:
         try:
             return content.decode(encoding)
@@ -150,6 +206,13 @@ def decode_content(content):
     raise ValueError('Unable to decode content' + str(content))
 
 
+def decode_message(message):
+    '''
+    Decode the body of a request/response according to its Content-Type
+    '''
+    return decode_content(message.content, message.headers.get('Content-Type', ''))
+
+
 def parse_content(flow):    
     '''
     Parse content of request/response
@@ -157,7 +220,14 @@ def parse_content(flow):
     
     content_type = flow.headers.get('Content-Type', '')
 
-    content = decode_content(flow.content)
+    content = decode_message(flow)
+    return parse_text(content_type, content)
+
+
+def parse_text(content_type, content):
+    '''
+    Parse decoded content according to its content type
+    '''
     if not content:
         return dict()
     if 'application/x-www-form-urlencoded' in content_type:
@@ -192,68 +262,145 @@ def remove_parenthesis(content):
         return content
     
 
+class ParsedFlow:
+    '''
+    Parsed view of the request/response of a flow, computed once and shared by the helpers
+    '''
+    __slots__ = ("url", "query", "headers", "headers_str", "cookie_dict",
+                 "text", "content_dict", "flatten_dict", "content_items", "flatten_items")
+
+    def __init__(self, flow, flow_type):
+        message = flow.request if flow_type == "request" else flow.response
+
+        self.url = str(flow.request.url)
+        self.query = []
+        if flow_type == "request":
+            self.query = [(k, str(v)) for k, v in flow.request.query.items()]
+
+        self.headers = []
+        self.headers_str = ""
+        self.cookie_dict = {}
+        self.text = ""
+        self.content_dict = {}
+        if message is not None:
+            self.headers = list(message.headers.items())
+            self.headers_str = str(message.headers)
+            self.cookie_dict = parse_cookie(flow, flow_type)
+            if message.content:
+                self.text = decode_message(message)
+                self.content_dict = parse_text(message.headers.get('Content-Type', ''), self.text)
+
+        self.flatten_dict = {}
+        self.content_items = []
+        self.flatten_items = []
+        if isinstance(self.content_dict, dict):
+            self.flatten_dict = flatten_nested_dict(self.content_dict)
+            self.content_items = [(k, str(v), unquote(str(v))) for k, v in self.content_dict.items()]
+            self.flatten_items = [(k, str(v), unquote(str(v))) for k, v in self.flatten_dict.items()]
+
+
+    def size(self):
+        """
+        Approximate characters held by the view, counted in the memory budget of the flow store
+        """
+        items = sum(len(str(k)) + len(v) + len(unquoted_v) for k, v, unquoted_v in self.content_items + self.flatten_items)
+        return len(self.url) + len(self.headers_str) + len(self.text) + items
+
+
+parsed_flows = {}
+
+def get_parsed_flow(flow, flow_type):
+    '''
+    Get the parsed view of the request/response of a flow, parsing it on first use
+    '''
+    key = (flow.id, flow_type)
+    parsed = parsed_flows.get(key)
+    if parsed is None:
+        parsed = ParsedFlow(flow, flow_type)
+        message = flow.request if flow_type == "request" else flow.response
+        if message is not None and getattr(message, "resident", True):    # spilled bodies of recorded flows are parsed on demand
+            parsed_flows[key] = parsed
+    return parsed
+
+
+def invalidate_parsed_flow(flow, flow_type=None):
+    '''
+    Drop the parsed views of a flow after it is mutated (e.g. for replay)
+    '''
+    for t in ["request", "response"]:
+        if flow_type is None or flow_type == t:
+            parsed_flows.pop((flow.id, t), None)
+
+
 def search(flow, flow_type, keyword):
     '''
     Search keyword in flow (request/response)
         if found, return the parameter name/ "inBody"
     '''
+    parsed = get_parsed_flow(flow, flow_type)
+
     if flow_type == "request":
-        for k, v in flow.request.query.items():
-            if keyword == str(v):
+        for k, v in parsed.query:
+            if keyword == v:
                 return k
-        if keyword in str(flow.request.url):
+        if keyword in parsed.url:
             return "noName"
         
-        if flow.request.content:
-            content_dict = parse_content(flow.request)
-            if isinstance(content_dict, dict):
-                for k, v in content_dict.items():
-                    if keyword in str(v):
-                        return k
-                    elif keyword in str(unquote(str(v))):
-                        return k
+        for k, v, unquoted_v in parsed.content_items:
+            if keyword in v:
+                return k
+            elif keyword in unquoted_v:
+                return k
                     
-        for k, v in flow.request.headers.items():
+        for k, v in parsed.headers:
             if k.lower() in ['cookie', 'set-cookie']:
                 continue
             if keyword in str(v):
                 return k
             
-        cookie_dict = parse_cookie(flow, flow_type)
-        for key, value in cookie_dict.items():
+        for key, value in parsed.cookie_dict.items():
             if str(value) == str(keyword):
                 return key
 
     if flow_type == "response":
-        if flow.response.content:
-            content_dict = parse_content(flow.response)
-
-            if isinstance(content_dict, dict):
-                flatten_dict = flatten_nested_dict(content_dict)
-                for k, v in flatten_dict.items():
-                    if keyword == str(v):
-                        return k
-                    elif keyword == str(unquote(str(v))):
-                        return k
-                for k, v in flatten_dict.items():
-                    if keyword in str(v):
-                        return k
-                    elif keyword in str(unquote(str(v))):
-                        return k
+        for k, v, unquoted_v in parsed.flatten_items:
+            if keyword == v:
+                return k
+            elif keyword == unquoted_v:
+                return k
+        for k, v, unquoted_v in parsed.flatten_items:
+            if keyword in v:
+                return k
+            elif keyword in unquoted_v:
+                return k
         
-        for k, v in flow.response.headers.items():
+        for k, v in parsed.headers:
             if keyword == str(v):
                 return k
             
-        for k, v in flow.response.headers.items():
+        for k, v in parsed.headers:
             if keyword in str(v):
-                cookie_dict = parse_cookie(flow, "response")
-                for key, value in cookie_dict.items():
+                for key, value in parsed.cookie_dict.items():
                     if keyword == str(value):
                         return key
                 return k
     return ""
 
+
+def field_value(flow, name):
+    '''
+    Value of a query param, body field or cookie of a request, None if the request has no such field
+    '''
+    parsed = get_parsed_flow(flow, "request")
+    for k, v in parsed.query:
+        if k == name:
+            return v
+    for k, v, unquoted_v in parsed.content_items:
+        if k == name:
+            return v
+    return parsed.cookie_dict.get(name)
+
+
 def is_timestamp(s):
         if s is None:
             return False
@@ -271,10 +418,3 @@ def is_timestamp(s):
                 return True
         except ValueError:
             return False
-        
-
-def is_login_done():
-    if os.path.exists('./intermediate_files/done_flag.txt'):
-        return True
-    return False
-